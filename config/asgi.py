@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from helpdesk.API.event_stream import TicketEventStream  # noqa: E402
+
+application = TicketEventStream(django_application)
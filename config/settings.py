@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from django.urls import reverse_lazy
@@ -41,6 +42,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'helpdesk.middlewares.RequestInstrumentation',
     'helpdesk.middlewares.AutoLogout',
     'helpdesk.middlewares.CounterUserAction',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -115,9 +117,22 @@ REST_FRAMEWORK = {
     'DATETIME_FORMAT': '%d-%m-%Y %H:%M',
 }
 
-CACHES = {
+# 'redis' uses the Redis server below, 'locmem' keeps the cache in process memory
+# so the project can run and be tested without Redis.
+CACHE_BACKEND = os.environ.get('HELPDESK_CACHE_BACKEND', 'redis')
+
+# Request instrumentation: per-view latency, query, cache and response size
+# histograms served at /api/metrics/ and logging of slow requests. Enable it
+# with HELPDESK_METRICS=on.
+METRICS_ENABLED = os.environ.get('HELPDESK_METRICS', 'off') == 'on'
+
+METRICS_SLOW_REQUEST_BUDGET = float(os.environ.get('HELPDESK_SLOW_REQUEST_BUDGET', 0.5))
+
+METRICS_SLOW_QUERY_LOG_LIMIT = 50
+
+REDIS_CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
+        "BACKEND": "helpdesk.metrics.InstrumentedRedisCache" if METRICS_ENABLED else "django_redis.cache.RedisCache",
         "LOCATION": "redis://127.0.0.1:6379/1",
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient"
@@ -126,6 +141,28 @@ CACHES = {
     }
 }
 
+LOCMEM_CACHES = {
+    "default": {
+        "BACKEND": "helpdesk.metrics.InstrumentedLocMemCache" if METRICS_ENABLED else
+                   "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "helpdesk",
+    }
+}
+
+CACHES = LOCMEM_CACHES if CACHE_BACKEND == 'locmem' else REDIS_CACHES
+
+# 'db' stores sessions in the database only, 'cached_db' reads them from the cache
+# and writes through to the database, 'cache' stores them in the cache only.
+SESSION_MODE = os.environ.get('HELPDESK_SESSION_MODE', 'cached_db')
+
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+}
+
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.1/topics/i18n/
 
@@ -150,6 +187,87 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 INACTIVITY_TIME_LIMIT = 60
 
+# 'session' keeps activity data in the session, 'cache' keeps it in the cache
+# and writes the activity time at most once per ACTIVITY_WRITE_INTERVAL seconds.
+ACTIVITY_TRACKING = 'cache'
+
+ACTIVITY_WRITE_INTERVAL = 10
+
 TOKEN_EXPIRATION_TIME = 60 * 60
 
+# Cached token principals and activity times are dropped after this many idle seconds.
+TOKEN_CACHE_TIMEOUT = 60 * 60 * 24
+
+TICKETS_PER_PAGE = 20
+
+COMMENTS_PER_PAGE = 20
+
+TICKET_CACHE_TIMEOUT = 60 * 60 * 24
+
+BULK_STATUS_CHANGE_LIMIT = 500
+
+STATS_USERS_LIMIT = 50
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_API_LIMIT = 5000
+
 FILTERS_EMPTY_CHOICE_LABEL = 'select an option...'
+
+SEARCH_BACKEND = 'helpdesk.search.SQLiteSearchBackend'
+
+SEARCH_RESULTS_LIMIT = 200
+
+# Broker behind the ticket event stream: Redis pub/sub shares events between
+# processes, the local broker only reaches subscribers of the same process.
+EVENT_BROKER = 'helpdesk.events.LocalEventBroker' if CACHE_BACKEND == 'locmem' else 'helpdesk.events.RedisEventBroker'
+
+EVENT_BROKER_URL = REDIS_CACHES['default']['LOCATION']
+
+EVENT_QUEUE_SIZE = 100
+
+EVENT_STREAM_KEEPALIVE = 15
+
+# Queue of background jobs such as search indexing and stats counters: Redis
+# lists shared by all worker processes, or a database table when running
+# without Redis.
+TASK_QUEUE_BACKEND = 'helpdesk.tasks.DatabaseTaskQueue' if CACHE_BACKEND == 'locmem' else \
+    'helpdesk.tasks.RedisTaskQueue'
+
+TASK_QUEUE_URL = REDIS_CACHES['default']['LOCATION']
+
+TASK_MAX_ATTEMPTS = 5
+
+# Seconds before the first retry of a failed job, doubled on every further attempt.
+TASK_RETRY_DELAY = 10
+
+TASK_POLL_INTERVAL = 1
+
+EMAIL_HOST = os.environ.get('HELPDESK_EMAIL_HOST', 'localhost')
+
+EMAIL_PORT = int(os.environ.get('HELPDESK_EMAIL_PORT', 25))
+
+DEFAULT_FROM_EMAIL = os.environ.get('HELPDESK_FROM_EMAIL', 'helpdesk@localhost')
+
+# Ticket authors are notified of status changes and comments made by staff.
+# Notifications are collected per recipient and sent as one digest once the
+# oldest of them is NOTIFICATION_DIGEST_WINDOW seconds old.
+NOTIFICATION_SENDERS = {
+    'email': 'helpdesk.notifications.EmailSender',
+    'webhook': 'helpdesk.notifications.WebhookSender',
+}
+
+NOTIFICATION_SENDER = NOTIFICATION_SENDERS[os.environ.get('HELPDESK_NOTIFICATION_SENDER', 'email')]
+
+NOTIFICATION_WEBHOOK_URL = os.environ.get('HELPDESK_NOTIFICATION_WEBHOOK_URL', '')
+
+NOTIFICATION_WEBHOOK_TIMEOUT = 10
+
+NOTIFICATION_DIGEST_WINDOW = int(os.environ.get('HELPDESK_NOTIFICATION_DIGEST_WINDOW', 5 * 60))
+
+# Digests sent over one SMTP or HTTP connection.
+NOTIFICATION_BATCH_SIZE = 100
@@ -0,0 +1,118 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from rest_framework.exceptions import APIException, NotAuthenticated, MethodNotAllowed, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from helpdesk.API.authentication import CustomTokenAuthentication
+from helpdesk.API.pagination import TicketCursorPagination
+from helpdesk.API.resourses import TicketViewSet, comments_prefetch, comment_count_subquery, \
+    filter_visible_tickets, can_see_cached_ticket, expand_comments
+from helpdesk.API.serializers import TicketListSerializer, TicketGetOrCreateSerializer, CommentSerializer
+from helpdesk.cache import aget_cached_ticket_data, aset_cached_ticket_data
+from helpdesk.models import Ticket, Comment
+
+
+class AsyncTicketView:
+    filter_backends = TicketViewSet.filter_backends
+    search_fields = TicketViewSet.search_fields
+    ordering_fields = TicketViewSet.ordering_fields
+    ordering = TicketViewSet.ordering
+
+    def filter_queryset(self, request, queryset):
+        for backend in self.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, self)
+        return queryset
+
+
+def async_api_view(methods):
+    def decorator(view_func):
+
+        @wraps(view_func)
+        async def wrapped_view(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise MethodNotAllowed(request.method)
+
+                authentication = await CustomTokenAuthentication().aauthenticate(request)
+                if authentication is None:
+                    raise NotAuthenticated()
+
+                api_request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+                api_request.user, api_request.auth = authentication
+                return await view_func(api_request, *args, **kwargs)
+
+            except APIException as exc:
+                detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                return JsonResponse(detail, status=exc.status_code, encoder=JSONEncoder, safe=False)
+
+        wrapped_view.csrf_exempt = True
+        return wrapped_view
+
+    return decorator
+
+
+def get_visible_tickets(user):
+    return filter_visible_tickets(Ticket.objects.exclude(status=Ticket.RESTORED_STATUS), user)
+
+
+@async_api_view(['GET'])
+async def ticket_list(request):
+    view = AsyncTicketView()
+    expand = expand_comments(request)
+    queryset = get_visible_tickets(request.user).select_related('user')
+    if expand:
+        queryset, serializer_class = queryset.prefetch_related(comments_prefetch()), TicketGetOrCreateSerializer
+    else:
+        queryset, serializer_class = queryset.defer('description')\
+            .annotate(comment_count=comment_count_subquery()), TicketListSerializer
+    # Full-text search reads its index while filtering, a sync query.
+    queryset = await sync_to_async(view.filter_queryset)(request, queryset)
+
+    paginator = TicketCursorPagination()
+    if expand:
+        # aiterator() does not support prefetch_related().
+        page = await sync_to_async(paginator.paginate_queryset)(queryset, request, view)
+    else:
+        page = await paginator.apaginate_queryset(queryset, request, view)
+    serializer = serializer_class(page, many=True, context={'request': request})
+    return JsonResponse({
+        'next': paginator.get_next_link(),
+        'previous': paginator.get_previous_link(),
+        **paginator.get_search_fields(),
+        'results': serializer.data,
+    }, encoder=JSONEncoder)
+
+
+@async_api_view(['GET'])
+async def ticket_detail(request, pk):
+    user = request.user
+    version, cached_data = await aget_cached_ticket_data(pk)
+    if cached_data is not None and can_see_cached_ticket(user, cached_data):
+        return JsonResponse(cached_data['ticket'], encoder=JSONEncoder)
+
+    queryset = get_visible_tickets(user).select_related('user').prefetch_related(comments_prefetch())
+    try:
+        ticket = await queryset.aget(pk=pk)
+    except Ticket.DoesNotExist:
+        raise NotFound()
+
+    serializer = TicketGetOrCreateSerializer(ticket, context={'request': request})
+    await aset_cached_ticket_data(pk, version, {
+        'user_id': ticket.user_id,
+        'status': ticket.status,
+        'ticket': serializer.data,
+    })
+    return JsonResponse(serializer.data, encoder=JSONEncoder)
+
+
+@async_api_view(['POST'])
+async def comment_create(request):
+    serializer = CommentSerializer(data=request.data, context={'request': request})
+    # Validation looks the ticket up through the serializer's related field, a sync query.
+    await sync_to_async(serializer.is_valid)(raise_exception=True)
+    comment = await Comment.objects.acreate(author=request.user, **serializer.validated_data)
+    return JsonResponse(CommentSerializer(comment).data, status=201, encoder=JSONEncoder)
@@ -1,33 +1,220 @@
+import asyncio
+from weakref import WeakKeyDictionary
+
 from django.core.cache import cache
 from django.utils import timezone
-from rest_framework.authentication import TokenAuthentication
+from redis import asyncio as aioredis
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
 
-from config.settings import TOKEN_EXPIRATION_TIME
+from config.settings import TOKEN_EXPIRATION_TIME, TOKEN_CACHE_TIMEOUT
+from helpdesk.models import CustomUser
+
+
+class TokenPrincipalCache:
+    key_prefix = 'auth-token'
+    async_clients = WeakKeyDictionary()
+    async_connection_classes = {
+        'Connection': aioredis.Connection,
+        'SSLConnection': aioredis.SSLConnection,
+        'UnixDomainSocketConnection': aioredis.UnixDomainSocketConnection,
+    }
+    user_fields = ['id', 'username', 'first_name', 'last_name', 'email', 'is_active', 'is_staff', 'is_superuser']
+
+    def get_key(self, key):
+        return f'{self.key_prefix}:{key}'
+
+    def get_redis_key(self, key):
+        return cache.client.make_key(self.get_key(key))
+
+    def uses_redis(self):
+        return hasattr(cache, 'client') and hasattr(cache.client, 'get_client')
+
+    def get_user_data(self, user):
+        return {field: getattr(user, field) for field in self.user_fields}
+
+    def queue_touch(self, pipeline, key, time_now):
+        redis_key = self.get_redis_key(key)
+        pipeline.hmget(redis_key, 'user', 'last_activity')
+        pipeline.hset(redis_key, 'last_activity', cache.client.encode(time_now))
+        pipeline.expire(redis_key, TOKEN_CACHE_TIMEOUT)
+
+    def read_touch(self, results):
+        (user_data, last_activity), _, _ = results
+        return [cache.client.decode(value) if value is not None else None for value in (user_data, last_activity)]
+
+    def queue_set_user(self, pipeline, key, user):
+        redis_key = self.get_redis_key(key)
+        pipeline.hset(redis_key, 'user', cache.client.encode(self.get_user_data(user)))
+        pipeline.expire(redis_key, TOKEN_CACHE_TIMEOUT)
+
+    def build_principal(self, user_data, last_activity, time_now):
+        user = self.build_user(user_data) if user_data is not None else None
+        return user, last_activity or time_now
+
+    def touch(self, key, time_now):
+        """
+        Return the cached user and the previous activity time of the token
+        and store time_now as its new activity time in one round trip.
+        """
+        if self.uses_redis():
+            pipeline = cache.client.get_client(write=True).pipeline()
+            self.queue_touch(pipeline, key, time_now)
+            user_data, last_activity = self.read_touch(pipeline.execute())
+        else:
+            principal = cache.get(self.get_key(key), {})
+            user_data, last_activity = principal.get('user'), principal.get('last_activity')
+            cache.set(self.get_key(key), {'user': user_data, 'last_activity': time_now}, TOKEN_CACHE_TIMEOUT)
+        return self.build_principal(user_data, last_activity, time_now)
+
+    def set_user(self, key, user):
+        if self.uses_redis():
+            pipeline = cache.client.get_client(write=True).pipeline()
+            self.queue_set_user(pipeline, key, user)
+            pipeline.execute()
+        else:
+            principal = cache.get(self.get_key(key), {})
+            cache.set(self.get_key(key), {**principal, 'user': self.get_user_data(user)}, TOKEN_CACHE_TIMEOUT)
+
+    def forget_user(self, *keys):
+        """
+        Drop the cached user of the tokens but keep their activity time, so
+        saving the user does not restart the expiration of their tokens.
+        """
+        if self.uses_redis():
+            pipeline = cache.client.get_client(write=True).pipeline()
+            for key in keys:
+                pipeline.hdel(self.get_redis_key(key), 'user')
+            pipeline.execute()
+            return
+
+        for key in keys:
+            principal = cache.get(self.get_key(key))
+            if principal is not None:
+                principal['user'] = None
+                cache.set(self.get_key(key), principal, TOKEN_CACHE_TIMEOUT)
+
+    def delete(self, *keys):
+        cache.delete_many([self.get_key(key) for key in keys])
+
+    def build_user(self, user_data):
+        field_names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in user_data]
+        return CustomUser.from_db('default', field_names, [user_data[name] for name in field_names])
+
+    def get_async_client(self):
+        """
+        A redis.asyncio client per event loop, connecting with the address,
+        credentials and pool size of the pool behind the sync cache client.
+        Values are encoded by the sync client, so they use its serializer.
+        """
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            pool = cache.client.get_client(write=True).connection_pool
+            connection_kwargs = {name: value for name, value in pool.connection_kwargs.items()
+                                 if name != 'parser_class'}
+            client = aioredis.Redis(connection_pool=aioredis.ConnectionPool(
+                connection_class=self.async_connection_classes[pool.connection_class.__name__],
+                max_connections=pool.max_connections,
+                **connection_kwargs,
+            ))
+            self.async_clients[loop] = client
+        return client
+
+    async def atouch(self, key, time_now):
+        if self.uses_redis():
+            async with self.get_async_client().pipeline() as pipeline:
+                self.queue_touch(pipeline, key, time_now)
+                user_data, last_activity = self.read_touch(await pipeline.execute())
+        else:
+            principal = await cache.aget(self.get_key(key), {})
+            user_data, last_activity = principal.get('user'), principal.get('last_activity')
+            await cache.aset(self.get_key(key), {'user': user_data, 'last_activity': time_now}, TOKEN_CACHE_TIMEOUT)
+        return self.build_principal(user_data, last_activity, time_now)
+
+    async def aset_user(self, key, user):
+        if self.uses_redis():
+            async with self.get_async_client().pipeline() as pipeline:
+                self.queue_set_user(pipeline, key, user)
+                await pipeline.execute()
+        else:
+            principal = await cache.aget(self.get_key(key), {})
+            await cache.aset(self.get_key(key), {**principal, 'user': self.get_user_data(user)}, TOKEN_CACHE_TIMEOUT)
+
+    async def adelete(self, *keys):
+        await cache.adelete_many([self.get_key(key) for key in keys])
+
+
+token_cache = TokenPrincipalCache()
 
 
 class CustomTokenAuthentication(TokenAuthentication):
 
     def authenticate_credentials(self, key):
-        try:
-            token = Token.objects.get(key=key)
-        except Token.DoesNotExist:
-            raise AuthenticationFailed('Invalid token.')
+        time_now = timezone.now()
+        user, last_activity_time = token_cache.touch(key, time_now)
+
+        if user is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                token_cache.delete(key)
+                raise AuthenticationFailed('Invalid token.')
+            user = token.user
+            token_cache.set_user(key, user)
 
-        if not token.user.is_active:
+        if not user.is_active:
             raise AuthenticationFailed('User inactive or deleted.')
 
-        if not token.user.is_staff:
-            time_now = timezone.now()
-            last_activity_time = cache.get(key, time_now)
+        if not user.is_staff:
             inactivity_period = time_now - last_activity_time
 
-            if inactivity_period.seconds > TOKEN_EXPIRATION_TIME:
-                token.delete()
-                cache.delete(key)
+            if inactivity_period.total_seconds() > TOKEN_EXPIRATION_TIME:
+                Token.objects.filter(key=key).delete()
+                token_cache.delete(key)
                 raise AuthenticationFailed('Token has expired.')
 
-            cache.set(key, time_now)
+        return user, Token(key=key, user=user)
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        time_now = timezone.now()
+        user, last_activity_time = await token_cache.atouch(key, time_now)
+
+        if user is None:
+            try:
+                token = await Token.objects.select_related('user').aget(key=key)
+            except Token.DoesNotExist:
+                await token_cache.adelete(key)
+                raise AuthenticationFailed('Invalid token.')
+            user = token.user
+            await token_cache.aset_user(key, user)
+
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+
+        if not user.is_staff:
+            inactivity_period = time_now - last_activity_time
+
+            if inactivity_period.total_seconds() > TOKEN_EXPIRATION_TIME:
+                await Token.objects.filter(key=key).adelete()
+                await token_cache.adelete(key)
+                raise AuthenticationFailed('Token has expired.')
 
-        return token.user, token
+        return user, Token(key=key, user=user)
@@ -0,0 +1,115 @@
+import asyncio
+import json
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import AuthenticationFailed
+
+from config.settings import EVENT_STREAM_KEEPALIVE
+from helpdesk.API.authentication import CustomTokenAuthentication
+from helpdesk.events import get_event_broker
+
+
+class TicketEventStream:
+    """
+    ASGI application that serves ticket events as Server-Sent Events on
+    `path` and passes every other request to the wrapped application.
+
+    Clients authenticate with a token header or the session cookie. Staff
+    receive events of all tickets, users only those of their own tickets;
+    `?ticket=<id>` narrows the stream down to one ticket.
+    """
+
+    def __init__(self, application, path='/api/events/'):
+        self.application = application
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == self.path:
+            return await self.stream(scope, receive, send)
+        return await self.application(scope, receive, send)
+
+    async def authenticate(self, request):
+        try:
+            authentication = await CustomTokenAuthentication().aauthenticate(request)
+        except AuthenticationFailed:
+            return None
+        if authentication is not None:
+            return authentication[0]
+
+        session_key = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session_key is None:
+            return None
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        user = await sync_to_async(get_user)(request)
+        return user if user.is_authenticated else None
+
+    def is_visible(self, event, user, ticket_id):
+        if ticket_id is not None and event['ticket_id'] != ticket_id:
+            return False
+        return user.is_staff or event['user_id'] == user.id
+
+    async def stream(self, scope, receive, send):
+        request = ASGIRequest(scope, None)
+        user = await self.authenticate(request)
+        if user is None:
+            return await self.send_response(send, 401, {'detail': 'Authentication credentials were not provided.'})
+
+        ticket_id = request.GET.get('ticket')
+        if ticket_id is not None and not ticket_id.isdigit():
+            return await self.send_response(send, 400, {'ticket': 'A valid integer is required.'})
+        ticket_id = int(ticket_id) if ticket_id is not None else None
+
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        async with get_event_broker().subscribe() as queue:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+
+            next_event = asyncio.ensure_future(queue.get())
+            try:
+                while True:
+                    done, _ = await asyncio.wait({next_event, disconnect},
+                                                 timeout=EVENT_STREAM_KEEPALIVE,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if disconnect in done:
+                        break
+                    if next_event not in done:
+                        await self.send_body(send, b': keepalive\n\n')
+                        continue
+
+                    event = next_event.result()
+                    next_event = asyncio.ensure_future(queue.get())
+                    if self.is_visible(event, user, ticket_id):
+                        data = json.dumps(event, cls=DjangoJSONEncoder)
+                        await self.send_body(send, f'event: {event["event"]}\ndata: {data}\n\n'.encode())
+            finally:
+                next_event.cancel()
+                disconnect.cancel()
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def send_body(self, send, body):
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    async def send_response(self, send, status, data):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json')],
+        })
+        await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
@@ -1,6 +1,8 @@
 from django.db.models import Q
 from rest_framework import filters, serializers
 
+from helpdesk.search import get_search_backend
+
 
 class StatusPriorityFilter(filters.BaseFilterBackend):
     statuses = {
@@ -33,3 +35,14 @@ class StatusPriorityFilter(filters.BaseFilterBackend):
                 })
             queryset = queryset.filter(Q(status__in=status) & Q(priority__in=priority))
         return queryset
+
+
+class FullTextSearchFilter(filters.BaseFilterBackend):
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        if query:
+            queryset, view.search_truncated = get_search_backend().filter_queryset(queryset, query)
+            queryset = queryset.order_by('search_rank')
+        return queryset
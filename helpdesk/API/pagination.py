@@ -0,0 +1,156 @@
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.response import Response
+
+from config.settings import COMMENTS_PER_PAGE, SEARCH_RESULTS_LIMIT
+
+
+class TicketCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-created', '-id')
+    keyset_ordering = ('-created', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get('ordering'):
+            ordering = ['search_rank']
+        else:
+            ordering = list(super().get_ordering(request, queryset, view))
+        ordering_fields = [field.lstrip('-') for field in ordering]
+        for field in self.keyset_ordering:
+            if field.lstrip('-') not in ordering_fields:
+                ordering.append(field)
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([instance async for instance in queryset.aiterator()])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        # Set on the view by FullTextSearchFilter.
+        self.search_truncated = getattr(view, 'search_truncated', None)
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        if self.cursor is None:
+            self.reverse, self.position = False, None
+        else:
+            self.reverse, self.position = self.cursor.reverse, self.decode_position(queryset, self.cursor.position)
+
+        ordering = self.reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, self.position))
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        self.page = results[:self.page_size]
+        has_following = len(results) > self.page_size
+
+        if self.reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = self.position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.position is not None
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            *self.get_search_fields().items(),
+            ('results', data),
+        ]))
+
+    def get_search_fields(self):
+        """Full-text search keeps at most SEARCH_RESULTS_LIMIT tickets, say when it dropped some."""
+        if self.search_truncated is None:
+            return {}
+        return {'search_limit': SEARCH_RESULTS_LIMIT, 'search_truncated': self.search_truncated}
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self.encode_position(self.page[-1])
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self.encode_position(self.page[0])
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return json.dumps(values, separators=(',', ':'))
+
+    def decode_position(self, queryset, position):
+        if position is None:
+            return None
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.get_field_value(queryset, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def get_field_value(queryset, field_name, value):
+        if field_name in queryset.query.annotations:
+            return value
+        return queryset.model._meta.get_field(field_name).to_python(value)
+
+    @staticmethod
+    def reverse_ordering(ordering):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+    @staticmethod
+    def get_keyset_filter(ordering, position):
+        keyset_filter = Q()
+        equal_filter = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            keyset_filter |= equal_filter & Q(**{f'{name}__{lookup}': value})
+            equal_filter &= Q(**{name: value})
+        return keyset_filter
+
+
+class CommentCursorPagination(TicketCursorPagination):
+    """
+    Pages through the comments of a ticket from the newest one, `after`
+    holds the cursor of the next, older page.
+    """
+    cursor_query_param = 'after'
+    page_size = COMMENTS_PER_PAGE
+    max_page_size = 100
@@ -1,15 +1,82 @@
+from collections import Counter
+
 from django.db import transaction
-from rest_framework import viewsets
-from rest_framework.decorators import action
+from django.db.models import Prefetch, OuterRef, Subquery, Count
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import viewsets, status
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 
-from helpdesk.API.filters import StatusPriorityFilter
+from helpdesk.API.filters import StatusPriorityFilter, FullTextSearchFilter
+from helpdesk.API.pagination import TicketCursorPagination, CommentCursorPagination
 from helpdesk.API.permissions import IsUserOrAdminReadOnly
 from helpdesk.API.serializers import RegistrationSerializer, TicketUpdateSerializer, CommentSerializer,\
-    TicketGetOrCreateSerializer, ChangeTicketStatusSerializer
-from helpdesk.models import CustomUser, Ticket, Comment
+    TicketGetOrCreateSerializer, ChangeTicketStatusSerializer, TicketListSerializer, BulkChangeTicketStatusSerializer,\
+    TimeInStatusSerializer, BulkImportTicketSerializer
+from helpdesk.cache import get_cached_ticket_data, set_cached_ticket_data, bump_ticket_version
+from helpdesk.events import publish_event, ticket_event, comment_event, TICKET_STATUS
+from helpdesk.export import export_tickets, EXPORT_FORMATS, EXPORT_RESOURCES
+from helpdesk.importer import TicketImporter, IMPORT_READERS
+from helpdesk.metrics import registry, PROMETHEUS_CONTENT_TYPE
+from helpdesk.models import CustomUser, Ticket, Comment, TicketStatusEvent
+from helpdesk.notifications import status_notification, record_notifications
+from helpdesk.search import index_comments
+from helpdesk.stats import count_ticket_changes, get_ticket_stats, get_time_in_status
+from helpdesk.tasks import enqueue
+from helpdesk.transitions import apply_transition, set_status, claim_ticket, TransitionConflict, DELETE_TICKET,\
+    COMMENT_TOPICS, CONFLICT_ERROR
+
+
+def comments_prefetch():
+    return Prefetch('comments', queryset=Comment.objects.select_related('author'))
+
+
+def comment_count_subquery():
+    comment_count = Comment.objects.filter(ticket=OuterRef('pk')).order_by()\
+        .values('ticket').annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(comment_count), 0)
+
+
+def filter_visible_tickets(queryset, user):
+    if not user.is_staff:
+        return queryset.filter(user=user)
+    return queryset
+
+
+def can_see_cached_ticket(user, cached_data):
+    """The check of filter_visible_tickets on a cached ticket, which must not be restored."""
+    if cached_data['status'] == Ticket.RESTORED_STATUS:
+        return False
+    return user.is_staff or cached_data['user_id'] == user.id
+
+
+def expand_comments(request):
+    expand = request.query_params.get('expand', '')
+    return 'comments' in [field.strip() for field in expand.split(',')]
+
+
+class TicketReadMixin:
+
+    def expand_comments(self):
+        return expand_comments(self.request)
+
+    def get_serializer_class(self):
+        if self.action == 'list' and not self.expand_comments():
+            return TicketListSerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list' and not self.expand_comments():
+            return queryset.select_related('user').defer('description')\
+                .annotate(comment_count=comment_count_subquery())
+        if self.action in ['list', 'retrieve']:
+            return queryset.select_related('user').prefetch_related(comments_prefetch())
+        return queryset
 
 
 class RegistrationViewSet(viewsets.ModelViewSet):
@@ -19,29 +86,56 @@ class RegistrationViewSet(viewsets.ModelViewSet):
     permission_classes = [AllowAny]
 
 
-class TicketViewSet(viewsets.ModelViewSet):
+class TicketViewSet(TicketReadMixin, viewsets.ModelViewSet):
     queryset = Ticket.objects.exclude(status=Ticket.RESTORED_STATUS)
     http_method_names = ['get', 'post', 'patch']
-    filter_backends = [StatusPriorityFilter, SearchFilter, OrderingFilter]
+    serializer_class = TicketGetOrCreateSerializer
+    filter_backends = [StatusPriorityFilter, FullTextSearchFilter, SearchFilter, OrderingFilter]
     search_fields = ['title']
     ordering_fields = ['priority', 'status', 'created']
+    ordering = ['-created']
+    pagination_class = TicketCursorPagination
     permission_classes = [IsUserOrAdminReadOnly]
 
     def get_serializer_class(self):
         if self.action == 'partial_update':
             return TicketUpdateSerializer
-        return TicketGetOrCreateSerializer
+        return super().get_serializer_class()
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-        user = self.request.user
-        if not user.is_staff:
-            return queryset.filter(user=user)
-        return queryset
+        return filter_visible_tickets(super().get_queryset(), self.request.user)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def retrieve(self, request, *args, **kwargs):
+        ticket_id = kwargs[self.lookup_field]
+        # Query parameters select fields or filter the ticket, only the plain representation is cached.
+        if request.query_params or not ticket_id.isdigit():
+            return super().retrieve(request, *args, **kwargs)
+
+        ticket_id = int(ticket_id)
+        version, cached_data = get_cached_ticket_data(ticket_id)
+        if cached_data is not None and can_see_cached_ticket(request.user, cached_data):
+            return Response(cached_data['ticket'])
+
+        ticket = self.get_object()
+        serializer = self.get_serializer(ticket)
+        set_cached_ticket_data(ticket_id, version, {
+            'user_id': ticket.user_id,
+            'status': ticket.status,
+            'ticket': serializer.data,
+        })
+        return Response(serializer.data)
+
+    @action(detail=True)
+    def comments(self, request, pk=None):
+        ticket = self.get_object()
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(ticket.comments.select_related('author'), request)
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=True,
             methods=['patch'],
             queryset=Ticket.objects.exclude(status=Ticket.COMPLETED_STATUS),
@@ -52,44 +146,160 @@ class TicketViewSet(viewsets.ModelViewSet):
         serializer = ChangeTicketStatusSerializer(ticket, data=request.data, context=context)
         serializer.is_valid(raise_exception=True)
 
-        current_status = ticket.status
-        changed_status = serializer.validated_data.get('status')
-        comment = serializer.validated_data.get('comment')
+        transition = serializer.transition
+        try:
+            apply_transition(ticket,
+                             transition,
+                             serializer.validated_data.get('status'),
+                             request.user,
+                             serializer.validated_data.get('comment'),
+                             serializer.validated_data.get('version'))
+        except TransitionConflict:
+            return Response({'detail': CONFLICT_ERROR}, status=status.HTTP_409_CONFLICT)
+
+        if transition.effect == DELETE_TICKET:
+            return Response({'detail': 'Ticket deleted.'})
+        return Response(serializer.data)
+
+    @action(detail=False,
+            methods=['patch'],
+            url_path='change-ticket-status',
+            queryset=Ticket.objects.exclude(status=Ticket.COMPLETED_STATUS),
+            permission_classes=[IsAuthenticated])
+    def bulk_change_ticket_status(self, request):
+        bulk_serializer = BulkChangeTicketStatusSerializer(data=request.data)
+        bulk_serializer.is_valid(raise_exception=True)
+        items = bulk_serializer.validated_data['tickets']
 
-        if (changed_status == Ticket.RESTORED_STATUS and comment) or \
-                (changed_status == Ticket.REJECTED_STATUS and
-                 current_status == Ticket.ACTIVE_STATUS):
+        ticket_ids = Counter(item['id'] for item in items)
+        tickets = self.get_queryset().in_bulk(list(ticket_ids))
+        context = self.get_serializer_context()
 
-            new_comment = Comment(author=request.user,
-                                  ticket=ticket,
-                                  body=comment)
+        results = []
+        valid_items = []
+        changed_tickets = []
+        status_events = []
+        new_comments = []
+        notifications = []
+        deleted_ids = []
 
-            if changed_status == Ticket.RESTORED_STATUS:
-                new_comment.topic = Comment.RESTORE_TOPIC
-            else:
-                new_comment.topic = Comment.REJECT_TOPIC
+        for item in items:
+            ticket_id = item['id']
+            ticket = tickets.get(ticket_id)
+            if ticket is None:
+                results.append({'id': ticket_id, 'errors': {'id': 'Not found.'}})
+                continue
+            if ticket_ids[ticket_id] > 1:
+                results.append({'id': ticket_id, 'errors': {'id': 'Ticket occurs more than once.'}})
+                continue
 
-            with transaction.atomic():
-                new_comment.save()
-                serializer.save()
+            serializer = ChangeTicketStatusSerializer(ticket, data=item, context=context)
+            if not serializer.is_valid():
+                results.append({'id': ticket_id, 'errors': serializer.errors})
+                continue
 
-            return Response(serializer.data)
+            valid_items.append((len(results), ticket, serializer))
+            results.append(None)
 
-        if changed_status == Ticket.REJECTED_STATUS and \
-                current_status == Ticket.RESTORED_STATUS:
-            ticket.delete()
-            return Response({'detail': 'Ticket deleted.'})
+        with transaction.atomic():
+            for index, ticket, serializer in valid_items:
+                try:
+                    claim_ticket(ticket, serializer.validated_data.get('version'))
+                except TransitionConflict:
+                    results[index] = {'id': ticket.id, 'errors': {'id': CONFLICT_ERROR}}
+                    continue
 
-        serializer.save()
-        return Response(serializer.data)
+                transition = serializer.transition
+                changed_status = serializer.validated_data.get('status')
+                if transition.effect == DELETE_TICKET:
+                    notifications.append(status_notification(ticket, changed_status, request.user, deleted=True))
+                    deleted_ids.append(ticket.id)
+                    results[index] = {'id': ticket.id, 'detail': 'Ticket deleted.'}
+                    continue
+
+                topic = COMMENT_TOPICS.get(transition.effect)
+                comment = serializer.validated_data.get('comment') if topic else None
+                if comment:
+                    new_comments.append(Comment(author=request.user, ticket=ticket, topic=topic, body=comment))
 
+                notifications.append(status_notification(ticket, changed_status, request.user, comment))
+                status_events.append(set_status(ticket, changed_status, request.user))
+                changed_tickets.append(ticket)
+                results[index] = {'id': ticket.id, **ChangeTicketStatusSerializer(ticket, context=context).data}
 
-class RestoreTicketViewSet(viewsets.ReadOnlyModelViewSet):
+            Ticket.objects.bulk_update(changed_tickets, ['status', 'completed'])
+            TicketStatusEvent.objects.bulk_create(status_events)
+            count_ticket_changes(changed_tickets)
+            new_comments = Comment.objects.bulk_create(new_comments)
+            enqueue(index_comments, [comment.id for comment in new_comments])
+            record_notifications(notifications)
+            Ticket.objects.filter(id__in=deleted_ids).delete()
+
+        for comment in new_comments:
+            publish_event(comment_event(comment))
+        for ticket in changed_tickets:
+            bump_ticket_version(ticket.id)
+            publish_event(ticket_event(TICKET_STATUS, ticket))
+
+        return Response(results)
+
+    @action(detail=False, permission_classes=[IsAdminUser])
+    def stats(self, request):
+        return Response(get_ticket_stats())
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAuthenticated])
+    def import_tickets(self, request):
+        upload = request.FILES.get('file')
+        if upload is not None:
+            import_format = request.data.get('import_format') or upload.name.rsplit('.', 1)[-1].lower()
+            if import_format not in IMPORT_READERS:
+                raise ValidationError({'import_format': f'Select a valid choice. {import_format} is not one of the '
+                                                        f'available choices.'})
+            records = IMPORT_READERS[import_format](line.decode('utf-8') for line in upload)
+        else:
+            serializer = BulkImportTicketSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            records = serializer.validated_data['tickets']
+
+        imported = 0
+        errors = []
+        for _, batch_imported, batch_errors in TicketImporter(request.user).run(records):
+            imported += batch_imported
+            errors.extend(batch_errors)
+        return Response({'imported': imported, 'errors': errors})
+
+    @action(detail=False)
+    def export(self, request):
+        export_format = request.query_params.get('export_format', 'csv')
+        resource = request.query_params.get('resource', 'tickets')
+        if export_format not in EXPORT_FORMATS:
+            raise ValidationError({'export_format': f'Select a valid choice. {export_format} is not one of the '
+                                                    f'available choices.'})
+        if resource not in EXPORT_RESOURCES:
+            raise ValidationError({'resource': f'Select a valid choice. {resource} is not one of the '
+                                               f'available choices.'})
+
+        tickets = StatusPriorityFilter().filter_queryset(request, self.get_queryset(), self)
+        _, content_type = EXPORT_FORMATS[export_format]
+        response = StreamingHttpResponse(export_tickets(tickets, resource, export_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{resource}.{export_format}"'
+        return response
+
+    @action(detail=False, url_path='time-in-status', permission_classes=[IsAdminUser])
+    def time_in_status(self, request):
+        serializer = TimeInStatusSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(get_time_in_status(**serializer.validated_data))
+
+
+class RestoreTicketViewSet(TicketReadMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ticket.objects.filter(status=Ticket.RESTORED_STATUS)
     serializer_class = TicketGetOrCreateSerializer
-    filter_backends = [StatusPriorityFilter, SearchFilter, OrderingFilter]
+    filter_backends = [StatusPriorityFilter, FullTextSearchFilter, SearchFilter, OrderingFilter]
     search_fields = ['title']
     ordering_fields = ['priority', 'status', 'created']
+    ordering = ['-created']
+    pagination_class = TicketCursorPagination
     permission_classes = [IsAdminUser]
 
 
@@ -101,3 +311,9 @@ class CommentViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
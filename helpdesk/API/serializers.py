@@ -1,6 +1,23 @@
 from rest_framework import serializers
 
+from config.settings import BULK_STATUS_CHANGE_LIMIT, IMPORT_API_LIMIT
 from helpdesk.models import Ticket, Comment, CustomUser
+from helpdesk.transitions import get_transition, get_allowed_statuses
+
+
+class DynamicFieldsMixin:
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+
+        fields = request.query_params.get('fields')
+        if fields:
+            allowed = {field.strip() for field in fields.split(',')}
+            for field_name in set(self.fields) - allowed:
+                self.fields.pop(field_name)
 
 
 class RegistrationSerializer(serializers.ModelSerializer):
@@ -64,24 +81,45 @@ class CommentSerializer(serializers.ModelSerializer):
         }
 
     def validate(self, data):
-        request = self.context.get('request')
-        user = request.user
-        ticket = data.get('ticket')
+        errors = self.get_ticket_errors(data.get('ticket'))
 
-        if ticket.status != Ticket.ACTIVE_STATUS:
-            raise serializers.ValidationError({
-                'ticket': 'You cannot comment on an ticket that is not in the active status.'
-            })
-
-        if user != ticket.user and not user.is_staff:
+        if errors:
             raise serializers.ValidationError({
-                'ticket': 'Only the author or administrator can leave a comment on the ticket.'
+                'ticket': errors[0]
             })
 
         return data
 
+    def get_ticket_errors(self, ticket):
+        """Rules for commenting on a ticket, also applied by CommentCreateForm."""
+        user = self.context.get('request').user
+        errors = []
+
+        if ticket.status != Ticket.ACTIVE_STATUS:
+            errors.append('You cannot comment on an ticket that is not in the active status.')
 
-class TicketGetOrCreateSerializer(serializers.ModelSerializer):
+        if ticket.user_id != user.id and not user.is_staff:
+            errors.append('Only the author or administrator can leave a comment on the ticket.')
+
+        return errors
+
+
+class TicketListSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    priority = serializers.CharField(source='get_priority_display', read_only=True)
+    status = serializers.CharField(source='get_status_display', read_only=True)
+    author = UserSerializer(source='user', read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    allowed_status_ids = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Ticket
+        fields = ['id', 'title', 'priority', 'status', 'author', 'created', 'comment_count', 'allowed_status_ids']
+
+    def get_allowed_status_ids(self, ticket):
+        return get_allowed_statuses(ticket.status, self.context['request'].user.is_staff)
+
+
+class TicketGetOrCreateSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     priority = serializers.CharField(source='get_priority_display', read_only=True)
     status = serializers.CharField(source='get_status_display', read_only=True)
     author = UserSerializer(source='user', read_only=True)
@@ -89,7 +127,9 @@ class TicketGetOrCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ticket
-        fields = ['id', 'title', 'description', 'priority_id', 'priority', 'status', 'author', 'created', 'comments']
+        fields = ['id', 'title', 'description', 'priority_id', 'priority', 'status', 'version', 'author', 'created',
+                  'comments']
+        read_only_fields = ['version']
         extra_kwargs = {
             'priority_id': {
                 'source': 'priority',
@@ -129,64 +169,97 @@ class ChangeTicketStatusSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Ticket
-        fields = ['title', 'description', 'priority', 'status_id', 'status', 'comment']
+        fields = ['title', 'description', 'priority', 'status_id', 'status', 'version', 'comment']
         read_only_fields = ['title', 'description']
         extra_kwargs = {
             'status_id': {
                 'source': 'status',
                 'write_only': True,
             },
+            'version': {
+                'required': False,
+            },
         }
 
     def validate(self, data):
         comment = data.get('comment')
         changed_status = data.get('status')
-        current_status = self.instance.status
         request = self.context.get('request')
-        user_is_admin = request.user.is_staff
 
         if changed_status is None:
             raise serializers.ValidationError({
                 'status_id': 'This field is required.'
             })
 
-        if changed_status == current_status:
+        self.transition = get_transition(self.instance.status, changed_status, request.user.is_staff)
+
+        if self.transition.error_field:
             raise serializers.ValidationError({
-                'status_id': 'Status should be different.'
+                'status_id': self.transition.error
             })
 
-        if changed_status == Ticket.ACTIVE_STATUS:
+        if self.transition.error:
+            raise serializers.ValidationError(self.transition.error)
+
+        if self.transition.comment_required and comment is None:
             raise serializers.ValidationError({
-                'status_id': 'Status ACTIVE cannot be set by user.'
+                'comment': 'This field is required.'
             })
 
-        if changed_status in [Ticket.PROCESSED_STATUS, Ticket.REJECTED_STATUS]:
-            if not user_is_admin:
-                raise serializers.ValidationError('Status can only be changed by the administrator.')
-            if current_status not in [Ticket.ACTIVE_STATUS, Ticket.RESTORED_STATUS]:
-                raise serializers.ValidationError({
-                    'status_id': 'Status can only be changed if the ticket is active or restored.'
-                })
-            if changed_status == Ticket.REJECTED_STATUS and \
-                    current_status == Ticket.ACTIVE_STATUS and comment is None:
-                raise serializers.ValidationError({
-                    'comment': 'This field is required.'
-                })
-
-        if changed_status == Ticket.RESTORED_STATUS:
-            if user_is_admin:
-                raise serializers.ValidationError('Administrator cant restore tickets.')
-            if current_status != Ticket.REJECTED_STATUS:
-                raise serializers.ValidationError({
-                    'status_id': 'You can only restore an ticket if it was rejected.'
-                })
-
-        if changed_status == Ticket.COMPLETED_STATUS:
-            if not user_is_admin:
-                raise serializers.ValidationError('Status can only be changed by the administrator.')
-            if current_status != Ticket.PROCESSED_STATUS:
-                raise serializers.ValidationError({
-                    'status_id': 'You can complete the ticket only if it in the status PROCESSED.'
-                })
-
         return data
+
+
+class BulkChangeTicketStatusItemSerializer(serializers.Serializer):
+    """The shape of one item, the status change itself is checked by ChangeTicketStatusSerializer."""
+    id = serializers.IntegerField()
+    status_id = serializers.IntegerField()
+    comment = serializers.CharField(required=False, allow_blank=True)
+    version = serializers.IntegerField(required=False)
+
+
+class BulkChangeTicketStatusSerializer(serializers.Serializer):
+    tickets = serializers.ListField(child=BulkChangeTicketStatusItemSerializer(),
+                                    allow_empty=False,
+                                    max_length=BULK_STATUS_CHANGE_LIMIT)
+
+
+class TimeInStatusSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    percentiles = serializers.CharField(required=False, default='50,90,95,99')
+
+    def validate_percentiles(self, value):
+        try:
+            percentiles = [float(percentile) for percentile in value.split(',')]
+        except ValueError:
+            percentiles = []
+        if not percentiles or not all(0 < percentile <= 100 for percentile in percentiles):
+            raise serializers.ValidationError('Enter comma-separated percentiles between 0 and 100.')
+        return [int(percentile) if percentile.is_integer() else percentile for percentile in percentiles]
+
+
+class ImportCommentSerializer(serializers.ModelSerializer):
+    author = serializers.CharField(required=False)
+
+    class Meta:
+        model = Comment
+        fields = ['comment', 'author']
+        extra_kwargs = CommentSerializer.Meta.extra_kwargs
+
+
+class TicketImportSerializer(TicketGetOrCreateSerializer):
+    """
+    Validates one record of a ticket import. Authors are usernames and are
+    resolved for a whole batch at once by the importer.
+    """
+    author = serializers.CharField(required=False)
+    comments = ImportCommentSerializer(many=True, required=False)
+
+    class Meta(TicketGetOrCreateSerializer.Meta):
+        fields = ['title', 'description', 'priority_id', 'author', 'comments']
+
+
+class BulkImportTicketSerializer(serializers.Serializer):
+    tickets = serializers.ListField(child=serializers.DictField(),
+                                    allow_empty=False,
+                                    max_length=IMPORT_API_LIMIT)
@@ -1,7 +1,9 @@
 from django.contrib import admin
 
-from helpdesk.models import CustomUser, Ticket, Comment
+from helpdesk.models import CustomUser, Ticket, Comment, QueuedTask, Notification
 
 admin.site.register(CustomUser)
 admin.site.register(Ticket)
 admin.site.register(Comment)
+admin.site.register(QueuedTask)
+admin.site.register(Notification)
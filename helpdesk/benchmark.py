@@ -0,0 +1,349 @@
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+import django
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from config.settings import BASE_DIR
+from helpdesk.models import CustomUser, Ticket, Comment, TicketStatusEvent
+from helpdesk.search import get_search_backend
+from helpdesk.stats import reconcile_ticket_stats
+from helpdesk.tasks import Worker
+
+BENCHMARK_RESULTS_DIR = BASE_DIR / 'benchmarks'
+
+WORDS = [
+    'printer', 'network', 'password', 'email', 'laptop', 'monitor', 'vpn', 'access', 'account', 'license',
+    'update', 'install', 'error', 'crash', 'slow', 'backup', 'server', 'keyboard', 'phone', 'wifi',
+]
+
+Endpoint = namedtuple('Endpoint', ['name', 'weight', 'actor', 'method', 'build'])
+
+
+@contextmanager
+def benchmark_database():
+    """
+    Run the block on a fresh test database, file-backed on SQLite, that is
+    destroyed afterwards, so benchmarks never touch the project database.
+    """
+    setup_test_environment()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'helpdesk_benchmark.sqlite3')
+    old_database_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of the values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+
+def random_text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def seed_dataset(user_count, ticket_count, comments_per_ticket, rng):
+    """
+    Create the users with their tokens, the tickets with their initial
+    status events and about `comments_per_ticket` comments per ticket, then
+    rebuild the counters and the search index the way an import would.
+    """
+    staff = CustomUser.objects.create_user(username='benchmark-admin', email='benchmark-admin@example.com',
+                                           first_name='Benchmark', last_name='Admin',
+                                           password=None, is_staff=True)
+    users = CustomUser.objects.bulk_create([
+        CustomUser(username=f'benchmark{number}', email=f'benchmark{number}@example.com',
+                   first_name='Benchmark', last_name=f'User {number}', password='!')
+        for number in range(user_count)
+    ], batch_size=1000)
+    Token.objects.bulk_create([Token(user=user, key=Token.generate_key()) for user in users], batch_size=1000)
+
+    statuses = [status for status, _ in Ticket.STATUS_CHOICES]
+    status_weights = [60, 15, 10, 5, 10]
+    priorities = [priority for priority, _ in Ticket.PRIORITY_CHOICES]
+    now = timezone.now()
+    tickets = []
+    created_times = []
+    for _ in range(ticket_count):
+        created = now - timedelta(seconds=rng.randint(0, 90 * 24 * 60 * 60))
+        status = rng.choices(statuses, status_weights)[0]
+        completed = created + timedelta(seconds=rng.randint(60, 7 * 24 * 60 * 60)) \
+            if status == Ticket.COMPLETED_STATUS else None
+        tickets.append(Ticket(user=rng.choice(users), title=random_text(rng, 4), description=random_text(rng, 20),
+                              priority=rng.choice(priorities), status=status, completed=completed))
+        created_times.append(created)
+    Ticket.objects.bulk_create(tickets, batch_size=1000)
+    # `created` is auto_now_add, so the spread over the last months is written afterwards.
+    for ticket, created in zip(tickets, created_times):
+        ticket.created = created
+    Ticket.objects.bulk_update(tickets, ['created'], batch_size=1000)
+    TicketStatusEvent.objects.bulk_create([
+        TicketStatusEvent(ticket=ticket, to_status=ticket.status, changed_by_id=ticket.user_id, created=ticket.created)
+        for ticket in tickets
+    ], batch_size=1000)
+
+    comments = []
+    for ticket in tickets:
+        for _ in range(rng.randint(0, 2 * comments_per_ticket)):
+            author_id = ticket.user_id if rng.random() < 0.7 else staff.id
+            comments.append(Comment(ticket=ticket, author_id=author_id, body=random_text(rng, 12)))
+            if len(comments) >= 5000:
+                Comment.objects.bulk_create(comments)
+                comments = []
+    Comment.objects.bulk_create(comments)
+
+    reconcile_ticket_stats()
+    get_search_backend().rebuild()
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+    return staff
+
+
+class BenchmarkContext:
+    """
+    The logged-in clients the request mix is replayed with and the ticket
+    ids the requests pick from.
+    """
+
+    def __init__(self, staff, users, rng):
+        self.rng = rng
+        self.actors = {'staff': [self.create_actor(staff)], 'user': [self.create_actor(user) for user in users]}
+        self.ticket_ids = list(self.visible_tickets(Ticket.objects.all()).values_list('id', flat=True))
+
+    def create_actor(self, user):
+        html_client = Client()
+        html_client.force_login(user)
+        token, _ = Token.objects.get_or_create(user=user)
+        api_client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        tickets = self.visible_tickets(Ticket.objects.filter(user=user))
+        return {
+            'user': user,
+            'html': html_client,
+            'api': api_client,
+            'ticket_ids': list(tickets.values_list('id', flat=True)),
+            'active_ticket_ids': list(tickets.filter(status=Ticket.ACTIVE_STATUS).values_list('id', flat=True)),
+        }
+
+    def visible_tickets(self, tickets):
+        return tickets.exclude(status=Ticket.RESTORED_STATUS)
+
+    def own_ticket(self, actor):
+        return self.rng.choice(actor['ticket_ids'] or self.ticket_ids)
+
+    def any_ticket(self):
+        return self.rng.choice(self.ticket_ids)
+
+
+def html_ticket_detail(context, actor):
+    return f'/ticket/{context.own_ticket(actor)}/', None
+
+
+def api_ticket_search(context, actor):
+    return f'/api/ticket/?q={context.rng.choice(WORDS)}', None
+
+
+def api_ticket_detail(context, actor):
+    return f'/api/ticket/{context.own_ticket(actor)}/', None
+
+
+def api_ticket_create(context, actor):
+    return '/api/ticket/', {'title': random_text(context.rng, 4), 'description': random_text(context.rng, 20),
+                            'priority_id': context.rng.choice(Ticket.PRIORITY_CHOICES)[0]}
+
+
+def api_comment_create(context, actor):
+    ticket_id = context.rng.choice(actor['active_ticket_ids'] or context.ticket_ids)
+    return '/api/comment/', {'ticket': ticket_id, 'comment': random_text(context.rng, 12)}
+
+
+def staff_ticket_detail(context, actor):
+    return f'/api/ticket/{context.any_ticket()}/', None
+
+
+# The replayed request mix: mostly users reading their own tickets, some
+# writes and a few staff reports.
+ENDPOINTS = [
+    Endpoint('html_ticket_list', 15, 'user', 'get', lambda context, actor: ('/', None)),
+    Endpoint('html_ticket_detail', 10, 'user', 'get', html_ticket_detail),
+    Endpoint('html_restore_list', 2, 'staff', 'get', lambda context, actor: ('/restore-ticket', None)),
+    Endpoint('api_ticket_list', 20, 'user', 'get', lambda context, actor: ('/api/ticket/', None)),
+    Endpoint('api_ticket_search', 5, 'user', 'get', api_ticket_search),
+    Endpoint('api_ticket_detail', 15, 'user', 'get', api_ticket_detail),
+    Endpoint('api_ticket_create', 4, 'user', 'post', api_ticket_create),
+    Endpoint('api_comment_create', 6, 'user', 'post', api_comment_create),
+    Endpoint('api_staff_ticket_list', 8, 'staff', 'get', lambda context, actor: ('/api/ticket/?status=active', None)),
+    Endpoint('api_staff_ticket_detail', 8, 'staff', 'get', staff_ticket_detail),
+    Endpoint('api_restore_list', 2, 'staff', 'get', lambda context, actor: ('/api/restore-ticket/', None)),
+    Endpoint('api_stats', 2, 'staff', 'get', lambda context, actor: ('/api/ticket/stats/', None)),
+    Endpoint('api_time_in_status', 1, 'staff', 'get', lambda context, actor: ('/api/ticket/time-in-status/', None)),
+]
+
+
+def send_request(context, endpoint):
+    actor = context.rng.choice(context.actors[endpoint.actor])
+    client = actor['html'] if endpoint.name.startswith('html') else actor['api']
+    path, data = endpoint.build(context, actor)
+    if endpoint.method == 'get':
+        return client.get(path)
+    return client.generic(endpoint.method.upper(), path, json.dumps(data), content_type='application/json')
+
+
+def replay(context, endpoints, request_count, trace_allocations=False):
+    """
+    Send `request_count` requests picked from the weighted mix and return
+    the latency, query count, status code and, when tracing allocations,
+    peak allocated bytes of each request grouped by endpoint.
+    """
+    samples = defaultdict(lambda: defaultdict(list))
+    chosen = context.rng.choices(endpoints, [endpoint.weight for endpoint in endpoints], k=request_count)
+
+    if trace_allocations:
+        tracemalloc.start()
+    try:
+        for endpoint in chosen:
+            if trace_allocations:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = send_request(context, endpoint)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+
+            endpoint_samples = samples[endpoint.name]
+            endpoint_samples['status'].append(response.status_code)
+            if trace_allocations:
+                endpoint_samples['allocations'].append(tracemalloc.get_traced_memory()[1] - baseline)
+            else:
+                endpoint_samples['latency'].append(elapsed)
+                endpoint_samples['queries'].append(len(queries))
+    finally:
+        if trace_allocations:
+            tracemalloc.stop()
+    return samples
+
+
+def summarize(timing_samples, allocation_samples):
+    endpoints = {}
+    for name in sorted(timing_samples.keys() | allocation_samples.keys()):
+        latency = [seconds * 1000 for seconds in timing_samples[name]['latency']]
+        queries = timing_samples[name]['queries']
+        allocations = [size / 1024 for size in allocation_samples[name]['allocations']]
+        statuses = Counter(timing_samples[name]['status'] + allocation_samples[name]['status'])
+        endpoints[name] = {
+            'requests': len(latency),
+            'latency_ms': {
+                'p50': round_value(percentile(latency, 50)),
+                'p95': round_value(percentile(latency, 95)),
+                'p99': round_value(percentile(latency, 99)),
+                'mean': round_value(sum(latency) / len(latency) if latency else None),
+            },
+            'queries': {
+                'mean': round_value(sum(queries) / len(queries) if queries else None),
+                'max': max(queries, default=None),
+            },
+            'allocated_kb': {
+                'p50': round_value(percentile(allocations, 50)),
+                'max': round_value(max(allocations, default=None)),
+            },
+            'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        }
+    return endpoints
+
+
+def round_value(value):
+    return None if value is None else round(value, 2)
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(users, tickets, comments_per_ticket, requests, warmup=50, allocation_requests=None,
+                  actors=10, seed=0, endpoints=ENDPOINTS):
+    """
+    Seed the dataset into the current database, replay the request mix and
+    return the results. Latencies and query counts come from one pass and
+    allocations from a second, shorter pass, so that tracemalloc overhead
+    does not skew the timings. The background jobs queued by the writes
+    are run at the end and only counted.
+    """
+    rng = random.Random(seed)
+    staff = seed_dataset(users, tickets, comments_per_ticket, rng)
+    actor_users = list(CustomUser.objects.filter(is_staff=False, tickets__isnull=False).distinct()
+                       .order_by('id')[:actors])
+    context = BenchmarkContext(staff, actor_users, rng)
+
+    replay(context, endpoints, warmup)
+    timing_samples = replay(context, endpoints, requests)
+    if allocation_requests is None:
+        allocation_requests = max(requests // 5, 1)
+    allocation_samples = replay(context, endpoints, allocation_requests, trace_allocations=True)
+    background_jobs = Worker().run(burst=True)
+
+    return {
+        'meta': {
+            'commit': get_git_commit(),
+            'created': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': users,
+            'tickets': tickets,
+            'comments_per_ticket': comments_per_ticket,
+            'requests': requests,
+            'allocation_requests': allocation_requests,
+            'seed': seed,
+            'background_jobs': background_jobs,
+        },
+        'endpoints': summarize(timing_samples, allocation_samples),
+    }
+
+
+def compare_results(previous, current, threshold):
+    """
+    Return (endpoint, metric, old, new, change) for every latency
+    percentile or query count that grew by more than `threshold` percent.
+    """
+    regressions = []
+    for name, result in current['endpoints'].items():
+        old_result = previous['endpoints'].get(name)
+        if old_result is None:
+            continue
+        metrics = [
+            (f'latency {key}', old_result['latency_ms'][key], result['latency_ms'][key]) for key in ('p50', 'p95')
+        ] + [('queries', old_result['queries']['mean'], result['queries']['mean'])]
+        for metric, old_value, new_value in metrics:
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value * 100
+            if change > threshold:
+                regressions.append((name, metric, old_value, new_value, change))
+    return regressions
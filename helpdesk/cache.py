@@ -0,0 +1,63 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from config.settings import TICKET_CACHE_TIMEOUT
+
+
+def get_ticket_version_key(ticket_id):
+    return f'ticket-version:{ticket_id}'
+
+
+def get_ticket_version(ticket_id):
+    version = cache.get(get_ticket_version_key(ticket_id))
+    if version is None:
+        version = bump_ticket_version(ticket_id)
+    return version
+
+
+def bump_ticket_version(ticket_id):
+    version = uuid4().hex
+    cache.set(get_ticket_version_key(ticket_id), version, None)
+    return version
+
+
+def get_ticket_data_key(ticket_id):
+    return f'ticket-data:{ticket_id}'
+
+
+def read_cached_ticket_data(ticket_id, values):
+    """
+    The data is stored with the version it was built for and read together
+    with the current version in one round trip; it is stale when they differ.
+    """
+    version = values.get(get_ticket_version_key(ticket_id))
+    cached = values.get(get_ticket_data_key(ticket_id))
+    if version is None or cached is None or cached['version'] != version:
+        return version, None
+    return version, cached['data']
+
+
+def get_cached_ticket_data(ticket_id):
+    values = cache.get_many([get_ticket_version_key(ticket_id), get_ticket_data_key(ticket_id)])
+    version, data = read_cached_ticket_data(ticket_id, values)
+    if version is None:
+        version = bump_ticket_version(ticket_id)
+    return version, data
+
+
+def set_cached_ticket_data(ticket_id, version, data):
+    cache.set(get_ticket_data_key(ticket_id), {'version': version, 'data': data}, TICKET_CACHE_TIMEOUT)
+
+
+async def aget_cached_ticket_data(ticket_id):
+    values = await cache.aget_many([get_ticket_version_key(ticket_id), get_ticket_data_key(ticket_id)])
+    version, data = read_cached_ticket_data(ticket_id, values)
+    if version is None:
+        version = uuid4().hex
+        await cache.aset(get_ticket_version_key(ticket_id), version, None)
+    return version, data
+
+
+async def aset_cached_ticket_data(ticket_id, version, data):
+    await cache.aset(get_ticket_data_key(ticket_id), {'version': version, 'data': data}, TICKET_CACHE_TIMEOUT)
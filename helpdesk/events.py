@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import redis
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.module_loading import import_string
+from redis import asyncio as aioredis
+
+from config.settings import EVENT_BROKER, EVENT_BROKER_URL, EVENT_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+TICKET_CREATED = 'ticket_created'
+TICKET_STATUS = 'ticket_status'
+TICKET_DELETED = 'ticket_deleted'
+COMMENT_CREATED = 'comment_created'
+
+
+class LocalEventBroker:
+    """
+    In-process broker. Every subscriber gets its own bounded queue bound to
+    the event loop it subscribed from; events published from sync code are
+    handed over to that loop thread-safely. Slow subscribers lose events
+    instead of growing their queue without limit.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+
+    def publish(self, event):
+        for queue, loop in list(self.subscribers.items()):
+            try:
+                loop.call_soon_threadsafe(self.put, queue, event)
+            except RuntimeError:
+                self.subscribers.pop(queue, None)
+
+    def dispatch(self, loop, event):
+        for queue, queue_loop in list(self.subscribers.items()):
+            if queue_loop is loop:
+                self.put(queue, event)
+
+    def put(self, queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    def has_subscribers(self, loop):
+        return any(queue_loop is loop for queue_loop in self.subscribers.values())
+
+    @asynccontextmanager
+    async def subscribe(self):
+        queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.subscribers[queue] = asyncio.get_running_loop()
+        try:
+            yield queue
+        finally:
+            self.subscribers.pop(queue, None)
+
+
+class RedisEventBroker(LocalEventBroker):
+    """
+    Redis pub/sub broker. Events are published to one channel, and each
+    event loop keeps a single subscription to it which fans the events out
+    to the local subscriber queues.
+    """
+    channel = 'helpdesk:events'
+
+    def __init__(self):
+        super().__init__()
+        self.client = None
+        self.listeners = {}
+
+    def publish(self, event):
+        if self.client is None:
+            self.client = redis.Redis.from_url(EVENT_BROKER_URL)
+        try:
+            self.client.publish(self.channel, json.dumps(event, cls=DjangoJSONEncoder))
+        except redis.RedisError:
+            logger.warning('Could not publish ticket event %s', event['event'], exc_info=True)
+
+    async def listen(self, loop):
+        while True:
+            client = aioredis.from_url(EVENT_BROKER_URL)
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.dispatch(loop, json.loads(message['data']))
+            except redis.RedisError:
+                logger.warning('Ticket event subscription lost, reconnecting', exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+                await client.close()
+
+    @asynccontextmanager
+    async def subscribe(self):
+        loop = asyncio.get_running_loop()
+        listener = self.listeners.get(loop)
+        if listener is None or listener.done():
+            self.listeners[loop] = loop.create_task(self.listen(loop))
+
+        try:
+            async with super().subscribe() as queue:
+                yield queue
+        finally:
+            if not self.has_subscribers(loop) and loop in self.listeners:
+                self.listeners.pop(loop).cancel()
+
+
+@lru_cache
+def get_event_broker():
+    return import_string(EVENT_BROKER)()
+
+
+def publish_event(event):
+    transaction.on_commit(lambda: get_event_broker().publish(event))
+
+
+def ticket_event(event_type, ticket):
+    return {
+        'event': event_type,
+        'ticket_id': ticket.id,
+        'user_id': ticket.user_id,
+        'status': ticket.status,
+        'status_display': ticket.get_status_display(),
+    }
+
+
+def comment_event(comment):
+    return {
+        'event': COMMENT_CREATED,
+        'ticket_id': comment.ticket_id,
+        'user_id': comment.ticket.user_id,
+        'comment_id': comment.id,
+        'author_id': comment.author_id,
+        'topic': comment.topic,
+        'body': comment.body,
+        'created': comment.created,
+    }
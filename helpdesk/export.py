@@ -0,0 +1,111 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from config.settings import EXPORT_CHUNK_SIZE, EXPORT_BUFFER_SIZE
+from helpdesk.models import Ticket, Comment
+
+TICKET_FIELDS = [
+    ('id', 'id'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('priority', 'priority'),
+    ('status', 'status'),
+    ('author', 'user__username'),
+    ('created', 'created'),
+    ('completed', 'completed'),
+]
+
+COMMENT_FIELDS = [
+    ('id', 'id'),
+    ('ticket', 'ticket_id'),
+    ('author', 'author__username'),
+    ('topic', 'topic'),
+    ('body', 'body'),
+    ('created', 'created'),
+]
+
+CHOICE_NAMES = {
+    'priority': dict(Ticket.PRIORITY_CHOICES),
+    'status': dict(Ticket.STATUS_CHOICES),
+    'topic': dict(Comment.TOPIC_CHOICES),
+}
+
+
+class Echo:
+    """
+    File-like object that hands back what is written to it, so csv.writer
+    returns each formatted line instead of buffering it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iterate_rows(queryset, fields):
+    headers = [header for header, _ in fields]
+    converters = [CHOICE_NAMES.get(header) for header in headers]
+    rows = queryset.order_by('id').values_list(*[lookup for _, lookup in fields])\
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    for row in rows:
+        yield [
+            converter[value] if converter else value.isoformat() if hasattr(value, 'isoformat') else value
+            for converter, value in zip(converters, row)
+        ]
+
+
+def get_export_rows(tickets, resource):
+    """
+    Return the column names and a lazy row iterator of the tickets, or of
+    the comments on them when resource is 'comments'.
+    """
+    if resource == 'comments':
+        comments = Comment.objects.filter(ticket__in=tickets.values('id'))
+        return [header for header, _ in COMMENT_FIELDS], iterate_rows(comments, COMMENT_FIELDS)
+    return [header for header, _ in TICKET_FIELDS], iterate_rows(tickets, TICKET_FIELDS)
+
+
+def csv_lines(headers, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in row])
+
+
+def ndjson_lines(headers, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(headers, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+}
+
+EXPORT_RESOURCES = ['tickets', 'comments']
+
+
+def buffer_lines(lines):
+    """
+    Join lines into chunks of about EXPORT_BUFFER_SIZE characters so that a
+    large export is not written to the client one row at a time.
+    """
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_tickets(tickets, resource, export_format):
+    headers, rows = get_export_rows(tickets, resource)
+    render_lines, _ = EXPORT_FORMATS[export_format]
+    return buffer_lines(render_lines(headers, rows))
@@ -1,10 +1,18 @@
 import django_filters
 
 from helpdesk.models import Ticket
+from helpdesk.search import get_search_backend
 
 
 class TicketFilter(django_filters.FilterSet):
+    q = django_filters.CharFilter(method='search', label='Search')
 
     class Meta:
         model = Ticket
-        fields = ['priority', 'status']
+        fields = ['q', 'priority', 'status']
+
+    search_truncated = False
+
+    def search(self, queryset, name, value):
+        queryset, self.search_truncated = get_search_backend().filter_queryset(queryset, value)
+        return queryset.order_by('search_rank')
@@ -2,7 +2,9 @@ from django.contrib.auth.forms import UserCreationForm
 from django import forms
 from django.forms import HiddenInput
 
+from helpdesk.API.serializers import CommentSerializer
 from helpdesk.models import CustomUser, Ticket, Comment
+from helpdesk.transitions import get_transition
 
 
 class UserCreateForm(UserCreationForm):
@@ -30,15 +32,8 @@ class CommentCreateForm(forms.ModelForm):
 
     def clean(self):
         super().clean()
-        current_status = self.ticket.status
-        ticket_author = self.ticket.user
-        comment_author = self.request.user
-
-        if current_status != Ticket.ACTIVE_STATUS:
-            self.add_error(None, 'You cannot comment on an ticket that is not in the active status.')
-
-        if ticket_author != comment_author and not comment_author.is_staff:
-            self.add_error(None, 'Only the author or administrator can leave a comment on the ticket.')
+        for error in CommentSerializer(context={'request': self.request}).get_ticket_errors(self.ticket):
+            self.add_error(None, error)
 
 
 class TicketUpdateForm(forms.ModelForm):
@@ -54,25 +49,24 @@ class TicketUpdateForm(forms.ModelForm):
     def clean(self):
         super().clean()
         current_status = self.instance.status
-        author = self.instance.user
         user = self.request.user
 
         if current_status != Ticket.ACTIVE_STATUS:
             self.add_error(None, 'You cannot edit an ticket if it is not in the Active status.')
 
-        if author != user:
+        if self.instance.user_id != user.id:
             self.add_error(None, 'You can change only your ticket.')
 
 
 class ChangeTicketStatusForm(forms.ModelForm):
+    # Not a model field of the form, so validation leaves the instance in the
+    # status it was loaded with until the transition is applied.
+    status = forms.TypedChoiceField(choices=Ticket.STATUS_CHOICES, coerce=int, widget=HiddenInput())
     comment = forms.CharField(required=False, widget=forms.Textarea)
 
     class Meta:
         model = Ticket
-        fields = ['status']
-        widgets = {
-            'status': HiddenInput(),
-        }
+        fields = []
 
     def __init__(self, *args, **kwargs):
         self.request = kwargs.pop('request', None)
@@ -81,34 +75,18 @@ class ChangeTicketStatusForm(forms.ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         changed_status = cleaned_data.get('status')
-        current_status = self.instance.status
-        author = self.instance.user
+        comment = cleaned_data.get('comment')
         user = self.request.user
-        user_is_admin = user.is_staff
+        if changed_status is None:
+            return
+
+        self.transition = get_transition(self.instance.status, changed_status, user.is_staff)
 
-        if user != author and not user_is_admin:
+        if self.instance.user_id != user.id and not user.is_staff:
             self.add_error('status', 'You can change status only your ticket.')
 
-        elif changed_status == current_status:
-            self.add_error('status', 'Status should be different.')
-
-        elif changed_status == Ticket.ACTIVE_STATUS:
-            self.add_error('status', 'Status ACTIVE cannot be set by user.')
-
-        elif changed_status in [Ticket.PROCESSED_STATUS, Ticket.REJECTED_STATUS]:
-            if not user_is_admin:
-                self.add_error('status', 'Status can only be changed by the administrator.')
-            elif current_status not in [Ticket.ACTIVE_STATUS, Ticket.RESTORED_STATUS]:
-                self.add_error('status', 'Status can only be changed if the ticket is active or restored.')
-
-        elif changed_status == Ticket.RESTORED_STATUS:
-            if user_is_admin:
-                self.add_error('status', 'Administrator cant restore tickets.')
-            elif current_status != Ticket.REJECTED_STATUS:
-                self.add_error('status', 'You can only restore an ticket if it was rejected.')
-
-        elif changed_status == Ticket.COMPLETED_STATUS:
-            if not user_is_admin:
-                self.add_error('status', 'Status can only be changed by the administrator.')
-            elif current_status != Ticket.PROCESSED_STATUS:
-                self.add_error('status', 'You can complete the ticket only if it in the status PROCESSED.')
+        elif self.transition.error:
+            self.add_error('status', self.transition.error)
+
+        elif self.transition.comment_required and not comment:
+            self.add_error('status', 'Comment is required for this status change.')
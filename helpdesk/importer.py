@@ -0,0 +1,170 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import connection, transaction
+from rest_framework.exceptions import ValidationError
+
+from config.settings import IMPORT_BATCH_SIZE
+from helpdesk.API.serializers import TicketImportSerializer
+from helpdesk.models import CustomUser, Ticket, Comment, TicketStatusEvent, ImportCheckpoint
+from helpdesk.search import index_tickets, index_comments
+from helpdesk.stats import count_ticket_changes
+from helpdesk.tasks import enqueue
+
+PRIORITY_IDS = {name.lower(): priority for priority, name in Ticket.PRIORITY_CHOICES}
+
+
+def read_ndjson(lines):
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+def read_csv(lines):
+    """
+    Read CSV records with the columns of the ticket export. `priority` may
+    be given by name instead of `priority_id` and `comments` holds a JSON
+    list of comments.
+    """
+    for row in csv.DictReader(lines):
+        record = {key: value for key, value in row.items() if value not in (None, '')}
+        if 'priority_id' not in record and 'priority' in record:
+            record['priority_id'] = PRIORITY_IDS.get(record['priority'].lower(), record['priority'])
+        if 'comments' in record:
+            try:
+                record['comments'] = json.loads(record['comments'])
+            except ValueError:
+                pass
+        yield record
+
+
+IMPORT_READERS = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+}
+
+
+class TicketImporter:
+    """
+    Imports ticket records in batches. Every batch is validated with
+    TicketImportSerializer, written with bulk_create in one transaction
+    and, when a checkpoint name is given, recorded in ImportCheckpoint in
+    that same transaction so an interrupted import resumes after the last
+    committed batch.
+
+    `user` is the importing user: records without an author belong to
+    them, and only staff may import tickets for other users. As on create,
+    tickets never belong to staff, so staff imports name every author.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE, checkpoint=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.serializer = TicketImportSerializer()
+
+    def get_start_position(self):
+        if self.checkpoint is None:
+            return 0
+        return ImportCheckpoint.objects.filter(name=self.checkpoint).values_list('position', flat=True).first() or 0
+
+    def run(self, records):
+        """
+        Import the records and yield (position, imported, errors) after
+        every committed batch, where position counts all records read so far.
+        """
+        position = self.get_start_position()
+        records = islice(records, position, None)
+
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            tickets, comments, errors = self.validate_batch(batch, position)
+            position += len(batch)
+            self.write_batch(tickets, comments, position)
+            yield position, len(tickets), errors
+
+    def validate_batch(self, batch, position):
+        validated = []
+        errors = []
+        for index, record in enumerate(batch, position):
+            try:
+                validated.append((index, self.serializer.run_validation(record)))
+            except ValidationError as exc:
+                errors.append({'index': index, 'errors': exc.detail})
+
+        usernames = {data['author'] for _, data in validated if 'author' in data}
+        usernames |= {comment['author'] for _, data in validated
+                      for comment in data.get('comments', []) if 'author' in comment}
+        users = CustomUser.objects.filter(username__in=usernames).values_list('username', 'id', 'is_staff')
+        user_ids = {username: user_id for username, user_id, _ in users}
+        user_ids[self.user.username] = self.user.id
+        staff_usernames = {username for username, _, is_staff in users if is_staff}
+        if self.user.is_staff:
+            staff_usernames.add(self.user.username)
+
+        tickets = []
+        comments = []
+        for index, data in validated:
+            record_errors = self.check_authors(data, user_ids, staff_usernames)
+            if record_errors:
+                errors.append({'index': index, 'errors': record_errors})
+                continue
+
+            ticket = Ticket(user_id=user_ids[data.get('author', self.user.username)],
+                            title=data['title'],
+                            description=data['description'],
+                            priority=data['priority'])
+            tickets.append(ticket)
+            comments.extend(
+                Comment(ticket=ticket, author_id=user_ids[comment.get('author', self.user.username)],
+                        body=comment['body'])
+                for comment in data.get('comments', [])
+            )
+        return tickets, comments, sorted(errors, key=lambda error: error['index'])
+
+    def check_authors(self, data, user_ids, staff_usernames):
+        errors = {}
+        authors = [data.get('author')] + [comment.get('author') for comment in data.get('comments', [])]
+        for author in filter(None, authors):
+            if author not in user_ids:
+                errors['author'] = f'User "{author}" does not exist.'
+            elif author != self.user.username and not self.user.is_staff:
+                errors['author'] = 'Only the administrator can import tickets of other users.'
+        if not errors and data.get('author', self.user.username) in staff_usernames:
+            errors['author'] = 'This field is required.' if 'author' not in data else \
+                'Tickets cannot belong to the administrator.'
+        return errors
+
+    def create_status_events(self, ticket_ids):
+        """
+        Copy the initial status events of the new tickets straight from the
+        ticket table instead of building a model instance for each of them.
+        """
+        quote_name = connection.ops.quote_name
+        event_table = quote_name(TicketStatusEvent._meta.db_table)
+        ticket_table = quote_name(Ticket._meta.db_table)
+        with connection.cursor() as cursor:
+            for start in range(0, len(ticket_ids), 500):
+                chunk = ticket_ids[start:start + 500]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(f'INSERT INTO {event_table} (ticket_id, to_status, changed_by_id, created) '
+                               f'SELECT id, status, user_id, created FROM {ticket_table} WHERE id IN ({placeholders})',
+                               chunk)
+
+    def write_batch(self, tickets, comments, position):
+        with transaction.atomic():
+            Ticket.objects.bulk_create(tickets)
+            Comment.objects.bulk_create(comments)
+            self.create_status_events([ticket.id for ticket in tickets])
+            count_ticket_changes(tickets, created=True)
+            enqueue(index_tickets, [ticket.id for ticket in tickets])
+            enqueue(index_comments, [comment.id for comment in comments])
+            if self.checkpoint is not None:
+                ImportCheckpoint.objects.update_or_create(name=self.checkpoint, defaults={'position': position})
@@ -0,0 +1,94 @@
+import json
+import logging
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from config.settings import LOCMEM_CACHES
+from helpdesk.benchmark import BENCHMARK_RESULTS_DIR, ENDPOINTS, benchmark_database, run_benchmark, \
+    compare_results
+
+
+class Command(BaseCommand):
+    help = 'Seed a scaled dataset on a temporary test database, replay a weighted mix of page and API ' \
+           'requests and report latency percentiles, query counts and allocations per endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--tickets', type=int, default=5000)
+        parser.add_argument('--comments', type=int, default=3, help='Average number of comments per ticket.')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--allocation-requests', type=int,
+                            help='Requests replayed with allocation tracing, a fifth of --requests by default.')
+        parser.add_argument('--actors', type=int, default=10, help='Number of users sending requests.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            choices=[endpoint.name for endpoint in ENDPOINTS],
+                            help='Replay only this endpoint, may be given several times.')
+        parser.add_argument('--output', help=f'Results file, {BENCHMARK_RESULTS_DIR}/<commit>.json by default.')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare with.')
+        parser.add_argument('--threshold', type=float, default=20,
+                            help='Percent growth of a metric that counts as a regression.')
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--local-cache', action='store_true',
+                            help='Use the in-process cache instead of the configured one.')
+
+    def handle(self, *args, **options):
+        previous = self.load_results(options['compare']) if options['compare'] else None
+        endpoints = [endpoint for endpoint in ENDPOINTS
+                     if not options['endpoints'] or endpoint.name in options['endpoints']]
+
+        # Expected 4xx responses of the mix would otherwise be logged one by one.
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+        caches = LOCMEM_CACHES if options['local_cache'] else None
+        with benchmark_database(), override_settings(**({'CACHES': caches} if caches else {})):
+            results = run_benchmark(users=options['users'],
+                                    tickets=options['tickets'],
+                                    comments_per_ticket=options['comments'],
+                                    requests=options['requests'],
+                                    warmup=options['warmup'],
+                                    allocation_requests=options['allocation_requests'],
+                                    actors=options['actors'],
+                                    seed=options['seed'],
+                                    endpoints=endpoints)
+
+        self.write_table(results)
+        output = Path(options['output'] or BENCHMARK_RESULTS_DIR / f'{results["meta"]["commit"] or "results"}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        self.stdout.write(f'Results written to {output}')
+
+        if previous is not None:
+            regressions = compare_results(previous, results, options['threshold'])
+            for name, metric, old_value, new_value, change in regressions:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: {metric} {old_value} -> {new_value} (+{change:.1f}%)'
+                ))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}'))
+            elif options['fail_on_regression']:
+                raise CommandError(f'{len(regressions)} regressions against {options["compare"]}')
+
+    def load_results(self, path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read results from {path}: {exc}')
+
+    def write_table(self, results):
+        self.stdout.write(f'{"endpoint":<26}{"requests":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+                          f'{"queries":>9}{"alloc KB":>10}  status')
+        for name, result in results['endpoints'].items():
+            latency = result['latency_ms']
+            statuses = ' '.join(f'{code}x{count}' for code, count in result['status_codes'].items())
+            self.stdout.write(f'{name:<26}{result["requests"]:>9}{format_value(latency["p50"]):>9}'
+                              f'{format_value(latency["p95"]):>9}{format_value(latency["p99"]):>9}'
+                              f'{format_value(result["queries"]["mean"]):>9}'
+                              f'{format_value(result["allocated_kb"]["p50"]):>10}  {statuses}')
+
+
+def format_value(value):
+    return '-' if value is None else f'{value:.1f}'
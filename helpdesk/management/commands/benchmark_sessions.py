@@ -0,0 +1,65 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from config.settings import SESSION_ENGINES, LOCMEM_CACHES
+from helpdesk import middlewares
+from helpdesk.benchmark import benchmark_database
+from helpdesk.models import CustomUser, Ticket
+
+SCENARIOS = [
+    ('db', 'session'),
+    ('cached_db', 'session'),
+    ('cached_db', 'cache'),
+    ('cache', 'cache'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second of a page for each session engine and activity tracking mode ' \
+           'on a temporary test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--tickets', type=int, default=20)
+        parser.add_argument('--path', default='/')
+        parser.add_argument('--local-cache', action='store_true',
+                            help='Use the in-process cache instead of the configured one.')
+
+    def handle(self, *args, **options):
+        caches = LOCMEM_CACHES if options['local_cache'] else None
+        with benchmark_database(), override_settings(**({'CACHES': caches} if caches else {})):
+            user = self.create_data(options['tickets'])
+            for session_mode, activity_tracking in SCENARIOS:
+                requests_per_second = self.run_scenario(user, session_mode, activity_tracking,
+                                                       options['path'], options['requests'])
+                self.stdout.write(f'session={session_mode:<10} activity={activity_tracking:<8} '
+                                  f'{requests_per_second:8.1f} req/s')
+
+    def create_data(self, ticket_count):
+        user = CustomUser.objects.create_user(username='benchmark',
+                                              email='benchmark@example.com',
+                                              first_name='Benchmark',
+                                              last_name='User',
+                                              password=None)
+        Ticket.objects.bulk_create([
+            Ticket(user=user, title=f'Ticket {number}', description='description')
+            for number in range(ticket_count)
+        ])
+        return user
+
+    def run_scenario(self, user, session_mode, activity_tracking, path, request_count):
+        cache.clear()
+        with override_settings(SESSION_ENGINE=SESSION_ENGINES[session_mode]), \
+                mock.patch.object(middlewares, 'ACTIVITY_TRACKING', activity_tracking):
+            client = Client()
+            client.force_login(user)
+            client.get(path)
+
+            started = time.perf_counter()
+            for _ in range(request_count):
+                client.get(path)
+            return request_count / (time.perf_counter() - started)
@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from helpdesk.API.filters import StatusPriorityFilter
+from helpdesk.API.resourses import TicketViewSet
+from helpdesk.export import export_tickets, EXPORT_FORMATS, EXPORT_RESOURCES
+from helpdesk.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Stream tickets or their comments as CSV or NDJSON with the visibility rules of /api/ticket/.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--export-format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--resource', choices=EXPORT_RESOURCES, default='tickets')
+        parser.add_argument('--user', help='Export what this user can see. Defaults to all tickets.')
+        parser.add_argument('--status')
+        parser.add_argument('--priority')
+        parser.add_argument('--output', help='File to write to. Defaults to stdout.')
+
+    def handle(self, *args, **options):
+        if options['user']:
+            try:
+                user = CustomUser.objects.get(username=options['user'])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f'User "{options["user"]}" does not exist.')
+        else:
+            user = SimpleNamespace(is_staff=True)
+
+        query_params = {name: options[name] for name in ['status', 'priority'] if options[name]}
+        request = SimpleNamespace(user=user, query_params=query_params)
+        view = TicketViewSet(request=request, action='export', format_kwarg=None)
+        try:
+            tickets = StatusPriorityFilter().filter_queryset(request, view.get_queryset(), view)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        chunks = export_tickets(tickets, options['resource'], options['export_format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,55 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from config.settings import IMPORT_BATCH_SIZE
+from helpdesk.importer import TicketImporter, IMPORT_READERS
+from helpdesk.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = 'Import tickets with their comments from a CSV or NDJSON file in batched transactions. ' \
+           'Progress is checkpointed after every batch, so rerunning the same command resumes the import.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True,
+                            help='Importing user. Owns records without an author; must be staff to import '
+                                 'tickets of other users.')
+        parser.add_argument('--import-format', choices=list(IMPORT_READERS),
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--checkpoint', help='Checkpoint name. Defaults to the absolute path of the file.')
+        parser.add_argument('--no-checkpoint', action='store_true', help='Always start from the first record.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        import_format = options['import_format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if import_format not in IMPORT_READERS:
+            raise CommandError(f'Unknown import format "{import_format}", use --import-format.')
+
+        try:
+            user = CustomUser.objects.get(username=options['user'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f'User "{options["user"]}" does not exist.')
+
+        checkpoint = None if options['no_checkpoint'] else options['checkpoint'] or os.path.abspath(path)
+        importer = TicketImporter(user, options['batch_size'], checkpoint)
+        start_position = importer.get_start_position()
+        if start_position:
+            self.stdout.write(f'Resuming after record {start_position}.')
+
+        imported = rejected = 0
+        started = time.perf_counter()
+        with open(path, newline='', encoding='utf-8') as source:
+            for position, batch_imported, errors in importer.run(IMPORT_READERS[import_format](source)):
+                imported += batch_imported
+                rejected += len(errors)
+                for error in errors:
+                    self.stderr.write(f'Record {error["index"]}: {error["errors"]}')
+                rate = imported / (time.perf_counter() - started)
+                self.stdout.write(f'{position} records read, {imported} imported, {rejected} rejected, '
+                                  f'{rate:.0f} tickets/s')
+
+        self.stdout.write(self.style.SUCCESS(f'Import finished: {imported} imported, {rejected} rejected.'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from helpdesk.stats import reconcile_ticket_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ticket counters behind /api/ticket/stats/ from the ticket table. ' \
+           'Meant to be run periodically, e.g. from cron.'
+
+    def handle(self, *args, **options):
+        corrected = reconcile_ticket_stats()
+        self.stdout.write(self.style.SUCCESS(f'Ticket stats reconciled, {corrected} counters corrected.'))
@@ -0,0 +1,58 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from helpdesk.tasks import Worker, get_task_queue
+
+
+def run_worker(burst):
+    worker = Worker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(burst=burst)
+
+
+class Command(BaseCommand):
+    help = 'Run background workers for the jobs queued by ticket events: search indexing and stats counters. ' \
+           'Stop them with SIGTERM or Ctrl+C, a worker finishes its current job first.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--recover', action='store_true',
+                            help='Requeue jobs left running by workers that were killed. '
+                                 'Only use it when no other worker is running.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1:
+            raise CommandError('--processes must be at least 1.')
+
+        if options['recover']:
+            recovered = get_task_queue().recover()
+            self.stdout.write(f'{recovered} interrupted jobs requeued.')
+
+        if options['processes'] == 1:
+            processed = Worker().run(burst=options['burst'])
+            self.stdout.write(self.style.SUCCESS(f'Worker stopped, {processed} jobs processed.'))
+            return
+
+        # Children must open their own database connections.
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=run_worker, args=(options['burst'],))
+                     for _ in range(options['processes'])]
+        for process in processes:
+            process.start()
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS(f'{len(processes)} workers stopped.'))
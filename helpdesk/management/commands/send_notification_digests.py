@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from helpdesk.notifications import send_notification_digests
+
+
+class Command(BaseCommand):
+    help = 'Send ticket authors a digest of the status changes and comments made by staff since the last one. ' \
+           'Meant to be run every minute or so, e.g. from cron; HELPDESK_NOTIFICATION_DIGEST_WINDOW sets how long ' \
+           'notifications are collected before a digest goes out.'
+
+    def handle(self, *args, **options):
+        sent = send_notification_digests()
+        self.stdout.write(self.style.SUCCESS(f'{sent} notification digests sent.'))
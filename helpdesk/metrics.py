@@ -0,0 +1,191 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from django.core.cache.backends.locmem import LocMemCache
+from django_redis.cache import RedisCache
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_COUNT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100, 200]
+SIZE_BUCKETS = [256, 1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+# Metrics of the request being handled by the current thread or task.
+current_request_metrics = ContextVar('current_request_metrics', default=None)
+
+MISSING = object()
+
+
+class RequestMetrics:
+    """
+    Collects the queries and cache lookups of one request. Instances are
+    installed as a connection execute wrapper.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - started))
+
+    @property
+    def query_time(self):
+        return sum(duration for _, duration in self.queries)
+
+
+def record_cache_lookup(hits, misses):
+    metrics = current_request_metrics.get()
+    if metrics is not None:
+        metrics.cache_hits += hits
+        metrics.cache_misses += misses
+
+
+class InstrumentedCacheMixin:
+    """Counts the hits and misses of cache reads made during a request."""
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, MISSING, version=version)
+        if value is MISSING:
+            record_cache_lookup(0, 1)
+            return default
+        record_cache_lookup(1, 0)
+        return value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        # Some backends read many keys through get(), which must not count them twice.
+        token = current_request_metrics.set(None)
+        try:
+            values = super().get_many(keys, version=version)
+        finally:
+            current_request_metrics.reset(token)
+        record_cache_lookup(len(values), len(keys) - len(values))
+        return values
+
+
+class InstrumentedLocMemCache(InstrumentedCacheMixin, LocMemCache):
+    pass
+
+
+class InstrumentedRedisCache(InstrumentedCacheMixin, RedisCache):
+    pass
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def samples(self):
+        cumulative = 0
+        for upper_bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{upper_bound:g}', cumulative
+        yield '+Inf', self.count
+
+
+METRICS = [
+    ('helpdesk_requests_total', 'counter', 'Requests by view, method and status code.'),
+    ('helpdesk_slow_requests_total', 'counter', 'Requests that took longer than the slow request budget.'),
+    ('helpdesk_cache_hits_total', 'counter', 'Cache reads that found a value.'),
+    ('helpdesk_cache_misses_total', 'counter', 'Cache reads that found no value.'),
+    ('helpdesk_request_duration_seconds', 'histogram', 'Wall time of requests.'),
+    ('helpdesk_request_db_queries', 'histogram', 'Database queries per request.'),
+    ('helpdesk_request_db_duration_seconds', 'histogram', 'Database time per request.'),
+    ('helpdesk_response_size_bytes', 'histogram', 'Size of non-streaming response bodies.'),
+]
+
+HISTOGRAM_BUCKETS = {
+    'helpdesk_request_duration_seconds': DURATION_BUCKETS,
+    'helpdesk_request_db_queries': QUERY_COUNT_BUCKETS,
+    'helpdesk_request_db_duration_seconds': DURATION_BUCKETS,
+    'helpdesk_response_size_bytes': SIZE_BUCKETS,
+}
+
+
+def format_labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class MetricsRegistry:
+    """
+    Aggregates request metrics of this process and renders them in the
+    Prometheus text format. Every worker process keeps its own registry,
+    so each one is scraped separately.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {name: {} for name, metric_type, _ in METRICS if metric_type == 'counter'}
+            self.histograms = {name: {} for name in HISTOGRAM_BUCKETS}
+
+    def increment(self, name, labels, value=1):
+        self.counters[name][labels] = self.counters[name].get(labels, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self.histograms[name]
+        if labels not in histograms:
+            histograms[labels] = Histogram(HISTOGRAM_BUCKETS[name])
+        histograms[labels].observe(value)
+
+    def observe_request(self, view, method, status, duration, metrics, size, slow):
+        labels = (('view', view), ('method', method))
+        with self.lock:
+            self.increment('helpdesk_requests_total', labels + (('status', status),))
+            if slow:
+                self.increment('helpdesk_slow_requests_total', labels)
+            if metrics.cache_hits:
+                self.increment('helpdesk_cache_hits_total', labels, metrics.cache_hits)
+            if metrics.cache_misses:
+                self.increment('helpdesk_cache_misses_total', labels, metrics.cache_misses)
+            self.observe('helpdesk_request_duration_seconds', labels, duration)
+            self.observe('helpdesk_request_db_queries', labels, len(metrics.queries))
+            self.observe('helpdesk_request_db_duration_seconds', labels, metrics.query_time)
+            if size is not None:
+                self.observe('helpdesk_response_size_bytes', labels, size)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, metric_type, description in METRICS:
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                if metric_type == 'counter':
+                    for labels, value in sorted(self.counters[name].items()):
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+                    continue
+                for labels, histogram in sorted(self.histograms[name].items()):
+                    for upper_bound, count in histogram.samples():
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", upper_bound),))} {count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum:g}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
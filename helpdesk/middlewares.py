@@ -1,32 +1,132 @@
+import logging
+import time
+from contextlib import ExitStack
 from datetime import datetime
 
 from django.contrib import messages
 from django.contrib.auth import logout
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy
 from django.utils.deprecation import MiddlewareMixin
 
-from config.settings import INACTIVITY_TIME_LIMIT
+from config.settings import INACTIVITY_TIME_LIMIT, ACTIVITY_TRACKING, ACTIVITY_WRITE_INTERVAL, METRICS_ENABLED, \
+    METRICS_SLOW_REQUEST_BUDGET, METRICS_SLOW_QUERY_LOG_LIMIT
+from helpdesk.metrics import RequestMetrics, current_request_metrics, registry
+
+logger = logging.getLogger('helpdesk.metrics')
+
+ACTIVITY_SESSION_KEY = 'activity_tracking'
+
+
+def get_activity_key(request):
+    return f'activity:{request.session.session_key}'
+
+
+def get_action_counter_key(request):
+    return f'action-counter:{request.session.session_key}'
 
 
 class AutoLogout(MiddlewareMixin):
 
     def process_request(self, request):
         if request.user.is_authenticated and not request.user.is_staff:
-            now = datetime.now()
-            last_activity_time = request.session.get('last_activity_time', now.isoformat())
-            inactivity_period = now - datetime.fromisoformat(last_activity_time)
-            if inactivity_period.seconds > INACTIVITY_TIME_LIMIT:
-                logout(request)
-                return HttpResponseRedirect(reverse_lazy('login'))
-            request.session['last_activity_time'] = now.isoformat()
+            if ACTIVITY_TRACKING == 'cache':
+                return self.track_in_cache(request)
+            return self.track_in_session(request)
+
+    def track_in_session(self, request):
+        now = datetime.now()
+        last_activity_time = request.session.get('last_activity_time', now.isoformat())
+        inactivity_period = now - datetime.fromisoformat(last_activity_time)
+        if inactivity_period.seconds > INACTIVITY_TIME_LIMIT:
+            return self.logout(request)
+        request.session['last_activity_time'] = now.isoformat()
+
+    def track_in_cache(self, request):
+        now = time.time()
+        activity_key = get_activity_key(request)
+        last_activity_time = cache.get(activity_key)
+
+        if last_activity_time is None:
+            # The key expires one write interval after the limit, so once it
+            # was seeded a missing key means the user stayed inactive.
+            if request.session.get(ACTIVITY_SESSION_KEY):
+                return self.logout(request)
+            request.session[ACTIVITY_SESSION_KEY] = True
+
+        elif now - last_activity_time > INACTIVITY_TIME_LIMIT:
+            return self.logout(request)
+
+        if last_activity_time is None or now - last_activity_time >= ACTIVITY_WRITE_INTERVAL:
+            cache.set(activity_key, now, INACTIVITY_TIME_LIMIT + ACTIVITY_WRITE_INTERVAL)
+
+    def logout(self, request):
+        if ACTIVITY_TRACKING == 'cache':
+            cache.delete_many([get_activity_key(request), get_action_counter_key(request)])
+        logout(request)
+        return HttpResponseRedirect(reverse_lazy('login'))
 
 
 class CounterUserAction(MiddlewareMixin):
 
     def process_request(self, request):
         if request.user.is_authenticated and not request.user.is_staff and request.method == 'GET':
+            if ACTIVITY_TRACKING == 'cache':
+                counter_key = get_action_counter_key(request)
+                cache.add(counter_key, 0, request.session.get_expiry_age())
+                request.action_counter = cache.incr(counter_key)
+                return
+
             counter_action = request.session.get('counter_action', 0)
             counter_action += 1
             request.session['counter_action'] = counter_action
             messages.info(request, f'{counter_action}')
+
+
+class RequestInstrumentation:
+    """
+    Records the wall time, database queries, cache lookups and response
+    size of every request under its URL name, and logs requests slower than
+    METRICS_SLOW_REQUEST_BUDGET seconds together with their SQL.
+
+    Queries run while a streaming response is consumed happen after the
+    middleware returns and are not counted.
+    """
+
+    def __init__(self, get_response):
+        if not METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_request_metrics.set(metrics)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            current_request_metrics.reset(token)
+        duration = time.perf_counter() - started
+
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        size = None if response.streaming else len(response.content)
+        slow = duration > METRICS_SLOW_REQUEST_BUDGET
+        registry.observe_request(view, request.method, response.status_code, duration, metrics, size, slow)
+        if slow:
+            self.log_slow_request(request, view, duration, metrics)
+        return response
+
+    def log_slow_request(self, request, view, duration, metrics):
+        queries = '\n'.join(f'  {query_time * 1000:8.1f} ms  {sql}'
+                            for sql, query_time in metrics.queries[:METRICS_SLOW_QUERY_LOG_LIMIT])
+        if len(metrics.queries) > METRICS_SLOW_QUERY_LOG_LIMIT:
+            queries += f'\n  ... {len(metrics.queries) - METRICS_SLOW_QUERY_LOG_LIMIT} more queries'
+        logger.warning('Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms\n%s',
+                       request.method, request.get_full_path(), view, duration * 1000,
+                       len(metrics.queries), metrics.query_time * 1000, queries)
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('CREATE VIRTUAL TABLE helpdesk_ticket_fts USING fts5(title, description)')
+    schema_editor.execute('CREATE VIRTUAL TABLE helpdesk_comment_fts USING fts5(ticket_id UNINDEXED, body)')
+    schema_editor.execute('INSERT INTO helpdesk_ticket_fts (rowid, title, description) '
+                          'SELECT id, title, description FROM helpdesk_ticket')
+    schema_editor.execute('INSERT INTO helpdesk_comment_fts (rowid, ticket_id, body) '
+                          'SELECT id, ticket_id, body FROM helpdesk_comment')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS helpdesk_ticket_fts')
+    schema_editor.execute('DROP TABLE IF EXISTS helpdesk_comment_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk', '0005_ticket_comment_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
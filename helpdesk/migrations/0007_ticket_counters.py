@@ -0,0 +1,69 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:25
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_ticket_counters(apps, schema_editor):
+    Ticket = apps.get_model('helpdesk', 'Ticket')
+    TicketCounter = apps.get_model('helpdesk', 'TicketCounter')
+    UserTicketCounter = apps.get_model('helpdesk', 'UserTicketCounter')
+
+    TicketCounter.objects.bulk_create([
+        TicketCounter(**row) for row in Ticket.objects.values('status', 'priority').annotate(count=models.Count('id'))
+    ])
+    UserTicketCounter.objects.bulk_create([
+        UserTicketCounter(user_id=row['user'], status=row['status'], count=row['count'])
+        for row in Ticket.objects.values('user', 'status').annotate(count=models.Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk', '0006_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompletionTimeBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('upper_bound', models.PositiveIntegerField(unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Active'), (2, 'Processed'), (3, 'Rejected'), (4, 'Restored'), (5, 'Completed')])),
+                ('priority', models.PositiveSmallIntegerField(choices=[(1, 'High'), (2, 'Medium'), (3, 'Low')])),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ticket',
+            name='completed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='UserTicketCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.PositiveSmallIntegerField(choices=[(1, 'Active'), (2, 'Processed'), (3, 'Rejected'), (4, 'Restored'), (5, 'Completed')])),
+                ('count', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticket_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ticketcounter',
+            constraint=models.UniqueConstraint(fields=('status', 'priority'), name='ticket_counter_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='userticketcounter',
+            constraint=models.UniqueConstraint(fields=('user', 'status'), name='user_ticket_counter_unique'),
+        ),
+        migrations.RunPython(fill_ticket_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.1.4 on 2026-10-18 18:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def fill_status_events(apps, schema_editor):
+    # The history before this migration is unknown, so every ticket starts
+    # with a single event in its current status at its creation time.
+    Ticket = apps.get_model('helpdesk', 'Ticket')
+    TicketStatusEvent = apps.get_model('helpdesk', 'TicketStatusEvent')
+    TicketStatusEvent.objects.bulk_create([
+        TicketStatusEvent(ticket_id=ticket_id, to_status=status, created=created)
+        for ticket_id, status, created in Ticket.objects.values_list('id', 'status', 'created').iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('helpdesk', '0007_ticket_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketStatusEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.PositiveSmallIntegerField(blank=True, choices=[(1, 'Active'), (2, 'Processed'), (3, 'Rejected'), (4, 'Restored'), (5, 'Completed')], null=True)),
+                ('to_status', models.PositiveSmallIntegerField(choices=[(1, 'Active'), (2, 'Processed'), (3, 'Rejected'), (4, 'Restored'), (5, 'Completed')])),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='status_events', to=settings.AUTH_USER_MODEL)),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_events', to='helpdesk.ticket')),
+            ],
+            options={
+                'ordering': ['created', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ticketstatusevent',
+            index=models.Index(fields=['ticket', 'created', 'id'], name='status_event_ticket_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketstatusevent',
+            index=models.Index(fields=['created'], name='status_event_created_idx'),
+        ),
+        migrations.RunPython(fill_status_events, migrations.RunPython.noop),
+    ]
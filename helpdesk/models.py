@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 
 class CustomUser(AbstractUser):
@@ -41,15 +42,43 @@ class Ticket(models.Model):
     priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=MEDIUM_PRIORITY)
     status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=ACTIVE_STATUS)
     created = models.DateTimeField(auto_now_add=True)
+    completed = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
 
     class Meta:
         ordering = ['-created']
         verbose_name = 'ticket'
         verbose_name_plural = 'tickets'
+        indexes = [
+            models.Index(fields=['-created', '-id'], name='ticket_created_idx'),
+            models.Index(fields=['user', '-created'], name='ticket_user_created_idx'),
+            models.Index(fields=['status', 'priority', '-created'], name='ticket_status_priority_idx'),
+        ]
+
+    # Added from the class body, the body of Meta cannot see the status constants.
+    Meta.indexes.append(
+        models.Index(fields=['-created'], condition=models.Q(status=RESTORED_STATUS), name='ticket_restored_idx')
+    )
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        ticket = super().from_db(db, field_names, values)
+        ticket.remember_counted_state()
+        return ticket
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using, fields)
+        if fields is None or {'user', 'user_id', 'status', 'priority'} & set(fields):
+            self.remember_counted_state()
+
+    def remember_counted_state(self):
+        """Record the saved state the stats counters hold the ticket in, unless part of it is deferred."""
+        if not {'user_id', 'status', 'priority'} & self.get_deferred_fields():
+            self.counted_state = (self.user_id, self.status, self.priority)
+
 
 class Comment(models.Model):
     DISCUSSION_TOPIC = 1
@@ -72,6 +101,108 @@ class Comment(models.Model):
         ordering = ['created']
         verbose_name = 'comment'
         verbose_name_plural = 'comments'
+        indexes = [
+            models.Index(fields=['ticket', 'created'], name='comment_ticket_created_idx'),
+        ]
 
     def __str__(self):
         return self.body
+
+
+class TicketStatusEvent(models.Model):
+    ticket = models.ForeignKey(Ticket, related_name='status_events', on_delete=models.CASCADE)
+    from_status = models.PositiveSmallIntegerField(choices=Ticket.STATUS_CHOICES, null=True, blank=True)
+    to_status = models.PositiveSmallIntegerField(choices=Ticket.STATUS_CHOICES)
+    changed_by = models.ForeignKey(CustomUser, related_name='status_events', null=True, blank=True,
+                                   on_delete=models.SET_NULL)
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(fields=['ticket', 'created', 'id'], name='status_event_ticket_idx'),
+            models.Index(fields=['created'], name='status_event_created_idx'),
+        ]
+
+
+class TicketCounter(models.Model):
+    status = models.PositiveSmallIntegerField(choices=Ticket.STATUS_CHOICES)
+    priority = models.PositiveSmallIntegerField(choices=Ticket.PRIORITY_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['status', 'priority'], name='ticket_counter_unique'),
+        ]
+
+
+class UserTicketCounter(models.Model):
+    user = models.ForeignKey(CustomUser, related_name='ticket_counters', on_delete=models.CASCADE)
+    status = models.PositiveSmallIntegerField(choices=Ticket.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'status'], name='user_ticket_counter_unique'),
+        ]
+
+
+class CompletionTimeBucket(models.Model):
+    upper_bound = models.PositiveIntegerField(unique=True)
+    count = models.IntegerField(default=0)
+
+
+class ImportCheckpoint(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    position = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+
+class QueuedTask(models.Model):
+    READY_STATUS = 1
+    RUNNING_STATUS = 2
+    DEAD_STATUS = 3
+
+    STATUS_CHOICES = [
+        (READY_STATUS, 'Ready'),
+        (RUNNING_STATUS, 'Running'),
+        (DEAD_STATUS, 'Dead'),
+    ]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    status = models.PositiveSmallIntegerField(choices=STATUS_CHOICES, default=READY_STATUS)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='queued_task_ready_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Notification(models.Model):
+    """
+    A change of a ticket its author should hear about. The ticket title is
+    copied, so the notification outlives a deleted ticket. `sent` is empty
+    until the notification went out in a digest.
+    """
+    recipient = models.ForeignKey(CustomUser, related_name='notifications', on_delete=models.CASCADE)
+    ticket_id = models.BigIntegerField()
+    ticket_title = models.CharField(max_length=100)
+    text = models.TextField()
+    created = models.DateTimeField(default=timezone.now)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['sent', 'recipient', 'created'], name='notification_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipient}: {self.text}'
@@ -0,0 +1,190 @@
+import http.client
+import json
+import logging
+import smtplib
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+from itertools import groupby
+from operator import attrgetter
+from urllib.parse import urlsplit
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from config.settings import NOTIFICATION_SENDER, NOTIFICATION_WEBHOOK_URL, NOTIFICATION_WEBHOOK_TIMEOUT, \
+    NOTIFICATION_DIGEST_WINDOW, NOTIFICATION_BATCH_SIZE
+from helpdesk.models import Ticket, Comment, Notification
+
+logger = logging.getLogger(__name__)
+
+Digest = namedtuple('Digest', ['recipient', 'notifications'])
+
+
+def status_notification(ticket, changed_status, user, comment=None, deleted=False):
+    """
+    Return the unsaved notification of a status change, or None when the
+    author changed their own ticket. Build it before a deleted ticket loses its id.
+    """
+    if user.id == ticket.user_id:
+        return None
+    status = dict(Ticket.STATUS_CHOICES)[changed_status]
+    text = f'{status} and deleted by {user.username}.' if deleted else f'{status} by {user.username}.'
+    if comment:
+        text += f' Comment: {comment}'
+    return Notification(recipient_id=ticket.user_id, ticket_id=ticket.id, ticket_title=ticket.title, text=text)
+
+
+def comment_notification(comment):
+    if comment.topic != Comment.DISCUSSION_TOPIC or comment.author_id == comment.ticket.user_id:
+        return None
+    return Notification(recipient_id=comment.ticket.user_id, ticket_id=comment.ticket_id,
+                        ticket_title=comment.ticket.title,
+                        text=f'New comment from {comment.author.username}: {comment.body}')
+
+
+def record_notifications(notifications):
+    Notification.objects.bulk_create([notification for notification in notifications if notification is not None])
+
+
+def format_digest(digest):
+    lines = [f'Hello {digest.recipient.first_name},', '', 'There are updates on your tickets:', '']
+    for ticket_id, notifications in groupby(digest.notifications, key=attrgetter('ticket_id')):
+        notifications = list(notifications)
+        lines.append(f'#{ticket_id} {notifications[0].ticket_title}')
+        lines.extend(f'  {notification.created:%d-%m-%Y %H:%M} {notification.text}' for notification in notifications)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+class EmailSender:
+    """Sends every digest as an email, the whole batch over one SMTP connection."""
+
+    def send(self, digests):
+        """Send the digests and return the ids of the recipients that could not be reached."""
+        connection = get_connection()
+        try:
+            connection.open()
+        except (smtplib.SMTPException, OSError):
+            logger.warning('Could not connect to the mail server', exc_info=True)
+            return [digest.recipient.id for digest in digests]
+
+        failed = []
+        try:
+            for digest in digests:
+                count = len(digest.notifications)
+                message = EmailMessage(subject=f'{count} update{"s" if count > 1 else ""} on your tickets',
+                                       body=format_digest(digest), to=[digest.recipient.email],
+                                       connection=connection)
+                try:
+                    message.send()
+                except (smtplib.SMTPException, OSError):
+                    logger.warning('Could not send the digest to %s', digest.recipient.email, exc_info=True)
+                    failed.append(digest.recipient.id)
+        finally:
+            connection.close()
+        return failed
+
+
+class WebhookSender:
+    """
+    Posts every digest as JSON to NOTIFICATION_WEBHOOK_URL, keeping one
+    HTTP connection alive for the whole batch.
+    """
+
+    def __init__(self, url=NOTIFICATION_WEBHOOK_URL, timeout=NOTIFICATION_WEBHOOK_TIMEOUT):
+        url = urlsplit(url)
+        self.connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.host = url.netloc
+        self.path = (url.path or '/') + (f'?{url.query}' if url.query else '')
+        self.timeout = timeout
+
+    def payload(self, digest):
+        return {
+            'recipient': {
+                'id': digest.recipient.id,
+                'username': digest.recipient.username,
+                'email': digest.recipient.email,
+            },
+            'notifications': [
+                {
+                    'ticket_id': notification.ticket_id,
+                    'ticket_title': notification.ticket_title,
+                    'text': notification.text,
+                    'created': notification.created,
+                }
+                for notification in digest.notifications
+            ],
+        }
+
+    def send(self, digests):
+        connection = self.connection_class(self.host, timeout=self.timeout)
+        failed = []
+        try:
+            for digest in digests:
+                try:
+                    connection.request('POST', self.path, json.dumps(self.payload(digest), cls=DjangoJSONEncoder),
+                                       {'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                except (http.client.HTTPException, OSError):
+                    logger.warning('Could not post the digest of %s', digest.recipient.username, exc_info=True)
+                    failed.append(digest.recipient.id)
+                    # The next request opens a new connection.
+                    connection.close()
+                    continue
+                if response.status >= 300:
+                    logger.warning('Webhook answered %s to the digest of %s', response.status,
+                                   digest.recipient.username)
+                    failed.append(digest.recipient.id)
+        finally:
+            connection.close()
+        return failed
+
+
+@lru_cache(maxsize=None)
+def get_notification_sender():
+    return import_string(NOTIFICATION_SENDER)()
+
+
+def send_notification_digests(now=None, sender=None):
+    """
+    Send a digest to every recipient whose oldest unsent notification is
+    older than NOTIFICATION_DIGEST_WINDOW and return the number of digests
+    sent. Notifications are claimed by setting `sent` before they go out, so
+    concurrent runs do not send them twice; those of unreachable recipients,
+    or of a batch whose sender raised, are released again for the next run.
+    """
+    now = now or timezone.now()
+    sender = sender or get_notification_sender()
+    pending = Notification.objects.filter(sent__isnull=True, created__lte=now)
+    due = pending.values('recipient_id').annotate(first=Min('created'))\
+        .filter(first__lte=now - timedelta(seconds=NOTIFICATION_DIGEST_WINDOW)).order_by('first')\
+        .values_list('recipient_id', flat=True)
+
+    sent = 0
+    failed = []
+    while True:
+        recipient_ids = list(due[:NOTIFICATION_BATCH_SIZE])
+        if not recipient_ids:
+            break
+        pending.filter(recipient_id__in=recipient_ids).update(sent=now)
+        notifications = Notification.objects.filter(recipient_id__in=recipient_ids, sent=now)\
+            .select_related('recipient').order_by('recipient_id', 'ticket_id', 'created', 'id')
+        digests = [Digest(recipient, list(group))
+                   for recipient, group in groupby(notifications, key=attrgetter('recipient'))]
+        try:
+            batch_failed = sender.send(digests)
+        except Exception:
+            # Release the whole run, an unexpected error must not leave the notifications claimed.
+            Notification.objects.filter(recipient_id__in=failed + recipient_ids, sent=now).update(sent=None)
+            raise
+        failed.extend(batch_failed)
+        sent += len(digests) - len(batch_failed)
+
+    if failed:
+        Notification.objects.filter(recipient_id__in=failed, sent=now).update(sent=None)
+    return sent
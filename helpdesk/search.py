@@ -0,0 +1,186 @@
+import re
+from functools import lru_cache
+
+from django.db import connection
+from django.db.models import Case, When, Value, IntegerField, Q
+from django.utils.module_loading import import_string
+
+from config.settings import SEARCH_BACKEND, SEARCH_RESULTS_LIMIT
+from helpdesk.models import Ticket, Comment
+from helpdesk.tasks import task
+
+
+class BaseSearchBackend:
+    """
+    Interface of the ticket search backends.
+
+    A backend keeps its own index of ticket titles, descriptions and comment
+    bodies and returns ticket ids ranked by relevance.
+    """
+
+    def index_ticket(self, ticket):
+        pass
+
+    def remove_ticket(self, ticket_id):
+        pass
+
+    def index_comment(self, comment):
+        pass
+
+    def remove_comment(self, comment_id):
+        pass
+
+    def add_tickets(self, tickets):
+        for ticket in tickets:
+            self.index_ticket(ticket)
+
+    def add_comments(self, comments):
+        for comment in comments:
+            self.index_comment(comment)
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, queryset, limit):
+        raise NotImplementedError
+
+    def filter_queryset(self, queryset, query):
+        """
+        Keep the SEARCH_RESULTS_LIMIT best matches of the query, annotated
+        with their `search_rank`, and tell whether more tickets matched.
+        """
+        ticket_ids = self.search(query, queryset, SEARCH_RESULTS_LIMIT + 1)
+        truncated = len(ticket_ids) > SEARCH_RESULTS_LIMIT
+        ticket_ids = ticket_ids[:SEARCH_RESULTS_LIMIT]
+        ranks = [When(id=ticket_id, then=Value(rank)) for rank, ticket_id in enumerate(ticket_ids)]
+        queryset = queryset.filter(id__in=ticket_ids)\
+            .annotate(search_rank=Case(*ranks, default=Value(len(ranks)), output_field=IntegerField()))
+        return queryset, truncated
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+    Index-free backend for databases without a full-text engine.
+    """
+
+    def search(self, query, queryset, limit):
+        search_filter = Q()
+        for term in query.split():
+            search_filter &= Q(title__icontains=term) | Q(description__icontains=term) | \
+                Q(comments__body__icontains=term)
+        return list(queryset.filter(search_filter).order_by('-created')
+                    .values_list('id', flat=True).distinct()[:limit])
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 backend. Tickets and comments live in two FTS5 tables whose
+    rowids are the ticket and comment ids, so updates are rowid lookups.
+    """
+    ticket_table = 'helpdesk_ticket_fts'
+    comment_table = 'helpdesk_comment_fts'
+    title_weight = 10.0
+
+    def create_tables(self, cursor):
+        cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.ticket_table} '
+                       f'USING fts5(title, description)')
+        cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.comment_table} '
+                       f'USING fts5(ticket_id UNINDEXED, body)')
+
+    def drop_tables(self, cursor):
+        cursor.execute(f'DROP TABLE IF EXISTS {self.ticket_table}')
+        cursor.execute(f'DROP TABLE IF EXISTS {self.comment_table}')
+
+    def fill_tables(self, cursor):
+        cursor.execute(f'INSERT INTO {self.ticket_table} (rowid, title, description) '
+                       f'SELECT id, title, description FROM helpdesk_ticket')
+        cursor.execute(f'INSERT INTO {self.comment_table} (rowid, ticket_id, body) '
+                       f'SELECT id, ticket_id, body FROM helpdesk_comment')
+
+    def index_ticket(self, ticket):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.ticket_table} WHERE rowid = %s', [ticket.id])
+            cursor.execute(f'INSERT INTO {self.ticket_table} (rowid, title, description) VALUES (%s, %s, %s)',
+                           [ticket.id, ticket.title, ticket.description])
+
+    def remove_ticket(self, ticket_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.ticket_table} WHERE rowid = %s', [ticket_id])
+
+    def index_comment(self, comment):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.comment_table} WHERE rowid = %s', [comment.id])
+            cursor.execute(f'INSERT INTO {self.comment_table} (rowid, ticket_id, body) VALUES (%s, %s, %s)',
+                           [comment.id, comment.ticket_id, comment.body])
+
+    def remove_comment(self, comment_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.comment_table} WHERE rowid = %s', [comment_id])
+
+    def add_tickets(self, tickets):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {self.ticket_table} (rowid, title, description) VALUES (%s, %s, %s)',
+                               [(ticket.id, ticket.title, ticket.description) for ticket in tickets])
+
+    def add_comments(self, comments):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {self.comment_table} (rowid, ticket_id, body) VALUES (%s, %s, %s)',
+                               [(comment.id, comment.ticket_id, comment.body) for comment in comments])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            self.drop_tables(cursor)
+            self.create_tables(cursor)
+            self.fill_tables(cursor)
+
+    def build_match_query(self, query):
+        terms = re.findall(r'\w+', query)
+        return ' '.join(f'"{term}"*' for term in terms)
+
+    def search(self, query, queryset, limit):
+        match_query = self.build_match_query(query)
+        if not match_query:
+            return []
+
+        visible_sql, visible_params = queryset.order_by().values('id').query.sql_with_params()
+        sql = (
+            f'SELECT ticket_id FROM ('
+            f'SELECT rowid AS ticket_id, bm25({self.ticket_table}, {self.title_weight}, 1.0) AS score '
+            f'FROM {self.ticket_table} WHERE {self.ticket_table} MATCH %s '
+            f'UNION ALL '
+            f'SELECT ticket_id, bm25({self.comment_table}) AS score '
+            f'FROM {self.comment_table} WHERE {self.comment_table} MATCH %s'
+            f') WHERE ticket_id IN ({visible_sql}) '
+            f'GROUP BY ticket_id ORDER BY MIN(score) LIMIT %s'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [match_query, match_query, *visible_params, limit])
+            return [row[0] for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    return import_string(SEARCH_BACKEND)()
+
+
+@task
+def index_tickets(ticket_ids):
+    """Index the tickets as they are now, removing those that were deleted."""
+    backend = get_search_backend()
+    tickets = Ticket.objects.only('title', 'description').in_bulk(ticket_ids)
+    for ticket_id in ticket_ids:
+        if ticket_id in tickets:
+            backend.index_ticket(tickets[ticket_id])
+        else:
+            backend.remove_ticket(ticket_id)
+
+
+@task
+def index_comments(comment_ids):
+    backend = get_search_backend()
+    comments = Comment.objects.only('ticket_id', 'body').in_bulk(comment_ids)
+    for comment_id in comment_ids:
+        if comment_id in comments:
+            backend.index_comment(comments[comment_id])
+        else:
+            backend.remove_comment(comment_id)
@@ -1,11 +1,102 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
 from config import settings
+from helpdesk.API.authentication import token_cache
+from helpdesk.cache import bump_ticket_version
+from helpdesk.events import publish_event, ticket_event, comment_event, TICKET_CREATED, TICKET_STATUS, \
+    TICKET_DELETED
+from helpdesk.models import Ticket, Comment, TicketStatusEvent
+from helpdesk.notifications import comment_notification, record_notifications
+from helpdesk.search import index_tickets, index_comments
+from helpdesk.stats import count_ticket_changes, count_deleted_tickets
+from helpdesk.tasks import enqueue
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
-def create_auth_token(sender, instance=None, created=False, **kwargs):
+def create_auth_token(sender, instance=None, created=False, update_fields=None, **kwargs):
     if created:
         Token.objects.create(user=instance)
+    elif update_fields is None or set(update_fields) & set(token_cache.user_fields):
+        token_cache.forget_user(*Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_auth_token(sender, instance=None, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=Ticket)
+def index_ticket(sender, instance=None, update_fields=None, **kwargs):
+    if update_fields is None or {'title', 'description'} & set(update_fields):
+        enqueue(index_tickets, [instance.id])
+
+
+@receiver(post_delete, sender=Ticket)
+def remove_ticket_from_index(sender, instance=None, **kwargs):
+    enqueue(index_tickets, [instance.id])
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance=None, **kwargs):
+    enqueue(index_comments, [instance.id])
+
+
+@receiver(post_delete, sender=Comment)
+def remove_comment_from_index(sender, instance=None, **kwargs):
+    enqueue(index_comments, [instance.id])
+
+
+@receiver(post_save, sender=Ticket)
+@receiver(post_delete, sender=Ticket)
+def invalidate_ticket_cache(sender, instance=None, **kwargs):
+    bump_ticket_version(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_ticket_cache(sender, instance=None, **kwargs):
+    bump_ticket_version(instance.ticket_id)
+
+
+@receiver(post_save, sender=Ticket)
+def publish_ticket_event(sender, instance=None, created=False, update_fields=None, **kwargs):
+    if created:
+        publish_event(ticket_event(TICKET_CREATED, instance))
+    elif update_fields is not None and 'status' in update_fields:
+        publish_event(ticket_event(TICKET_STATUS, instance))
+
+
+@receiver(post_delete, sender=Ticket)
+def publish_ticket_deleted_event(sender, instance=None, **kwargs):
+    publish_event(ticket_event(TICKET_DELETED, instance))
+
+
+@receiver(post_save, sender=Comment)
+def publish_comment_event(sender, instance=None, created=False, **kwargs):
+    if created:
+        publish_event(comment_event(instance))
+
+
+@receiver(post_save, sender=Comment)
+def notify_ticket_author(sender, instance=None, created=False, **kwargs):
+    if created:
+        record_notifications([comment_notification(instance)])
+
+
+@receiver(post_save, sender=Ticket)
+def count_ticket(sender, instance=None, created=False, **kwargs):
+    count_ticket_changes([instance], created)
+
+
+@receiver(post_delete, sender=Ticket)
+def count_deleted_ticket(sender, instance=None, **kwargs):
+    count_deleted_tickets([instance])
+
+
+@receiver(post_save, sender=Ticket)
+def create_initial_status_event(sender, instance=None, created=False, **kwargs):
+    if created:
+        TicketStatusEvent.objects.create(ticket=instance, to_status=instance.status, changed_by_id=instance.user_id,
+                                         created=instance.created)
@@ -0,0 +1,292 @@
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import F, Count, Sum
+
+from config.settings import STATS_USERS_LIMIT
+from helpdesk.models import CustomUser, Ticket, TicketCounter, UserTicketCounter, CompletionTimeBucket, \
+    TicketStatusEvent
+from helpdesk.tasks import task, enqueue
+
+# Upper bounds in seconds of the completion time histogram, from a minute to a year.
+COMPLETION_TIME_BUCKETS = [
+    60, 5 * 60, 15 * 60, 30 * 60,
+    60 * 60, 2 * 60 * 60, 4 * 60 * 60, 8 * 60 * 60,
+    24 * 60 * 60, 2 * 24 * 60 * 60, 4 * 24 * 60 * 60, 7 * 24 * 60 * 60,
+    14 * 24 * 60 * 60, 30 * 24 * 60 * 60, 90 * 24 * 60 * 60, 365 * 24 * 60 * 60,
+]
+
+
+def get_ticket_state(ticket):
+    return ticket.user_id, ticket.status, ticket.priority
+
+
+def get_completion_bucket(ticket):
+    seconds = (ticket.completed - ticket.created).total_seconds()
+    for upper_bound in COMPLETION_TIME_BUCKETS:
+        if seconds <= upper_bound:
+            return upper_bound
+    return COMPLETION_TIME_BUCKETS[-1]
+
+
+def is_completed(ticket):
+    return ticket.status == Ticket.COMPLETED_STATUS and ticket.completed is not None
+
+
+def add_to_counters(model, deltas):
+    """
+    Add every delta to the counter row matching its lookup with a single
+    UPDATE, creating missing rows only when the counter grows.
+    """
+    for lookup, delta in deltas:
+        if not delta:
+            continue
+        counters = model.objects.filter(**lookup)
+        if not counters.update(count=F('count') + delta) and delta > 0:
+            model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+            counters.update(count=F('count') + delta)
+
+
+def update_counters(state_deltas, completion_deltas=None):
+    status_priority_deltas = Counter()
+    user_status_deltas = Counter()
+    for (user_id, status, priority), delta in state_deltas.items():
+        status_priority_deltas[(status, priority)] += delta
+        user_status_deltas[(user_id, status)] += delta
+
+    with transaction.atomic():
+        add_to_counters(TicketCounter, [
+            ({'status': status, 'priority': priority}, delta)
+            for (status, priority), delta in status_priority_deltas.items()
+        ])
+        add_to_counters(UserTicketCounter, [
+            ({'user_id': user_id, 'status': status}, delta)
+            for (user_id, status), delta in user_status_deltas.items()
+        ])
+        add_to_counters(CompletionTimeBucket, [
+            ({'upper_bound': upper_bound}, delta)
+            for upper_bound, delta in (completion_deltas or {}).items()
+        ])
+
+
+@task
+def apply_counter_deltas(state_deltas, completion_deltas):
+    update_counters({tuple(state): delta for *state, delta in state_deltas},
+                    {upper_bound: delta for upper_bound, delta in completion_deltas})
+
+
+def queue_counter_update(state_deltas, completion_deltas):
+    """
+    Leave the counter UPDATEs to a background worker. Counters may lag
+    behind the tickets until it runs; reconcile_ticket_stats repairs them
+    should a job be lost.
+    """
+    enqueue(apply_counter_deltas,
+            [[*state, delta] for state, delta in state_deltas.items() if delta],
+            [[upper_bound, delta] for upper_bound, delta in completion_deltas.items() if delta])
+
+
+def count_ticket_changes(tickets, created=False):
+    """
+    Move the tickets from the counters of the state they were loaded in to
+    the counters of their current state. Tickets that were not loaded from
+    the database and are not new are skipped.
+    """
+    state_deltas = Counter()
+    completion_deltas = Counter()
+
+    for ticket in tickets:
+        old_state = None if created else getattr(ticket, 'counted_state', None)
+        if old_state is None and not created:
+            continue
+
+        new_state = get_ticket_state(ticket)
+        # The ticket is saved, so its current state is what the counters hold from now on.
+        ticket.remember_counted_state()
+        if old_state == new_state:
+            continue
+
+        state_deltas[new_state] += 1
+        if old_state is not None:
+            state_deltas[old_state] -= 1
+        if is_completed(ticket) and (old_state is None or old_state[1] != Ticket.COMPLETED_STATUS):
+            completion_deltas[get_completion_bucket(ticket)] += 1
+
+    if state_deltas:
+        queue_counter_update(state_deltas, completion_deltas)
+
+
+def count_deleted_tickets(tickets):
+    state_deltas = Counter()
+    completion_deltas = Counter()
+
+    for ticket in tickets:
+        state_deltas[getattr(ticket, 'counted_state', None) or get_ticket_state(ticket)] -= 1
+        if is_completed(ticket):
+            completion_deltas[get_completion_bucket(ticket)] -= 1
+
+    if state_deltas:
+        queue_counter_update(state_deltas, completion_deltas)
+
+
+def get_median_completion_time():
+    buckets = dict(CompletionTimeBucket.objects.filter(count__gt=0).values_list('upper_bound', 'count'))
+    half = sum(buckets.values()) / 2
+    if not half:
+        return None
+
+    cumulative = 0
+    lower_bound = 0
+    for upper_bound in COMPLETION_TIME_BUCKETS:
+        count = buckets.get(upper_bound, 0)
+        if count and cumulative + count >= half:
+            return round(lower_bound + (upper_bound - lower_bound) * (half - cumulative) / count)
+        cumulative += count
+        lower_bound = upper_bound
+    return None
+
+
+def get_ticket_stats():
+    status_names = dict(Ticket.STATUS_CHOICES)
+    priority_names = dict(Ticket.PRIORITY_CHOICES)
+
+    by_status_priority = {status: {priority: 0 for priority in priority_names.values()}
+                          for status in status_names.values()}
+    for status, priority, count in TicketCounter.objects.values_list('status', 'priority', 'count'):
+        by_status_priority[status_names[status]][priority_names[priority]] = count
+
+    top_users = UserTicketCounter.objects.values('user').annotate(total=Sum('count'))\
+        .filter(total__gt=0).order_by('-total', 'user')[:STATS_USERS_LIMIT]
+    users = {row['user']: {'total': row['total'], 'by_status': defaultdict(int)} for row in top_users}
+    for user_id, status, count in UserTicketCounter.objects.filter(user__in=users, count__gt=0)\
+            .values_list('user', 'status', 'count'):
+        users[user_id]['by_status'][status_names[status]] = count
+    usernames = dict(CustomUser.objects.filter(id__in=users).values_list('id', 'username'))
+
+    return {
+        'total': sum(sum(counts.values()) for counts in by_status_priority.values()),
+        'by_status_priority': by_status_priority,
+        'by_status': {status: sum(counts.values()) for status, counts in by_status_priority.items()},
+        'restored_queue': sum(by_status_priority[status_names[Ticket.RESTORED_STATUS]].values()),
+        'median_completion_time': get_median_completion_time(),
+        'users': [
+            {'id': user_id, 'username': usernames.get(user_id), 'total': data['total'],
+             'by_status': dict(data['by_status'])}
+            for user_id, data in users.items()
+        ],
+    }
+
+
+def reconcile_ticket_stats():
+    """
+    Recompute all counters from the ticket table and return how many
+    counter rows had drifted from it.
+    """
+    with transaction.atomic():
+        old_counters = {
+            **{('status', row[0], row[1]): row[2]
+               for row in TicketCounter.objects.values_list('status', 'priority', 'count')},
+            **{('user', row[0], row[1]): row[2]
+               for row in UserTicketCounter.objects.values_list('user', 'status', 'count')},
+            **{('completion', row[0]): row[1]
+               for row in CompletionTimeBucket.objects.values_list('upper_bound', 'count')},
+        }
+
+        tickets = Ticket.objects.order_by()
+        status_priority_counts = tickets.values_list('status', 'priority').annotate(count=Count('id'))
+        user_status_counts = tickets.values_list('user', 'status').annotate(count=Count('id'))
+        completion_counts = Counter(
+            get_completion_bucket(ticket)
+            for ticket in tickets.filter(status=Ticket.COMPLETED_STATUS, completed__isnull=False)
+            .only('created', 'completed').iterator()
+        )
+
+        new_counters = {
+            **{('status', status, priority): count for status, priority, count in status_priority_counts},
+            **{('user', user_id, status): count for user_id, status, count in user_status_counts},
+            **{('completion', upper_bound): count for upper_bound, count in completion_counts.items()},
+        }
+
+        TicketCounter.objects.all().delete()
+        UserTicketCounter.objects.all().delete()
+        CompletionTimeBucket.objects.all().delete()
+        TicketCounter.objects.bulk_create([
+            TicketCounter(status=key[1], priority=key[2], count=count)
+            for key, count in new_counters.items() if key[0] == 'status'
+        ])
+        UserTicketCounter.objects.bulk_create([
+            UserTicketCounter(user_id=key[1], status=key[2], count=count)
+            for key, count in new_counters.items() if key[0] == 'user'
+        ])
+        CompletionTimeBucket.objects.bulk_create([
+            CompletionTimeBucket(upper_bound=key[1], count=count)
+            for key, count in new_counters.items() if key[0] == 'completion'
+        ])
+
+    return sum(1 for key in old_counters.keys() | new_counters.keys()
+               if old_counters.get(key, 0) != new_counters.get(key, 0))
+
+
+# Seconds between two timestamp columns for each supported database.
+DURATION_SQL = {
+    'sqlite': '(julianday({end}) - julianday({start})) * 86400',
+    'postgresql': 'EXTRACT(EPOCH FROM {end} - {start})',
+}
+
+
+def get_time_in_status(percentiles, start=None, end=None):
+    """
+    Return the count, average, maximum and the given percentiles of the
+    time tickets spent in every status before leaving it.
+
+    Each status event is paired with the next event of its ticket through
+    LEAD() and the percentiles are read from CUME_DIST() over the resulting
+    durations, so the whole computation runs in one SQL query. Only
+    intervals that started in [start, end) are counted; intervals that are
+    still open are left out.
+    """
+    table = connection.ops.quote_name(TicketStatusEvent._meta.db_table)
+    duration = DURATION_SQL[connection.vendor].format(start='created', end='left_at')
+    percentile_columns = ''.join(
+        f', MIN(CASE WHEN cumulative >= %s THEN duration END)' for _ in percentiles
+    )
+    sql = f'''
+        WITH intervals AS (
+            SELECT to_status AS status, created,
+                   LEAD(created) OVER (PARTITION BY ticket_id ORDER BY created, id) AS left_at
+            FROM {table}
+            WHERE created >= %s
+        ), durations AS (
+            SELECT status, {duration} AS duration
+            FROM intervals
+            WHERE left_at IS NOT NULL AND created < %s
+        ), ranked AS (
+            SELECT status, duration, CUME_DIST() OVER (PARTITION BY status ORDER BY duration) AS cumulative
+            FROM durations
+        )
+        SELECT status, COUNT(*), AVG(duration), MAX(duration){percentile_columns}
+        FROM ranked
+        GROUP BY status
+        ORDER BY status
+    '''
+    params = [
+        connection.ops.adapt_datetimefield_value(start or datetime.min.replace(tzinfo=dt_timezone.utc)),
+        connection.ops.adapt_datetimefield_value(end or datetime.max.replace(tzinfo=dt_timezone.utc)),
+        *[percentile / 100 for percentile in percentiles],
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    status_names = dict(Ticket.STATUS_CHOICES)
+    return [
+        {
+            'status': status_names[status],
+            'count': count,
+            'average': round(average, 1),
+            'max': round(maximum, 1),
+            'percentiles': {str(percentile): round(value, 1) for percentile, value in zip(percentiles, values)},
+        }
+        for status, count, average, maximum, *values in rows
+    ]
@@ -0,0 +1,222 @@
+import json
+import logging
+import time
+import uuid
+from collections import namedtuple
+from datetime import timedelta
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.db import connection, close_old_connections, transaction
+from django.dispatch import receiver
+from django.test.signals import setting_changed
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from config.settings import TASK_QUEUE_URL, TASK_MAX_ATTEMPTS, TASK_RETRY_DELAY, TASK_POLL_INTERVAL
+from helpdesk.models import QueuedTask
+
+logger = logging.getLogger(__name__)
+
+# Task functions by name, filled by the @task decorator.
+TASKS = {}
+
+# `receipt` identifies the job to its backend when it is acknowledged.
+Job = namedtuple('Job', ['name', 'args', 'attempts', 'receipt'])
+
+
+def task(function):
+    """Register a function that can be run in the background with enqueue()."""
+    function.task_name = f'{function.__module__}.{function.__name__}'
+    TASKS[function.task_name] = function
+    return function
+
+
+def enqueue(function, *args):
+    """
+    Queue a call of the task function. Arguments must be JSON serializable.
+    The job becomes visible to workers once the current transaction commits.
+    """
+    get_task_queue().enqueue(function.task_name, list(args))
+
+
+class DatabaseTaskQueue:
+    """
+    Queue kept in the QueuedTask table. Jobs are inserted in the transaction
+    of the change that queued them and claimed with a conditional UPDATE, so
+    several workers never run the same job. Dead jobs stay in the table.
+    """
+
+    def enqueue(self, name, args):
+        QueuedTask.objects.create(name=name, args=args)
+
+    def dequeue(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.claim()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(TASK_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    def claim(self):
+        ready = QueuedTask.objects.filter(status=QueuedTask.READY_STATUS, available_at__lte=timezone.now())
+        for queued_task in ready.order_by('available_at', 'id')[:10]:
+            claimed = QueuedTask.objects.filter(id=queued_task.id, status=QueuedTask.READY_STATUS)\
+                .update(status=QueuedTask.RUNNING_STATUS)
+            if claimed:
+                return Job(queued_task.name, queued_task.args, queued_task.attempts, queued_task.id)
+        return None
+
+    def ack(self, job):
+        QueuedTask.objects.filter(id=job.receipt).delete()
+
+    def retry(self, job, delay, error):
+        QueuedTask.objects.filter(id=job.receipt).update(status=QueuedTask.READY_STATUS,
+                                                         attempts=job.attempts + 1,
+                                                         available_at=timezone.now() + timedelta(seconds=delay),
+                                                         last_error=error)
+
+    def dead(self, job, error):
+        QueuedTask.objects.filter(id=job.receipt).update(status=QueuedTask.DEAD_STATUS,
+                                                         attempts=job.attempts + 1,
+                                                         last_error=error)
+
+    def recover(self):
+        return QueuedTask.objects.filter(status=QueuedTask.RUNNING_STATUS).update(status=QueuedTask.READY_STATUS)
+
+
+class RedisTaskQueue:
+    """
+    Queue kept in Redis lists. Workers move a job atomically from the ready
+    list to the processing list and remove it from there once it is done.
+    Retries wait in a sorted set scored by the time they become due, jobs
+    that failed TASK_MAX_ATTEMPTS times end up in the dead-letter list.
+    """
+    ready_key = 'helpdesk:tasks'
+    processing_key = 'helpdesk:tasks:processing'
+    delayed_key = 'helpdesk:tasks:delayed'
+    dead_key = 'helpdesk:tasks:dead'
+
+    # Move due retries to the ready list in one step, so no job is lost between the two.
+    promote_script = '''
+        local messages = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+        for _, message in ipairs(messages) do
+            redis.call('ZREM', KEYS[1], message)
+            redis.call('LPUSH', KEYS[2], message)
+        end
+        return #messages
+    '''
+
+    def __init__(self, url=TASK_QUEUE_URL):
+        self.client = redis.Redis.from_url(url)
+        self.promote = self.client.register_script(self.promote_script)
+
+    def encode(self, name, args, attempts=0, error=None):
+        return json.dumps({'id': uuid.uuid4().hex, 'name': name, 'args': args, 'attempts': attempts, 'error': error})
+
+    def enqueue(self, name, args):
+        message = self.encode(name, args)
+        transaction.on_commit(lambda: self.push(message))
+
+    def push(self, message):
+        try:
+            self.client.lpush(self.ready_key, message)
+        except redis.RedisError:
+            logger.warning('Could not queue task %s', message, exc_info=True)
+
+    def dequeue(self, timeout):
+        self.promote(keys=[self.delayed_key, self.ready_key], args=[time.time()])
+        if timeout:
+            message = self.client.blmove(self.ready_key, self.processing_key, timeout, 'RIGHT', 'LEFT')
+        else:
+            message = self.client.lmove(self.ready_key, self.processing_key, 'RIGHT', 'LEFT')
+        if message is None:
+            return None
+        data = json.loads(message)
+        return Job(data['name'], data['args'], data['attempts'], message)
+
+    def ack(self, job):
+        self.client.lrem(self.processing_key, 1, job.receipt)
+
+    def retry(self, job, delay, error):
+        pipeline = self.client.pipeline()
+        pipeline.lrem(self.processing_key, 1, job.receipt)
+        pipeline.zadd(self.delayed_key, {self.encode(job.name, job.args, job.attempts + 1, error): time.time() + delay})
+        pipeline.execute()
+
+    def dead(self, job, error):
+        pipeline = self.client.pipeline()
+        pipeline.lrem(self.processing_key, 1, job.receipt)
+        pipeline.lpush(self.dead_key, self.encode(job.name, job.args, job.attempts + 1, error))
+        pipeline.execute()
+
+    def recover(self):
+        recovered = 0
+        while self.client.lmove(self.processing_key, self.ready_key, 'RIGHT', 'LEFT') is not None:
+            recovered += 1
+        return recovered
+
+
+@lru_cache(maxsize=None)
+def get_task_queue():
+    # Read at call time, so tests can switch the backend with override_settings.
+    return import_string(settings.TASK_QUEUE_BACKEND)()
+
+
+@receiver(setting_changed)
+def reset_task_queue(setting, **kwargs):
+    if setting == 'TASK_QUEUE_BACKEND':
+        get_task_queue.cache_clear()
+
+
+class Worker:
+    """
+    Runs queued jobs one at a time. A failing job is retried with
+    exponential backoff and moved to the dead-letter queue after
+    TASK_MAX_ATTEMPTS attempts.
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue or get_task_queue()
+        self.running = True
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self, burst=False):
+        """
+        Process jobs until stopped, or in burst mode until the queue is
+        empty, and return the number of processed jobs.
+        """
+        processed = 0
+        while self.running:
+            job = self.queue.dequeue(0 if burst else TASK_POLL_INTERVAL)
+            if job is None:
+                if burst:
+                    break
+                continue
+            self.process(job)
+            processed += 1
+        return processed
+
+    def process(self, job):
+        function = TASKS.get(job.name)
+        try:
+            if function is None:
+                raise LookupError(f'Unknown task {job.name}')
+            function(*job.args)
+        except Exception as exc:
+            error = f'{type(exc).__name__}: {exc}'
+            if function is None or job.attempts + 1 >= TASK_MAX_ATTEMPTS:
+                logger.error('Task %s failed, moved to the dead-letter queue', job.name, exc_info=True)
+                self.queue.dead(job, error)
+            else:
+                logger.warning('Task %s failed, retrying', job.name, exc_info=True)
+                self.queue.retry(job, TASK_RETRY_DELAY * 2 ** job.attempts, error)
+        else:
+            self.queue.ack(job)
+        finally:
+            # Inside a transaction, as in tests, the connection must stay open.
+            if not connection.in_atomic_block:
+                close_old_connections()
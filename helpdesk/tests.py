@@ -1,3 +1,1506 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+import fakeredis
+import fakeredis.aioredis
+from django.contrib.auth.models import update_last_login
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from config.settings import TICKETS_PER_PAGE, INACTIVITY_TIME_LIMIT, ACTIVITY_WRITE_INTERVAL, LOCMEM_CACHES,\
+    SESSION_ENGINES, TASK_MAX_ATTEMPTS, NOTIFICATION_DIGEST_WINDOW, REDIS_CACHES, TOKEN_EXPIRATION_TIME, \
+    TOKEN_CACHE_TIMEOUT, SEARCH_RESULTS_LIMIT
+from helpdesk.API.authentication import CustomTokenAuthentication, token_cache
+from helpdesk.API.event_stream import TicketEventStream
+from helpdesk.benchmark import run_benchmark, compare_results, percentile
+from helpdesk.events import LocalEventBroker, TICKET_STATUS, COMMENT_CREATED
+from helpdesk import middlewares
+from helpdesk.importer import TicketImporter
+from helpdesk.metrics import registry
+from helpdesk.models import CustomUser, Ticket, Comment, TicketCounter, TicketStatusEvent, ImportCheckpoint, \
+    QueuedTask, Notification
+from helpdesk.notifications import send_notification_digests, WebhookSender
+from helpdesk.search import get_search_backend
+from helpdesk.stats import reconcile_ticket_stats
+from helpdesk.tasks import task, enqueue, Worker
+from helpdesk.transitions import get_allowed_statuses, get_transition, apply_transition, TransitionConflict
+
+FAKE_REDIS_CACHES = {
+    'default': {
+        **REDIS_CACHES['default'],
+        'OPTIONS': {
+            **REDIS_CACHES['default']['OPTIONS'],
+            'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection},
+        },
+    }
+}
+
+INSTRUMENTED_CACHES = {
+    'default': {
+        **LOCMEM_CACHES['default'],
+        'BACKEND': 'helpdesk.metrics.InstrumentedLocMemCache',
+    }
+}
+
+
+# Jobs of the database queue are written in the test transaction, so workers
+# started by the tests see them; the Redis queue only pushes them on commit.
+@override_settings(CACHES=LOCMEM_CACHES, TASK_QUEUE_BACKEND='helpdesk.tasks.DatabaseTaskQueue')
+class HelpdeskTestCase(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+def run_tasks():
+    return Worker().run(burst=True)
+
+
+def create_user(username, **kwargs):
+    return CustomUser.objects.create_user(username=username,
+                                          email=f'{username}@example.com',
+                                          first_name=username.title(),
+                                          last_name='Test',
+                                          password=None,
+                                          **kwargs)
+
+
+class TicketCursorPaginationTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+        priorities = [Ticket.HIGH_PRIORITY, Ticket.MEDIUM_PRIORITY, Ticket.LOW_PRIORITY]
+        for number in range(7):
+            Ticket.objects.create(user=cls.user,
+                                  title=f'Ticket {number}',
+                                  description='description',
+                                  priority=priorities[number % 3])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def collect_pages(self, url):
+        ids = []
+        response = None
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(ticket['id'] for ticket in response.data['results'])
+            url = response.data['next']
+        return ids, response
+
+    def test_pages_follow_created_order(self):
+        ids, _ = self.collect_pages('/api/ticket/?page_size=3')
+        expected = list(Ticket.objects.order_by('-created', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_pages_follow_requested_ordering(self):
+        ids, last_response = self.collect_pages('/api/ticket/?ordering=priority&page_size=2')
+        expected = list(Ticket.objects.order_by('priority', '-created', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+        previous_response = self.client.get(last_response.data['previous'])
+        previous_ids = [ticket['id'] for ticket in previous_response.data['results']]
+        self.assertEqual(previous_ids, expected[-3:-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/ticket/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+class TicketQueryCountTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_tickets(self, count):
+        for _ in range(count):
+            author = create_user(f'author{Ticket.objects.count()}')
+            ticket = Ticket.objects.create(user=author, title='Ticket', description='description')
+            Comment.objects.create(author=author, ticket=ticket, body='comment')
+            Comment.objects.create(author=self.admin, ticket=ticket, body='answer')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_ticket_list_query_count_is_constant(self):
+        self.create_tickets(2)
+        expected = self.count_queries('/api/ticket/')
+        expected_expanded = self.count_queries('/api/ticket/?expand=comments')
+        self.create_tickets(5)
+        self.assertEqual(self.count_queries('/api/ticket/'), expected)
+        self.assertEqual(self.count_queries('/api/ticket/?expand=comments'), expected_expanded)
+
+    def test_restore_ticket_list_query_count_is_constant(self):
+        self.create_tickets(2)
+        Ticket.objects.update(status=Ticket.RESTORED_STATUS)
+        expected = self.count_queries('/api/restore-ticket/?expand=comments')
+        self.create_tickets(5)
+        Ticket.objects.update(status=Ticket.RESTORED_STATUS)
+        self.assertEqual(self.count_queries('/api/restore-ticket/?expand=comments'), expected)
+
+    def test_ticket_list_representation(self):
+        self.create_tickets(1)
+        ticket = Ticket.objects.get()
+
+        response = self.client.get('/api/ticket/')
+        self.assertEqual(response.data['results'][0]['comment_count'], 2)
+        self.assertNotIn('comments', response.data['results'][0])
+
+        response = self.client.get('/api/ticket/?fields=id,title')
+        self.assertEqual(response.data['results'][0], {'id': ticket.id, 'title': ticket.title})
+
+        response = self.client.get('/api/ticket/?expand=comments')
+        self.assertEqual(len(response.data['results'][0]['comments']), 2)
+
+        response = self.client.get(f'/api/ticket/{ticket.id}/')
+        self.assertEqual(len(response.data['comments']), 2)
+
+
+class TicketListViewTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_tickets(self, count):
+        for number in range(count):
+            author = create_user(f'author{Ticket.objects.count()}')
+            Ticket.objects.create(user=author, title=f'Ticket {number}', description='description')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_home_query_count_is_constant(self):
+        self.create_tickets(2)
+        expected = self.count_queries('/')
+        self.create_tickets(30)
+        self.assertEqual(self.count_queries('/'), expected)
+
+    def test_home_is_paginated(self):
+        self.create_tickets(TICKETS_PER_PAGE + 1)
+        response = self.client.get('/', {'priority': Ticket.MEDIUM_PRIORITY})
+        self.assertEqual(len(response.context['object_list']), TICKETS_PER_PAGE)
+        self.assertContains(response, f'priority={Ticket.MEDIUM_PRIORITY}&page=2')
+
+        response = self.client.get('/', {'priority': Ticket.MEDIUM_PRIORITY, 'page': 2})
+        self.assertEqual(len(response.context['object_list']), 1)
+
+
+class CustomTokenAuthenticationTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.token = Token.objects.get(user=cls.user)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_principal_skips_token_lookup(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        self.assertFalse(any('authtoken_token' in query['sql'] for query in context.captured_queries))
+
+    def test_cached_principal_keeps_user_fields(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        user, _ = CustomTokenAuthentication().authenticate_credentials(self.token.key)
+        self.assertEqual((user.id, user.username, user.email, user.is_staff, user.is_superuser),
+                         (self.user.id, 'user', 'user@example.com', False, False))
+
+    def test_user_change_invalidates_principal(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 401)
+
+    def test_token_delete_invalidates_principal(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 401)
+
+    def test_user_save_keeps_token_activity(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        token_cache.touch(self.token.key, timezone.now() - timedelta(seconds=TOKEN_EXPIRATION_TIME + 60))
+        self.user.first_name = 'Changed'
+        self.user.save()
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 401)
+
+    def test_last_login_update_keeps_principal(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        update_last_login(None, self.user)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        self.assertFalse(any('authtoken_token' in query['sql'] for query in context.captured_queries))
+
+    async def test_async_authentication_shares_principal(self):
+        user, _ = await CustomTokenAuthentication().aauthenticate_credentials(self.token.key)
+        self.assertEqual(user.id, self.user.id)
+        cached_user, _ = token_cache.touch(self.token.key, timezone.now())
+        self.assertEqual((cached_user.id, cached_user.username), (self.user.id, 'user'))
+
+
+@override_settings(CACHES=FAKE_REDIS_CACHES)
+class RedisTokenAuthenticationTest(CustomTokenAuthenticationTest):
+    """Runs the token tests against the pipelined Redis hash path."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(token_cache.async_connection_classes,
+                                  {'FakeConnection': fakeredis.aioredis.FakeConnection})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_principal_expires(self):
+        self.assertEqual(self.client.get('/api/ticket/').status_code, 200)
+        redis_key = cache.client.make_key(token_cache.get_key(self.token.key))
+        self.assertTrue(0 < cache.client.get_client().ttl(redis_key) <= TOKEN_CACHE_TIMEOUT)
+
+
+class TicketSearchTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other_user = create_user('other')
+        cls.admin = create_user('admin', is_staff=True)
+        cls.printer = Ticket.objects.create(user=cls.user, title='Printer is broken', description='Paper jam')
+        cls.network = Ticket.objects.create(user=cls.user, title='No network', description='Cable unplugged')
+        cls.other = Ticket.objects.create(user=cls.other_user, title='Printer toner', description='Empty')
+        Comment.objects.create(author=cls.admin, ticket=cls.network, body='Check the printer cable too')
+
+    def setUp(self):
+        run_tasks()
+        self.client = APIClient()
+
+    def search(self, user, query):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/ticket/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [ticket['id'] for ticket in response.data['results']]
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search(self.user, 'printer'), [self.printer.id, self.network.id])
+
+    def test_results_respect_visibility(self):
+        self.assertEqual(self.search(self.admin, 'toner'), [self.other.id])
+        self.assertEqual(self.search(self.user, 'toner'), [])
+
+    def test_index_follows_changes(self):
+        self.network.comments.all().delete()
+        self.printer.description = 'Scanner does not start'
+        self.printer.save()
+        run_tasks()
+        self.assertEqual(self.search(self.user, 'printer'), [self.printer.id])
+        self.assertEqual(self.search(self.user, 'scanner'), [self.printer.id])
+
+    def test_response_reports_result_limit(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/ticket/', {'q': 'printer'})
+        self.assertEqual(response.data['search_limit'], SEARCH_RESULTS_LIMIT)
+        self.assertFalse(response.data['search_truncated'])
+
+        with mock.patch('helpdesk.search.SEARCH_RESULTS_LIMIT', 1), \
+                mock.patch('helpdesk.API.pagination.SEARCH_RESULTS_LIMIT', 1):
+            response = self.client.get('/api/ticket/', {'q': 'printer'})
+        self.assertEqual([ticket['id'] for ticket in response.data['results']], [self.printer.id])
+        self.assertEqual(response.data['search_limit'], 1)
+        self.assertTrue(response.data['search_truncated'])
+        self.assertNotIn('search_truncated', self.client.get('/api/ticket/').data)
+
+    def test_html_search_reports_result_limit(self):
+        self.client.force_login(self.user)
+        self.assertNotContains(self.client.get('/', {'q': 'printer'}), 'best matches are shown')
+        with mock.patch('helpdesk.search.SEARCH_RESULTS_LIMIT', 1), \
+                mock.patch('helpdesk.views.SEARCH_RESULTS_LIMIT', 1):
+            response = self.client.get('/', {'q': 'printer'})
+        self.assertEqual(list(response.context['filter'].qs), [self.printer])
+        self.assertContains(response, 'Only the 1 best matches are shown')
+
+    def test_html_search(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/', {'q': 'cable'})
+        self.assertEqual(list(response.context['filter'].qs), [self.network])
+
+
+class TicketIndexUsageTest(HelpdeskTestCase):
+    ticket_count = 100000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'user{number}') for number in range(20)]
+        statuses = [status for status, _ in Ticket.STATUS_CHOICES]
+        priorities = [priority for priority, _ in Ticket.PRIORITY_CHOICES]
+        Ticket.objects.bulk_create([
+            Ticket(user=cls.users[number % len(cls.users)],
+                   title=f'Ticket {number}',
+                   description='description',
+                   status=statuses[number % len(statuses)],
+                   priority=priorities[number % len(priorities)])
+            for number in range(cls.ticket_count)
+        ], batch_size=5000)
+        cls.ticket = Ticket.objects.first()
+        Comment.objects.bulk_create([
+            Comment(author=cls.users[0], ticket=cls.ticket, body='comment') for _ in range(50)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+
+    def test_user_ticket_list(self):
+        queryset = Ticket.objects.exclude(status=Ticket.RESTORED_STATUS).filter(user=self.users[0])
+        self.assertUsesIndex(queryset, 'ticket_user_created_idx')
+
+    def test_staff_ticket_list(self):
+        queryset = Ticket.objects.exclude(status__in=[Ticket.RESTORED_STATUS, Ticket.REJECTED_STATUS])
+        self.assertUsesIndex(queryset[:50], 'ticket_created_idx')
+
+    def test_status_priority_filter(self):
+        queryset = Ticket.objects.filter(status__in=[Ticket.ACTIVE_STATUS], priority__in=[Ticket.HIGH_PRIORITY])
+        self.assertUsesIndex(queryset, 'ticket_status_priority_idx')
+
+    def test_restored_ticket_queue(self):
+        queryset = Ticket.objects.filter(status=Ticket.RESTORED_STATUS)
+        self.assertUsesIndex(queryset, 'ticket_restored_idx')
+
+    def test_ticket_comments(self):
+        self.assertUsesIndex(self.ticket.comments.all(), 'comment_ticket_created_idx')
+
+
+class TicketCacheTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other_user = create_user('other')
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+        Comment.objects.create(author=cls.user, ticket=cls.ticket, body='first comment')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/api/ticket/{self.ticket.id}/'
+
+    def test_api_representation_is_cached(self):
+        self.assertEqual(len(self.client.get(self.url).data['comments']), 1)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+        self.assertEqual(len(context), 0)
+        self.assertEqual(len(response.data['comments']), 1)
+
+    def test_comment_invalidates_cache(self):
+        self.client.get(self.url)
+        Comment.objects.create(author=self.user, ticket=self.ticket, body='second comment')
+        self.assertEqual(len(self.client.get(self.url).data['comments']), 2)
+
+    @override_settings(CACHES=FAKE_REDIS_CACHES)
+    def test_cache_is_read_in_one_round_trip(self):
+        self.client.get(self.url)
+        with mock.patch.object(cache, 'get', wraps=cache.get) as get, \
+                mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        ticket_keys = [call.args[0] for call in get.call_args_list if str(call.args[0]).startswith('ticket-')]
+        self.assertEqual((ticket_keys, get_many.call_count), ([], 1))
+
+    def test_query_parameters_skip_the_cache(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, {'status': 'rejected'}).status_code, 404)
+
+    def test_cached_ticket_is_not_leaked(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(self.other_user)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_detail_page_comment_fragment_is_cached(self):
+        self.client.force_login(self.user)
+        self.client.get(f'/ticket/{self.ticket.id}/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/ticket/{self.ticket.id}/')
+        self.assertContains(response, 'first comment')
+        self.assertFalse(any('helpdesk_comment' in query['sql'] for query in context.captured_queries))
+
+        Comment.objects.create(author=self.user, ticket=self.ticket, body='second comment')
+        self.assertContains(self.client.get(f'/ticket/{self.ticket.id}/'), 'second comment')
+
+
+class BulkChangeTicketStatusTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_ticket(self, status=Ticket.ACTIVE_STATUS):
+        return Ticket.objects.create(user=self.user, title='Ticket', description='description', status=status)
+
+    def test_bulk_transitions(self):
+        accepted = self.create_ticket()
+        rejected = self.create_ticket()
+        completed = self.create_ticket(Ticket.PROCESSED_STATUS)
+        deleted = self.create_ticket(Ticket.RESTORED_STATUS)
+        invalid = self.create_ticket(Ticket.PROCESSED_STATUS)
+
+        response = self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [
+            {'id': accepted.id, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok'},
+            {'id': rejected.id, 'status_id': Ticket.REJECTED_STATUS, 'comment': 'duplicate'},
+            {'id': completed.id, 'status_id': Ticket.COMPLETED_STATUS, 'comment': 'done'},
+            {'id': deleted.id, 'status_id': Ticket.REJECTED_STATUS, 'comment': 'no'},
+            {'id': invalid.id, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'again'},
+            {'id': 0, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'missing'},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([('errors' in result) for result in response.data], [False, False, False, False, True, True])
+        self.assertEqual(Ticket.objects.get(id=accepted.id).status, Ticket.PROCESSED_STATUS)
+        self.assertEqual(Ticket.objects.get(id=rejected.id).status, Ticket.REJECTED_STATUS)
+        self.assertEqual(Ticket.objects.get(id=completed.id).status, Ticket.COMPLETED_STATUS)
+        self.assertFalse(Ticket.objects.filter(id=deleted.id).exists())
+        self.assertEqual(Ticket.objects.get(id=invalid.id).status, Ticket.PROCESSED_STATUS)
+        self.assertEqual(list(rejected.comments.values_list('topic', 'body')), [(Comment.REJECT_TOPIC, 'duplicate')])
+
+    def test_bulk_transitions_reject_malformed_items(self):
+        ticket = self.create_ticket()
+        for item in [{'id': {'a': 1}, 'status_id': Ticket.PROCESSED_STATUS},
+                     {'id': True, 'status_id': Ticket.PROCESSED_STATUS},
+                     {'id': ticket.id}]:
+            response = self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [item]}, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Ticket.objects.get(id=ticket.id).status, Ticket.ACTIVE_STATUS)
+
+    def test_bulk_transitions_respect_visibility(self):
+        ticket = self.create_ticket(Ticket.REJECTED_STATUS)
+        other_ticket = Ticket.objects.create(user=self.admin, title='Ticket', description='description',
+                                             status=Ticket.REJECTED_STATUS)
+        self.client.force_authenticate(self.user)
+        response = self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [
+            {'id': ticket.id, 'status_id': Ticket.RESTORED_STATUS, 'comment': 'please'},
+            {'id': other_ticket.id, 'status_id': Ticket.RESTORED_STATUS, 'comment': 'please'},
+        ]}, format='json')
+        self.assertNotIn('errors', response.data[0])
+        self.assertIn('errors', response.data[1])
+        self.assertEqual(Ticket.objects.get(id=ticket.id).status, Ticket.RESTORED_STATUS)
+
+
+class TicketTransitionTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def test_allowed_statuses(self):
+        self.assertEqual(get_allowed_statuses(Ticket.ACTIVE_STATUS, True),
+                         (Ticket.PROCESSED_STATUS, Ticket.REJECTED_STATUS))
+        self.assertEqual(get_allowed_statuses(Ticket.ACTIVE_STATUS, False), ())
+        self.assertEqual(get_allowed_statuses(Ticket.REJECTED_STATUS, False), (Ticket.RESTORED_STATUS,))
+        self.assertEqual(get_allowed_statuses(Ticket.PROCESSED_STATUS, True), (Ticket.COMPLETED_STATUS,))
+        self.assertEqual(get_allowed_statuses(Ticket.COMPLETED_STATUS, True), ())
+
+    def test_html_reject_adds_comment(self):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        self.client.force_login(self.admin)
+        self.client.post(f'/update-ticket-status/{ticket.id}/',
+                         {'status': Ticket.REJECTED_STATUS, 'comment': 'duplicate'})
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.status, Ticket.REJECTED_STATUS)
+        self.assertEqual(list(ticket.comments.values_list('topic', 'body')), [(Comment.REJECT_TOPIC, 'duplicate')])
+        self.assertEqual(ticket.status_events.last().from_status, Ticket.ACTIVE_STATUS)
+
+    def test_html_invalid_transition(self):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        self.client.force_login(self.user)
+        response = self.client.post(f'/update-ticket-status/{ticket.id}/',
+                                    {'status': Ticket.COMPLETED_STATUS}, follow=True)
+        self.assertContains(response, 'Status can only be changed by the administrator.')
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.status, Ticket.ACTIVE_STATUS)
+
+    def test_api_transition_errors(self):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description',
+                                       status=Ticket.RESTORED_STATUS)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        url = f'/api/ticket/{ticket.id}/change_ticket_status/'
+        response = client.patch(url, {'status_id': Ticket.COMPLETED_STATUS, 'comment': 'done'})
+        self.assertEqual(response.data['status_id'][0],
+                         'You can complete the ticket only if it in the status PROCESSED.')
+
+        response = client.patch(url, {'status_id': Ticket.REJECTED_STATUS, 'comment': 'no'})
+        self.assertEqual(response.data, {'detail': 'Ticket deleted.'})
+        self.assertFalse(Ticket.objects.filter(id=ticket.id).exists())
+
+
+class ActivityTrackingTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_requests_do_not_write_session(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('UPDATE "django_session"' in query['sql'] for query in context.captured_queries))
+        self.assertEqual(response.wsgi_request.action_counter, 2)
+
+    def test_inactive_user_is_logged_out(self):
+        now = time.time()
+        with mock.patch('helpdesk.middlewares.time.time', return_value=now):
+            self.assertEqual(self.client.get('/').status_code, 200)
+        with mock.patch('helpdesk.middlewares.time.time', return_value=now + ACTIVITY_WRITE_INTERVAL):
+            self.assertEqual(self.client.get('/').status_code, 200)
+
+        inactive_time = now + ACTIVITY_WRITE_INTERVAL + INACTIVITY_TIME_LIMIT + 1
+        with mock.patch('helpdesk.middlewares.time.time', return_value=inactive_time):
+            self.assertRedirects(self.client.get('/'), reverse('login'), fetch_redirect_response=False)
+
+    def test_expired_activity_logs_out(self):
+        self.assertEqual(self.client.get('/').status_code, 200)
+        cache.delete(f'activity:{self.client.session.session_key}')
+        self.assertRedirects(self.client.get('/'), reverse('login'), fetch_redirect_response=False)
+
+    def test_activity_key_expiry_logs_out(self):
+        now = time.time()
+        self.assertEqual(self.client.get('/').status_code, 200)
+        # The locmem cache checks expiry against time.time as well.
+        with mock.patch('time.time', return_value=now + 3600):
+            self.assertRedirects(self.client.get('/'), reverse('login'), fetch_redirect_response=False)
+
+
+class SessionEngineTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+
+    def count_session_queries(self):
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        return len([query for query in context.captured_queries if 'django_session' in query['sql']])
+
+    def test_cached_db_sessions_are_read_from_cache(self):
+        with self.settings(SESSION_ENGINE=SESSION_ENGINES['cached_db']):
+            self.client.force_login(self.user)
+            self.assertEqual(self.count_session_queries(), 0)
+
+    def test_cache_sessions_do_not_use_database(self):
+        with self.settings(SESSION_ENGINE=SESSION_ENGINES['cache']):
+            self.client.force_login(self.user)
+            self.assertEqual(self.count_session_queries(), 0)
+
+    def test_db_sessions_are_read_from_database(self):
+        with self.settings(SESSION_ENGINE=SESSION_ENGINES['db']):
+            self.client.force_login(self.user)
+            self.assertEqual(self.count_session_queries(), 1)
+
+
+class AsyncApiTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other_user = create_user('other')
+        cls.token = Token.objects.get(user=cls.user)
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+        Ticket.objects.create(user=cls.other_user, title='Other ticket', description='description')
+
+    def setUp(self):
+        super().setUp()
+        self.client = AsyncClient()
+        self.headers = {'AUTHORIZATION': f'Token {self.token.key}'}
+
+    async def test_ticket_list(self):
+        response = await self.client.get('/api/async/ticket/', {'ordering': 'priority'}, **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([ticket['id'] for ticket in response.json()['results']], [self.ticket.id])
+
+    async def test_ticket_list_matches_sync_parameters(self):
+        await Comment.objects.acreate(author=self.user, ticket=self.ticket, body='printer cable')
+        await sync_to_async(run_tasks)()
+        for params in [{'q': 'printer'}, {'expand': 'comments'}, {'q': 'printer', 'expand': 'comments'},
+                       {'q': 'missing'}]:
+            response = await self.client.get('/api/async/ticket/', params, **self.headers)
+            sync_response = await sync_to_async(APIClient().get)('/api/ticket/', params, **{
+                'HTTP_AUTHORIZATION': f'Token {self.token.key}'})
+            self.assertEqual(response.json(), json.loads(sync_response.content), params)
+
+    async def test_ticket_detail(self):
+        response = await self.client.get(f'/api/async/ticket/{self.ticket.id}/', **self.headers)
+        self.assertEqual(response.json()['title'], 'Ticket')
+
+        other_ticket = await Ticket.objects.aget(user=self.other_user)
+        response = await self.client.get(f'/api/async/ticket/{other_ticket.id}/', **self.headers)
+        self.assertEqual(response.status_code, 404, response.content)
+
+    async def test_comment_create(self):
+        response = await self.client.post('/api/async/comment/',
+                                          {'ticket': self.ticket.id, 'comment': 'async comment'},
+                                          content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['comment'], 'async comment')
+        self.assertTrue(await Comment.objects.filter(ticket=self.ticket, body='async comment').aexists())
+
+        response = await self.client.post('/api/async/comment/', {'ticket': self.ticket.id, 'comment': ''},
+                                          content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+        other_ticket = await Ticket.objects.aget(user=self.other_user)
+        response = await self.client.post('/api/async/comment/', {'ticket': other_ticket.id, 'comment': 'comment'},
+                                          content_type='application/json', **self.headers)
+        self.assertEqual(response.json(), {'ticket': ['Only the author or administrator can leave a comment '
+                                                      'on the ticket.']})
+
+    async def test_authentication_required(self):
+        response = await self.client.get('/api/async/ticket/')
+        self.assertEqual(response.status_code, 401)
+        response = await self.client.get('/api/async/ticket/', AUTHORIZATION='Token invalid')
+        self.assertEqual(response.status_code, 401)
+
+
+class TicketEventStreamTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+        cls.token = Token.objects.get(user=cls.user)
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+        cls.other_ticket = Ticket.objects.create(user=cls.admin, title='Other', description='description')
+
+    def setUp(self):
+        super().setUp()
+        self.broker = LocalEventBroker()
+        for target in ['helpdesk.events.get_event_broker', 'helpdesk.API.event_stream.get_event_broker']:
+            patcher = mock.patch(target, return_value=self.broker)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_status_change_and_comment_publish_events(self):
+        admin_client, user_client = APIClient(), APIClient()
+        admin_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=self.admin).key}')
+        user_client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        with mock.patch.object(self.broker, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            user_client.post('/api/comment/', {'ticket': self.ticket.id, 'comment': 'hello'}, format='json')
+            admin_client.patch(f'/api/ticket/{self.ticket.id}/change_ticket_status/',
+                               {'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok'}, format='json')
+
+        events = [call.args[0] for call in publish.call_args_list]
+        self.assertEqual([event['event'] for event in events], [COMMENT_CREATED, TICKET_STATUS])
+        self.assertEqual(events[0]['body'], 'hello')
+        self.assertEqual(events[1]['status'], Ticket.PROCESSED_STATUS)
+
+    async def test_stream_sends_visible_events(self):
+        messages = []
+        started, received, disconnected = asyncio.Event(), asyncio.Event(), asyncio.Event()
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.start':
+                started.set()
+            elif message.get('body', b'').startswith(b'event:'):
+                received.set()
+
+        async def receive():
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/events/',
+            'query_string': b'',
+            'headers': [(b'authorization', f'Token {self.token.key}'.encode())],
+        }
+        stream = asyncio.ensure_future(TicketEventStream(None)(scope, receive, send))
+        await asyncio.wait_for(started.wait(), 1)
+        self.broker.publish({'event': TICKET_STATUS, 'ticket_id': self.other_ticket.id, 'user_id': self.admin.id})
+        self.broker.publish({'event': TICKET_STATUS, 'ticket_id': self.ticket.id, 'user_id': self.user.id})
+        await asyncio.wait_for(received.wait(), 1)
+        disconnected.set()
+        await asyncio.wait_for(stream, 1)
+
+        self.assertEqual(messages[0]['status'], 200)
+        events = [message['body'] for message in messages[1:] if message['body'].startswith(b'event:')]
+        self.assertEqual(len(events), 1)
+        self.assertIn(f'"ticket_id": {self.ticket.id}'.encode(), events[0])
+
+    async def test_stream_requires_authentication(self):
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/events/', 'query_string': b'', 'headers': []}
+        await TicketEventStream(None)(scope, None, send)
+        self.assertEqual(messages[0]['status'], 401)
+
+
+class TicketStatsTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def change_status(self, ticket, status, comment='comment'):
+        return self.client.patch(f'/api/ticket/{ticket.id}/change_ticket_status/',
+                                 {'status_id': status, 'comment': comment})
+
+    def test_counters_follow_ticket_changes(self):
+        tickets = [Ticket.objects.create(user=self.user, title=f'Ticket {number}', description='description',
+                                         priority=Ticket.HIGH_PRIORITY)
+                   for number in range(4)]
+        self.change_status(tickets[0], Ticket.PROCESSED_STATUS)
+        self.change_status(tickets[0], Ticket.COMPLETED_STATUS)
+        self.change_status(tickets[1], Ticket.REJECTED_STATUS)
+        self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [
+            {'id': tickets[2].id, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok'},
+        ]}, format='json')
+        self.client.force_authenticate(self.user)
+        self.change_status(tickets[1], Ticket.RESTORED_STATUS)
+        self.client.patch(f'/api/ticket/{tickets[3].id}/', {'priority_id': Ticket.LOW_PRIORITY})
+        self.client.force_authenticate(self.admin)
+        Ticket.objects.create(user=self.admin, title='Deleted', description='description').delete()
+        run_tasks()
+
+        with CaptureQueriesContext(connection) as context:
+            stats = self.client.get('/api/ticket/stats/').json()
+        self.assertFalse(any('FROM "helpdesk_ticket"' in query['sql'] for query in context.captured_queries))
+
+        self.assertEqual(stats['total'], 4)
+        self.assertEqual(stats['by_status'], {'Active': 1, 'Processed': 1, 'Rejected': 0, 'Restored': 1,
+                                              'Completed': 1})
+        self.assertEqual(stats['by_status_priority']['Active'], {'High': 0, 'Medium': 0, 'Low': 1})
+        self.assertEqual(stats['restored_queue'], 1)
+        self.assertEqual(stats['median_completion_time'], 30)
+        self.assertEqual(stats['users'], [{'id': self.user.id, 'username': 'user', 'total': 4,
+                                           'by_status': {'Active': 1, 'Processed': 1, 'Restored': 1,
+                                                         'Completed': 1}}])
+        self.assertEqual(reconcile_ticket_stats(), 0)
+
+    def test_counters_follow_saves_of_refreshed_tickets(self):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        stale = Ticket.objects.get(id=ticket.id)
+        ticket.status = Ticket.PROCESSED_STATUS
+        ticket.save()
+        ticket.priority = Ticket.LOW_PRIORITY
+        ticket.save()
+
+        stale.refresh_from_db()
+        stale.status = Ticket.COMPLETED_STATUS
+        stale.completed = timezone.now()
+        stale.save()
+        run_tasks()
+        self.assertEqual(reconcile_ticket_stats(), 0)
+
+    def test_reconcile_fixes_drift(self):
+        Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        run_tasks()
+        TicketCounter.objects.update(count=5)
+        self.assertEqual(reconcile_ticket_stats(), 1)
+        self.assertEqual(self.client.get('/api/ticket/stats/').json()['total'], 1)
+
+    def test_stats_are_staff_only(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/ticket/stats/').status_code, 403)
+
+
+class TimeInStatusTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_history(self, *steps):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        event_time = ticket.created
+        TicketStatusEvent.objects.filter(ticket=ticket).update(created=event_time)
+        for status, seconds in steps:
+            event_time += timedelta(seconds=seconds)
+            TicketStatusEvent.objects.create(ticket=ticket, to_status=status, created=event_time)
+        return ticket
+
+    def test_status_change_is_logged(self):
+        ticket = Ticket.objects.create(user=self.user, title='Ticket', description='description')
+        self.client.patch(f'/api/ticket/{ticket.id}/change_ticket_status/',
+                          {'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok'})
+        events = list(ticket.status_events.values_list('from_status', 'to_status', 'changed_by'))
+        self.assertEqual(events, [(None, Ticket.ACTIVE_STATUS, self.user.id),
+                                  (Ticket.ACTIVE_STATUS, Ticket.PROCESSED_STATUS, self.admin.id)])
+
+    def test_percentiles(self):
+        for seconds in [10, 20, 30, 40]:
+            self.create_history((Ticket.PROCESSED_STATUS, 100), (Ticket.COMPLETED_STATUS, seconds))
+
+        response = self.client.get('/api/ticket/time-in-status/', {'percentiles': '50,100'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'status': 'Active', 'count': 4, 'average': 100.0, 'max': 100.0,
+             'percentiles': {'50': 100.0, '100': 100.0}},
+            {'status': 'Processed', 'count': 4, 'average': 25.0, 'max': 40.0,
+             'percentiles': {'50': 20.0, '100': 40.0}},
+        ])
+
+    def test_range_and_validation(self):
+        self.create_history((Ticket.PROCESSED_STATUS, 100))
+        start = (timezone.now() + timedelta(days=1)).isoformat()
+        self.assertEqual(self.client.get('/api/ticket/time-in-status/', {'start': start}).json(), [])
+        response = self.client.get('/api/ticket/time-in-status/', {'percentiles': '0,101'})
+        self.assertEqual(response.status_code, 400)
+
+
+class TicketExportTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other_user = create_user('other')
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Printer, "office"', description='line\nbreak',
+                                           priority=Ticket.HIGH_PRIORITY)
+        Ticket.objects.create(user=cls.user, title='Low', description='description', priority=Ticket.LOW_PRIORITY)
+        Ticket.objects.create(user=cls.other_user, title='Other', description='description')
+        Comment.objects.create(author=cls.user, ticket=cls.ticket, body='comment')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_csv_export_streams_visible_tickets(self):
+        response = self.client.get('/api/ticket/export/', {'priority': 'high'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'title', 'description', 'priority', 'status', 'author', 'created',
+                                   'completed'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][1:6], ['Printer, "office"', 'line\nbreak', 'High', 'Active', 'user'])
+
+    def test_ndjson_comment_export(self):
+        response = self.client.get('/api/ticket/export/', {'export_format': 'ndjson', 'resource': 'comments'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['body'] for line in lines], ['comment'])
+
+        response = self.client.get('/api/ticket/export/', {'export_format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_command(self):
+        output = io.StringIO()
+        call_command('export_tickets', export_format='ndjson', user='other', stdout=output)
+        self.assertEqual([json.loads(line)['title'] for line in output.getvalue().splitlines()], ['Other'])
+
+        output = io.StringIO()
+        call_command('export_tickets', stdout=output)
+        self.assertEqual(len(list(csv.reader(io.StringIO(output.getvalue())))), 4)
+
+
+class TicketImportTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def write_records(self, records):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'tickets.ndjson')
+        with open(path, 'w') as output:
+            output.writelines(json.dumps(record) + '\n' for record in records)
+        return path
+
+    def test_command_imports_in_batches_and_resumes(self):
+        records = [{'title': f'Ticket {number}', 'description': 'description', 'priority_id': 1,
+                    'author': 'user', 'comments': [{'comment': 'imported'}]}
+                   for number in range(5)]
+        records.insert(2, {'title': 'Invalid'})
+        path = self.write_records(records)
+
+        write_batch = TicketImporter.write_batch
+
+        def interrupted_write_batch(importer, tickets, comments, position):
+            if position > 2:
+                raise RuntimeError('interrupted')
+            write_batch(importer, tickets, comments, position)
+
+        with mock.patch.object(TicketImporter, 'write_batch', interrupted_write_batch), \
+                self.assertRaises(RuntimeError):
+            call_command('import_tickets', path, user='admin', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(Ticket.objects.count(), 2)
+        self.assertEqual(ImportCheckpoint.objects.get().position, 2)
+
+        output, errors = io.StringIO(), io.StringIO()
+        call_command('import_tickets', path, user='admin', batch_size=2, stdout=output, stderr=errors)
+        self.assertIn('Resuming after record 2.', output.getvalue())
+        self.assertIn('3 imported, 1 rejected', output.getvalue())
+        self.assertIn('Record 2:', errors.getvalue())
+
+        self.assertEqual(Ticket.objects.filter(user=self.user).count(), 5)
+        self.assertEqual(Comment.objects.filter(author=self.admin, body='imported').count(), 5)
+        self.assertEqual(TicketStatusEvent.objects.filter(to_status=Ticket.ACTIVE_STATUS).count(), 5)
+        self.assertEqual(ImportCheckpoint.objects.get().position, 6)
+        run_tasks()
+        self.assertEqual(reconcile_ticket_stats(), 0)
+
+    def test_api_import(self):
+        response = self.client.post('/api/ticket/import/', {'tickets': [
+            {'title': 'Mine', 'description': 'description', 'priority_id': 2},
+            {'title': 'Theirs', 'description': 'description', 'priority_id': 2, 'author': 'admin'},
+        ]}, format='json')
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertTrue(Ticket.objects.filter(user=self.user, title='Mine').exists())
+
+    def test_staff_import_names_ticket_authors(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/api/ticket/import/', {'tickets': [
+            {'title': 'Unowned', 'description': 'description', 'priority_id': 2},
+            {'title': 'Staff', 'description': 'description', 'priority_id': 2, 'author': 'admin'},
+            {'title': 'Imported printer', 'description': 'description', 'priority_id': 2, 'author': 'user'},
+        ]}, format='json')
+        self.assertEqual(response.data['imported'], 1)
+        self.assertEqual(response.data['errors'], [
+            {'index': 0, 'errors': {'author': 'This field is required.'}},
+            {'index': 1, 'errors': {'author': 'Tickets cannot belong to the administrator.'}},
+        ])
+        self.assertFalse(Ticket.objects.filter(user=self.admin).exists())
+
+        ticket = Ticket.objects.get(user=self.user, title='Imported printer')
+        self.assertEqual(get_search_backend().search('printer', Ticket.objects.all(), 10), [])
+        run_tasks()
+        self.assertEqual(get_search_backend().search('printer', Ticket.objects.all(), 10), [ticket.id])
+
+    def test_api_imports_exported_csv(self):
+        Ticket.objects.create(user=self.user, title='Exported', description='description',
+                              priority=Ticket.LOW_PRIORITY)
+        export = b''.join(self.client.get('/api/ticket/export/').streaming_content)
+        upload = SimpleUploadedFile('tickets.csv', export, content_type='text/csv')
+        response = self.client.post('/api/ticket/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.data, {'imported': 1, 'errors': []})
+        self.assertEqual(Ticket.objects.filter(title='Exported', priority=Ticket.LOW_PRIORITY).count(), 2)
+
+
+class BenchmarkTest(HelpdeskTestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run_benchmark(self):
+        results = run_benchmark(users=5, tickets=50, comments_per_ticket=1, requests=60, warmup=5, actors=3)
+        self.assertEqual(results['meta']['tickets'], 50)
+        self.assertGreaterEqual(Ticket.objects.count(), 50)
+        self.assertGreater(results['meta']['background_jobs'], 0)
+        self.assertEqual(reconcile_ticket_stats(), 0)
+        for name, result in results['endpoints'].items():
+            self.assertFalse([code for code in result['status_codes'] if code.startswith('5')], name)
+
+        slower = json.loads(json.dumps(results))
+        slower['endpoints']['api_ticket_list']['latency_ms']['p95'] *= 2
+        self.assertEqual([regression[:2] for regression in compare_results(results, slower, 20)],
+                         [('api_ticket_list', 'latency p95')])
+
+
+@override_settings(CACHES=INSTRUMENTED_CACHES)
+class RequestInstrumentationTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(middlewares, 'METRICS_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        registry.reset()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=self.user).key}')
+
+    def get_metrics(self):
+        admin_client = APIClient()
+        admin_client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=self.admin).key}')
+        response = admin_client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        return response.content.decode()
+
+    def test_requests_are_recorded_by_url_name(self):
+        self.client.get('/api/ticket/')
+        self.client.get(f'/api/ticket/{self.ticket.pk}/')
+        self.client.get(f'/api/ticket/{self.ticket.pk}/')
+
+        metrics = self.get_metrics()
+        self.assertIn('helpdesk_requests_total{view="ticket-list",method="GET",status="200"} 1', metrics)
+        self.assertIn('helpdesk_requests_total{view="ticket-detail",method="GET",status="200"} 2', metrics)
+        self.assertIn('helpdesk_request_db_queries_count{view="ticket-list",method="GET"} 1', metrics)
+        self.assertIn('helpdesk_request_duration_seconds_bucket{view="ticket-detail",method="GET",le="+Inf"} 2',
+                      metrics)
+        self.assertIn('helpdesk_response_size_bytes_sum{view="ticket-list",method="GET"}', metrics)
+        self.assertIn('helpdesk_cache_hits_total{view="ticket-detail",method="GET"}', metrics)
+        self.assertIn('helpdesk_cache_misses_total{view="ticket-detail",method="GET"}', metrics)
+
+    def test_metrics_are_admin_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_slow_requests_are_logged_with_sql(self):
+        with mock.patch.object(middlewares, 'METRICS_SLOW_REQUEST_BUDGET', 0), \
+                self.assertLogs('helpdesk.metrics', 'WARNING') as logs:
+            self.client.get('/api/ticket/')
+        self.assertIn('(ticket-list)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+        self.assertIn('helpdesk_slow_requests_total{view="ticket-list",method="GET"} 1', self.get_metrics())
+
+
+class CommentPaginationTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other = create_user('other')
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+        Comment.objects.bulk_create([
+            Comment(ticket=cls.ticket, author=cls.user, body=f'Comment {number}') for number in range(25)
+        ])
+        cls.comment_ids = list(Comment.objects.order_by('-created', '-id').values_list('id', flat=True))
+
+    def test_api_pages_from_the_newest_comment(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/ticket/{self.ticket.pk}/comments/')
+        self.assertEqual(len(response.data['results']), 20)
+        self.assertEqual(response.data['results'][0]['comment'], 'Comment 24')
+        self.assertIn('after=', response.data['next'])
+
+        response = client.get(response.data['next'])
+        self.assertEqual([comment['comment'] for comment in response.data['results']],
+                         [f'Comment {number}' for number in range(4, -1, -1)])
+        self.assertIsNone(response.data['next'])
+
+    def test_api_hides_comments_of_other_users(self):
+        client = APIClient()
+        client.force_authenticate(self.other)
+        self.assertEqual(client.get(f'/api/ticket/{self.ticket.pk}/comments/').status_code, 404)
+
+    def test_detail_page_renders_latest_page(self):
+        self.client.force_login(self.user)
+        url = reverse('detail_ticket', kwargs={'pk': self.ticket.pk})
+        response = self.client.get(url)
+        self.assertContains(response, 'Comment 24')
+        self.assertNotContains(response, 'Comment 4<')
+        self.assertEqual(len(response.context['comments_page'].comments), 20)
+
+        response = self.client.get(response.context['comments_page'].older_url)
+        self.assertContains(response, 'Comment 4<')
+        self.assertNotContains(response, 'Comment 5<')
+        self.assertIsNotNone(response.context['comments_page'].newer_url)
+
+    def test_detail_page_queries_do_not_grow_with_comments(self):
+        self.client.force_login(self.user)
+        url = reverse('detail_ticket', kwargs={'pk': self.ticket.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        Comment.objects.bulk_create([
+            Comment(ticket=self.ticket, author=self.other, body='more') for _ in range(50)
+        ])
+        with CaptureQueriesContext(connection) as more_queries:
+            self.client.get(url)
+        self.assertEqual(len(more_queries), len(queries))
+
+    def test_query_parameters_share_the_comments_fragment(self):
+        self.client.force_login(self.user)
+        url = reverse('detail_ticket', kwargs={'pk': self.ticket.pk})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as other_queries:
+            response = self.client.get(url + '?page_size=100&utm=1')
+        self.assertEqual(len(other_queries), len(queries))
+        self.assertEqual(response.context['comments_page'].cache_key, 'latest')
+        self.assertNotIn('utm', response.context['comments_page'].older_url)
+
+    def test_detail_page_rejects_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('detail_ticket', kwargs={'pk': self.ticket.pk}) + '?after=bad')
+        self.assertEqual(response.status_code, 404)
+
+
+class TicketObjectLoadingTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other = create_user('other')
+        cls.ticket = Ticket.objects.create(user=cls.user, title='Ticket', description='description')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def assertLoadsTicketOnce(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data)
+        ticket_queries = [query['sql'] for query in context.captured_queries
+                          if query['sql'].startswith('SELECT') and 'FROM "helpdesk_ticket"' in query['sql']]
+        self.assertEqual(len(ticket_queries), 1, ticket_queries)
+        user_queries = [query['sql'] for query in context.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "helpdesk_customuser"' in query['sql']]
+        # Only the session user is loaded, never the author of the ticket.
+        self.assertEqual(len(user_queries), 1, user_queries)
+        return response
+
+    def test_detail_view(self):
+        response = self.assertLoadsTicketOnce('get', reverse('detail_ticket', kwargs={'pk': self.ticket.pk}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_view(self):
+        response = self.assertLoadsTicketOnce('post', reverse('update_ticket', kwargs={'pk': self.ticket.pk}),
+                                              {'description': 'updated', 'priority': 2})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Ticket.objects.get(pk=self.ticket.pk).description, 'updated')
+
+    def test_comment_create_view(self):
+        response = self.assertLoadsTicketOnce('post', reverse('add_comment', kwargs={'pk': self.ticket.pk}),
+                                              {'body': 'comment'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Comment.objects.filter(ticket=self.ticket, body='comment').exists())
+
+    def test_other_users_ticket_is_forbidden(self):
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('detail_ticket', kwargs={'pk': self.ticket.pk})).status_code, 403)
+        self.assertEqual(self.client.get(reverse('update_ticket', kwargs={'pk': self.ticket.pk})).status_code, 403)
+
+    def test_missing_ticket(self):
+        self.assertEqual(self.client.get(reverse('detail_ticket', kwargs={'pk': 0})).status_code, 404)
+        self.assertEqual(self.client.post(reverse('add_comment', kwargs={'pk': 0}), {'body': 'x'}).status_code, 404)
+
+
+class TicketVersionConflictTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.admin = create_user('admin', is_staff=True)
+        cls.other_admin = create_user('other_admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_ticket(self, status=Ticket.ACTIVE_STATUS):
+        return Ticket.objects.create(user=self.user, title='Ticket', description='description', status=status)
+
+    def transition(self, ticket, changed_status, user, comment='comment'):
+        transition = get_transition(ticket.status, changed_status, user.is_staff)
+        apply_transition(ticket, transition, changed_status, user, comment)
+
+    def test_status_change_increments_version(self):
+        ticket = self.create_ticket()
+        response = self.client.patch(f'/api/ticket/{ticket.id}/change_ticket_status/',
+                                     {'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok', 'version': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['version'], 1)
+        self.assertEqual(Ticket.objects.get(id=ticket.id).version, 1)
+
+    def test_stale_version_is_a_conflict(self):
+        ticket = self.create_ticket()
+        self.transition(Ticket.objects.get(id=ticket.id), Ticket.PROCESSED_STATUS, self.other_admin)
+        response = self.client.patch(f'/api/ticket/{ticket.id}/change_ticket_status/',
+                                     {'status_id': Ticket.COMPLETED_STATUS, 'comment': 'done', 'version': 0})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Ticket.objects.get(id=ticket.id).status, Ticket.PROCESSED_STATUS)
+
+    def test_concurrent_changes_of_restored_ticket(self):
+        ticket = self.create_ticket(Ticket.RESTORED_STATUS)
+        first, second = Ticket.objects.get(id=ticket.id), Ticket.objects.get(id=ticket.id)
+
+        self.transition(first, Ticket.PROCESSED_STATUS, self.admin)
+        with self.assertRaises(TransitionConflict):
+            self.transition(second, Ticket.REJECTED_STATUS, self.other_admin)
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.status, ticket.version), (Ticket.PROCESSED_STATUS, 1))
+        self.assertEqual(TicketStatusEvent.objects.filter(ticket=ticket).count(), 2)
+
+    def test_concurrent_deletes_of_restored_ticket(self):
+        ticket = self.create_ticket(Ticket.RESTORED_STATUS)
+        first, second = Ticket.objects.get(id=ticket.id), Ticket.objects.get(id=ticket.id)
+
+        self.transition(first, Ticket.REJECTED_STATUS, self.admin)
+        with self.assertRaises(TransitionConflict):
+            self.transition(second, Ticket.PROCESSED_STATUS, self.other_admin)
+        self.assertFalse(Ticket.objects.filter(id=ticket.id).exists())
+        run_tasks()
+        self.assertEqual(reconcile_ticket_stats(), 0)
+
+    def test_bulk_change_reports_conflicts(self):
+        stale = self.create_ticket()
+        fresh = self.create_ticket()
+        self.transition(Ticket.objects.get(id=stale.id), Ticket.PROCESSED_STATUS, self.other_admin)
+        response = self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [
+            {'id': stale.id, 'status_id': Ticket.COMPLETED_STATUS, 'comment': 'done', 'version': 0},
+            {'id': fresh.id, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok', 'version': 0},
+        ]}, format='json')
+        self.assertIn('changed by another request', response.data[0]['errors']['id'])
+        self.assertEqual(response.data[1]['version'], 1)
+        self.assertEqual(Ticket.objects.get(id=stale.id).status, Ticket.PROCESSED_STATUS)
+        self.assertEqual(Ticket.objects.get(id=fresh.id).status, Ticket.PROCESSED_STATUS)
+
+
+@task
+def record_call(value):
+    record_call.calls.append(value)
+
+
+record_call.calls = []
+
+
+@task
+def failing_task():
+    raise ValueError('broken')
+
+
+class TaskQueueTest(HelpdeskTestCase):
+
+    def setUp(self):
+        super().setUp()
+        record_call.calls.clear()
+        self.user = create_user('user')
+        run_tasks()
+
+    def test_ticket_changes_are_queued(self):
+        ticket = Ticket.objects.create(user=self.user, title='Printer', description='description')
+        self.assertEqual(set(QueuedTask.objects.values_list('name', flat=True)),
+                         {'helpdesk.stats.apply_counter_deltas', 'helpdesk.search.index_tickets'})
+        self.assertFalse(TicketCounter.objects.exists())
+
+        self.assertEqual(run_tasks(), 2)
+        self.assertFalse(QueuedTask.objects.exists())
+        self.assertEqual(TicketCounter.objects.get().count, 1)
+        self.client.force_login(self.user)
+        self.assertEqual(list(self.client.get('/', {'q': 'printer'}).context['filter'].qs), [ticket])
+
+    def test_failed_job_is_retried_then_dead_lettered(self):
+        enqueue(failing_task)
+        with self.assertLogs('helpdesk.tasks', 'WARNING'):
+            run_tasks()
+        queued_task = QueuedTask.objects.get()
+        self.assertEqual((queued_task.status, queued_task.attempts), (QueuedTask.READY_STATUS, 1))
+        self.assertEqual(queued_task.last_error, 'ValueError: broken')
+        self.assertGreater(queued_task.available_at, timezone.now())
+
+        QueuedTask.objects.update(available_at=timezone.now(), attempts=TASK_MAX_ATTEMPTS - 1)
+        with self.assertLogs('helpdesk.tasks', 'ERROR'):
+            run_tasks()
+        self.assertEqual(QueuedTask.objects.get().status, QueuedTask.DEAD_STATUS)
+        self.assertEqual(run_tasks(), 0)
+
+    def test_unknown_task_is_dead_lettered(self):
+        QueuedTask.objects.create(name='helpdesk.tasks.missing', args=[])
+        with self.assertLogs('helpdesk.tasks', 'ERROR'):
+            run_tasks()
+        self.assertEqual(QueuedTask.objects.get().status, QueuedTask.DEAD_STATUS)
+
+    def test_run_workers_command(self):
+        enqueue(record_call, 1)
+        enqueue(record_call, 2)
+        QueuedTask.objects.create(name='helpdesk.tests.record_call', args=[3], status=QueuedTask.RUNNING_STATUS)
+        output = io.StringIO()
+        call_command('run_workers', burst=True, recover=True, stdout=output)
+        self.assertIn('1 interrupted jobs requeued', output.getvalue())
+        self.assertIn('3 jobs processed', output.getvalue())
+        self.assertEqual(sorted(record_call.calls), [1, 2, 3])
+
+
+class WebhookStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    status = 200
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.server.payloads.append(json.loads(self.rfile.read(int(self.headers['Content-Length']))))
+        self.send_response(self.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class NotificationTest(HelpdeskTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.other_user = create_user('other')
+        cls.admin = create_user('admin', is_staff=True)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.later = timezone.now() + timedelta(seconds=NOTIFICATION_DIGEST_WINDOW + 60)
+
+    def create_ticket(self, user, status=Ticket.ACTIVE_STATUS):
+        return Ticket.objects.create(user=user, title=f'Ticket of {user.username}', description='description',
+                                     status=status)
+
+    def start_webhook_stub(self, status=200):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), type('Stub', (WebhookStub,), {'status': status}))
+        server.connections = 0
+        server.payloads = []
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, WebhookSender(f'http://127.0.0.1:{server.server_port}/hooks/helpdesk')
+
+    def test_staff_changes_are_sent_as_one_digest(self):
+        ticket = self.create_ticket(self.user)
+        self.client.post('/api/comment/', {'ticket': ticket.id, 'comment': 'Please send a screenshot'})
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/comment/', {'ticket': ticket.id, 'comment': 'Here it is'})
+        self.client.force_authenticate(self.admin)
+        self.client.patch(f'/api/ticket/{ticket.id}/change_ticket_status/', {'status_id': Ticket.REJECTED_STATUS,
+                                                                            'comment': 'Not reproducible'})
+        self.assertEqual(Notification.objects.filter(recipient=self.user).count(), 2)
+
+        self.assertEqual(send_notification_digests(), 0)
+        self.assertEqual(send_notification_digests(self.later), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertEqual(mail.outbox[0].subject, '2 updates on your tickets')
+        self.assertIn('Rejected by admin. Comment: Not reproducible', mail.outbox[0].body)
+        self.assertIn('New comment from admin: Please send a screenshot', mail.outbox[0].body)
+        self.assertNotIn('Here it is', mail.outbox[0].body)
+        self.assertEqual(send_notification_digests(self.later), 0)
+
+    def test_bulk_changes_and_deletes_are_recorded(self):
+        active = self.create_ticket(self.user)
+        restored = self.create_ticket(self.other_user, Ticket.RESTORED_STATUS)
+        self.client.patch('/api/ticket/change-ticket-status/', {'tickets': [
+            {'id': active.id, 'status_id': Ticket.PROCESSED_STATUS, 'comment': 'ok'},
+            {'id': restored.id, 'status_id': Ticket.REJECTED_STATUS, 'comment': 'duplicate'},
+        ]}, format='json')
+        self.assertEqual(list(Notification.objects.order_by('id').values_list('recipient', 'ticket_id', 'text')), [
+            (self.user.id, active.id, 'Processed by admin.'),
+            (self.other_user.id, restored.id, 'Rejected and deleted by admin.'),
+        ])
+
+    def test_unreachable_mail_server_keeps_notifications(self):
+        self.client.post('/api/comment/', {'ticket': self.create_ticket(self.user).id, 'comment': 'comment'})
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', EMAIL_PORT=1), \
+                self.assertLogs('helpdesk.notifications', 'WARNING'):
+            self.assertEqual(send_notification_digests(self.later), 0)
+        self.assertFalse(Notification.objects.filter(sent__isnull=False).exists())
+        self.assertEqual(send_notification_digests(self.later), 1)
+
+    def test_webhook_posts_digests_over_one_connection(self):
+        server, sender = self.start_webhook_stub()
+        for user in [self.user, self.other_user]:
+            self.client.post('/api/comment/', {'ticket': self.create_ticket(user).id, 'comment': 'comment'})
+
+        self.assertEqual(send_notification_digests(self.later, sender), 2)
+        self.assertEqual(server.connections, 1)
+        self.assertEqual([payload['recipient']['username'] for payload in server.payloads], ['user', 'other'])
+        self.assertEqual(server.payloads[0]['notifications'][0]['text'], 'New comment from admin: comment')
+
+    def test_webhook_errors_keep_notifications(self):
+        server, sender = self.start_webhook_stub(status=503)
+        self.client.post('/api/comment/', {'ticket': self.create_ticket(self.user).id, 'comment': 'comment'})
+        with self.assertLogs('helpdesk.notifications', 'WARNING'):
+            self.assertEqual(send_notification_digests(self.later, sender), 0)
+        self.assertEqual(len(server.payloads), 1)
+        self.assertTrue(Notification.objects.filter(sent__isnull=True).exists())
+
+    def test_sender_errors_release_notifications(self):
+        self.client.post('/api/comment/', {'ticket': self.create_ticket(self.user).id, 'comment': 'comment'})
+        sender = mock.Mock(**{'send.side_effect': ValueError})
+        with self.assertRaises(ValueError):
+            send_notification_digests(self.later, sender)
+        self.assertFalse(Notification.objects.filter(sent__isnull=False).exists())
+        self.assertEqual(send_notification_digests(self.later), 1)
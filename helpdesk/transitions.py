@@ -0,0 +1,148 @@
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import F
+
+from helpdesk.models import Ticket, Comment, TicketStatusEvent
+from helpdesk.notifications import status_notification, record_notifications
+
+UPDATE_STATUS = 'update_status'
+REJECT_WITH_COMMENT = 'reject_with_comment'
+RESTORE_WITH_COMMENT = 'restore_with_comment'
+DELETE_TICKET = 'delete_ticket'
+
+COMMENT_TOPICS = {
+    REJECT_WITH_COMMENT: Comment.REJECT_TOPIC,
+    RESTORE_WITH_COMMENT: Comment.RESTORE_TOPIC,
+}
+
+STAFF_ONLY_ERROR = 'Status can only be changed by the administrator.'
+USER_ONLY_ERROR = 'Administrator cant restore tickets.'
+INVALID_STATUS_ERROR = 'Select a valid choice.'
+CONFLICT_ERROR = 'The ticket was changed by another request, reload it and try again.'
+
+StatusRule = namedtuple('StatusRule', ['staff_only', 'effects', 'source_error'])
+Transition = namedtuple('Transition', ['effect', 'error', 'error_field', 'comment_required'])
+
+STATUS_RULES = {
+    Ticket.PROCESSED_STATUS: StatusRule(
+        staff_only=True,
+        effects={Ticket.ACTIVE_STATUS: UPDATE_STATUS, Ticket.RESTORED_STATUS: UPDATE_STATUS},
+        source_error='Status can only be changed if the ticket is active or restored.',
+    ),
+    Ticket.REJECTED_STATUS: StatusRule(
+        staff_only=True,
+        effects={Ticket.ACTIVE_STATUS: REJECT_WITH_COMMENT, Ticket.RESTORED_STATUS: DELETE_TICKET},
+        source_error='Status can only be changed if the ticket is active or restored.',
+    ),
+    Ticket.RESTORED_STATUS: StatusRule(
+        staff_only=False,
+        effects={Ticket.REJECTED_STATUS: RESTORE_WITH_COMMENT},
+        source_error='You can only restore an ticket if it was rejected.',
+    ),
+    Ticket.COMPLETED_STATUS: StatusRule(
+        staff_only=True,
+        effects={Ticket.PROCESSED_STATUS: UPDATE_STATUS},
+        source_error='You can complete the ticket only if it in the status PROCESSED.',
+    ),
+}
+
+
+def build_transition(current_status, changed_status, is_staff):
+    if changed_status == current_status:
+        return Transition(None, 'Status should be different.', 'status', False)
+
+    if changed_status == Ticket.ACTIVE_STATUS:
+        return Transition(None, 'Status ACTIVE cannot be set by user.', 'status', False)
+
+    rule = STATUS_RULES[changed_status]
+    if rule.staff_only and not is_staff:
+        return Transition(None, STAFF_ONLY_ERROR, None, False)
+    if not rule.staff_only and is_staff:
+        return Transition(None, USER_ONLY_ERROR, None, False)
+
+    effect = rule.effects.get(current_status)
+    if effect is None:
+        return Transition(None, rule.source_error, 'status', False)
+    return Transition(effect, None, None, effect == REJECT_WITH_COMMENT)
+
+
+STATUSES = [status for status, _ in Ticket.STATUS_CHOICES]
+
+TRANSITIONS = {
+    (current_status, changed_status, is_staff): build_transition(current_status, changed_status, is_staff)
+    for current_status in STATUSES
+    for changed_status in STATUSES
+    for is_staff in [False, True]
+}
+
+ALLOWED_STATUSES = {
+    (current_status, is_staff): tuple(
+        changed_status for changed_status in STATUSES
+        if TRANSITIONS[(current_status, changed_status, is_staff)].error is None
+    )
+    for current_status in STATUSES
+    for is_staff in [False, True]
+}
+
+
+def get_transition(current_status, changed_status, is_staff):
+    transition = TRANSITIONS.get((current_status, changed_status, bool(is_staff)))
+    if transition is None:
+        return Transition(None, INVALID_STATUS_ERROR, 'status', False)
+    return transition
+
+
+def get_allowed_statuses(current_status, is_staff):
+    return ALLOWED_STATUSES.get((current_status, bool(is_staff)), ())
+
+
+class TransitionConflict(Exception):
+    """The ticket was changed by another request after it was loaded."""
+
+
+def claim_ticket(ticket, expected_version=None):
+    """
+    Increment the version of the ticket with a conditional UPDATE that only
+    matches while the ticket still has the status and version it was loaded
+    with, and raise TransitionConflict when it does not. Run inside a
+    transaction: the updated row stays locked until it commits, so of two
+    concurrent status changes only the first one goes through.
+    """
+    if expected_version is not None and expected_version != ticket.version:
+        raise TransitionConflict
+    claimed = Ticket.objects.filter(pk=ticket.pk, status=ticket.status, version=ticket.version)\
+        .update(version=F('version') + 1)
+    if not claimed:
+        raise TransitionConflict
+    ticket.version += 1
+
+
+def set_status(ticket, changed_status, user):
+    """
+    Change the ticket status in memory and return the unsaved
+    TicketStatusEvent that records the change.
+    """
+    event = TicketStatusEvent(ticket=ticket, from_status=ticket.status, to_status=changed_status, changed_by=user)
+    ticket.status = changed_status
+    if changed_status == Ticket.COMPLETED_STATUS:
+        ticket.completed = event.created
+    return event
+
+
+def apply_transition(ticket, transition, changed_status, user, comment=None, expected_version=None):
+    with transaction.atomic():
+        claim_ticket(ticket, expected_version)
+        if transition.effect == DELETE_TICKET:
+            record_notifications([status_notification(ticket, changed_status, user, deleted=True)])
+            ticket.delete()
+            return
+
+        topic = COMMENT_TOPICS.get(transition.effect)
+        comment = comment if topic else None
+        record_notifications([status_notification(ticket, changed_status, user, comment)])
+        event = set_status(ticket, changed_status, user)
+        ticket.save(update_fields=['status', 'completed'])
+        event.save()
+        if comment:
+            Comment.objects.create(author=user, ticket=ticket, topic=topic, body=comment)
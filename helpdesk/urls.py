@@ -3,8 +3,9 @@ from django.urls import path, include
 from rest_framework import routers
 from rest_framework.authtoken import views as rest_views
 
+from helpdesk.API import async_views
 from helpdesk.API.resourses import RegistrationViewSet, TicketViewSet, CommentViewSet,\
-    RestoreTicketViewSet
+    RestoreTicketViewSet, metrics
 from helpdesk.views import UserCreateView, TicketCreateView, TicketUpdateView,\
     TicketListView, TicketDetailView, CommentCreateView, ChangeTicketStatusView,\
     RestoreTicketListView
@@ -29,5 +30,9 @@ urlpatterns = [
     path('add-comment/<int:pk>', CommentCreateView.as_view(), name='add_comment'),
 
     path('api/', include(router.urls)),
-    path('api/get-auth-token/', rest_views.obtain_auth_token)
+    path('api/get-auth-token/', rest_views.obtain_auth_token),
+    path('api/metrics/', metrics, name='metrics'),
+    path('api/async/ticket/', async_views.ticket_list, name='async_ticket_list'),
+    path('api/async/ticket/<int:pk>/', async_views.ticket_detail, name='async_ticket_detail'),
+    path('api/async/comment/', async_views.comment_create, name='async_comment_create'),
 ]
@@ -1,15 +1,47 @@
 from django import forms
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.db import transaction
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
+from django.shortcuts import get_object_or_404
 from django.urls import reverse_lazy
+from django.utils.functional import cached_property
 from django.views.generic import CreateView, ListView, DetailView, UpdateView
 from django.contrib import messages
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
 
+from config.settings import TICKETS_PER_PAGE, TICKET_CACHE_TIMEOUT, SEARCH_RESULTS_LIMIT
+from helpdesk.API.pagination import CommentCursorPagination
+from helpdesk.cache import get_ticket_version
 from helpdesk.filters import TicketFilter
 from helpdesk.forms import UserCreateForm, ChangeTicketStatusForm, CommentCreateForm, TicketUpdateForm
-from helpdesk.models import Ticket, Comment
+from helpdesk.models import Ticket
+from helpdesk.transitions import get_transition, get_allowed_statuses, apply_transition, TransitionConflict, \
+    CONFLICT_ERROR
+
+
+def get_query_params(request):
+    query_params = request.GET.copy()
+    query_params.pop('page', None)
+    return query_params.urlencode()
+
+
+class TicketObjectMixin:
+    """
+    Loads the ticket of the `pk` URL argument once per request and shares
+    it between the permission check, the view and its form.
+    """
+    ticket_queryset = Ticket.objects.all()
+
+    def get_ticket(self):
+        if not hasattr(self, 'ticket'):
+            self.ticket = get_object_or_404(self.ticket_queryset, pk=self.kwargs.get('pk'))
+        return self.ticket
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        return self.get_ticket()
 
 
 class UserCreateView(CreateView):
@@ -44,15 +76,15 @@ class TicketCreateView(UserPassesTestMixin, CreateView):
         return super().form_valid(form)
 
 
-class TicketUpdateView(UserPassesTestMixin, UpdateView):
+class TicketUpdateView(TicketObjectMixin, UserPassesTestMixin, UpdateView):
     model = Ticket
     form_class = TicketUpdateForm
     template_name = 'helpdesk/ticket_update.html'
 
     def test_func(self):
-        ticket = self.get_object()
+        ticket = self.get_ticket()
         user = self.request.user
-        return ticket.user == user and ticket.status == Ticket.ACTIVE_STATUS
+        return ticket.user_id == user.id and ticket.status == Ticket.ACTIVE_STATUS
 
     def get_success_url(self):
         return reverse_lazy('detail_ticket', kwargs={'pk': self.object.pk})
@@ -72,30 +104,81 @@ class TicketUpdateView(UserPassesTestMixin, UpdateView):
 class TicketListView(LoginRequiredMixin, ListView):
     queryset = Ticket.objects.exclude(status=Ticket.RESTORED_STATUS)
     template_name = 'helpdesk/home.html'
+    paginate_by = TICKETS_PER_PAGE
+    list_fields = ['id', 'title', 'status', 'created', 'user__first_name', 'user__last_name']
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['filter'] = TicketFilter(self.request.GET, queryset=self.get_queryset())
+        context['filter'] = self.filterset
+        context['query_params'] = get_query_params(self.request)
+        context['search_truncated'] = self.filterset.search_truncated
+        context['search_limit'] = SEARCH_RESULTS_LIMIT
         return context
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().order_by('-created', '-id')
         user = self.request.user
         if not user.is_staff:
-            return queryset.filter(user=user)
-        return queryset.exclude(status=Ticket.REJECTED_STATUS)
+            queryset = queryset.filter(user=user)
+        else:
+            queryset = queryset.exclude(status=Ticket.REJECTED_STATUS)
+        queryset = queryset.select_related('user').only(*self.list_fields)
+        self.filterset = TicketFilter(self.request.GET, queryset=queryset)
+        return self.filterset.qs
 
 
 class RestoreTicketListView(UserPassesTestMixin, ListView):
-    queryset = Ticket.objects.filter(status=Ticket.RESTORED_STATUS)
+    queryset = Ticket.objects.filter(status=Ticket.RESTORED_STATUS)\
+        .select_related('user').only(*TicketListView.list_fields).order_by('-created', '-id')
     template_name = 'helpdesk/ticket_restore.html'
+    paginate_by = TICKETS_PER_PAGE
 
     def test_func(self):
         return self.request.user.is_staff
 
 
-class TicketDetailView(UserPassesTestMixin, DetailView):
+class CommentPage:
+    """
+    The latest page of the comments of a ticket or the older page the
+    `after` cursor points to. The cursor is checked up front, but comments
+    are only fetched when the page is rendered, so a cached comment
+    fragment costs no query.
+    """
+
+    def __init__(self, ticket, request):
+        self.paginator = CommentCursorPagination()
+        # Only the cursor selects the page, other query parameters must not split the cached fragment.
+        self.paginator.page_size_query_param = None
+        try:
+            self.queryset = self.paginator.get_page_queryset(ticket.comments.select_related('author'),
+                                                             Request(request))
+        except NotFound:
+            raise Http404('Invalid comments cursor.')
+        self.paginator.base_url = request.build_absolute_uri(request.path)
+        self.cache_key = self.get_cache_key()
+
+    def get_cache_key(self):
+        if self.paginator.position is None:
+            return 'latest'
+        direction = 'newer' if self.paginator.reverse else 'older'
+        return ':'.join([direction] + [str(value) for value in self.paginator.position])
+
+    @cached_property
+    def comments(self):
+        return list(reversed(self.paginator.set_page(list(self.queryset))))
+
+    @property
+    def older_url(self):
+        return self.paginator.get_next_link() if self.comments else None
+
+    @property
+    def newer_url(self):
+        return self.paginator.get_previous_link() if self.comments else None
+
+
+class TicketDetailView(TicketObjectMixin, UserPassesTestMixin, DetailView):
     model = Ticket
+    ticket_queryset = Ticket.objects.select_related('user')
     template_name = 'helpdesk/ticket_detail.html'
     comment_form = CommentCreateForm
     accept_form = ChangeTicketStatusForm(initial={'status': Ticket.PROCESSED_STATUS})
@@ -104,37 +187,40 @@ class TicketDetailView(UserPassesTestMixin, DetailView):
     restore_form = ChangeTicketStatusForm(initial={'status': Ticket.RESTORED_STATUS})
 
     def test_func(self):
-        ticket = self.get_object()
+        ticket = self.get_ticket()
         user = self.request.user
-        return ticket.user == user or user.is_staff
+        return ticket.user_id == user.id or user.is_staff
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        context['ticket_version'] = get_ticket_version(self.object.pk)
+        context['ticket_cache_timeout'] = TICKET_CACHE_TIMEOUT
+        context['comments_page'] = CommentPage(self.object, self.request)
         ticket_status = self.object.status
         user_is_admin = self.request.user.is_staff
+        allowed_statuses = get_allowed_statuses(ticket_status, user_is_admin)
 
         if ticket_status == Ticket.ACTIVE_STATUS:
             context['comment_form'] = self.comment_form
 
-        if ticket_status in [Ticket.ACTIVE_STATUS, Ticket.RESTORED_STATUS] and user_is_admin:
+        if Ticket.PROCESSED_STATUS in allowed_statuses:
             self.accept_form.fields['comment'].widget = forms.HiddenInput()
             context['accept_form'] = self.accept_form
 
-            if ticket_status == Ticket.ACTIVE_STATUS:
-                self.reject_form.fields['comment'].required = True
+        if Ticket.REJECTED_STATUS in allowed_statuses:
+            transition = get_transition(ticket_status, Ticket.REJECTED_STATUS, user_is_admin)
+            self.reject_form.fields['comment'].required = transition.comment_required
+            if transition.comment_required:
                 self.reject_form.fields['comment'].widget = forms.Textarea()
-                context['reject_form'] = self.reject_form
-
-            elif ticket_status == Ticket.RESTORED_STATUS:
-                self.reject_form.fields['comment'].required = False
+            else:
                 self.reject_form.fields['comment'].widget = forms.HiddenInput()
-                context['reject_form'] = self.reject_form
+            context['reject_form'] = self.reject_form
 
-        if ticket_status == Ticket.PROCESSED_STATUS and user_is_admin:
+        if Ticket.COMPLETED_STATUS in allowed_statuses:
             self.complete_form.fields['comment'].widget = forms.HiddenInput()
             context['complete_form'] = self.complete_form
 
-        if ticket_status == Ticket.REJECTED_STATUS and not user_is_admin:
+        if Ticket.RESTORED_STATUS in allowed_statuses:
             context['restore_form'] = self.restore_form
         return context
 
@@ -145,34 +231,15 @@ class ChangeTicketStatusView(LoginRequiredMixin, UpdateView):
     success_url = reverse_lazy('home')
 
     def form_valid(self, form):
-        ticket = Ticket.objects.get(id=self.object.pk)
-        current_status = ticket.status
-        changed_status = form.cleaned_data.get('status')
-        comment = form.cleaned_data.get('comment')
-
-        if changed_status == Ticket.RESTORED_STATUS and comment:
-            with transaction.atomic():
-                form.save()
-                Comment.objects.create(author=self.request.user,
-                                       ticket=self.object,
-                                       topic=Comment.RESTORE_TOPIC,
-                                       body=comment)
-            return HttpResponseRedirect(self.success_url)
-
-        if changed_status == Ticket.REJECTED_STATUS and current_status == Ticket.ACTIVE_STATUS:
-            with transaction.atomic():
-                form.save()
-                Comment.objects.create(author=self.request.user,
-                                       ticket=self.object,
-                                       topic=Comment.REJECT_TOPIC,
-                                       body=comment)
-            return HttpResponseRedirect(self.success_url)
-
-        if changed_status == Ticket.REJECTED_STATUS and current_status == Ticket.RESTORED_STATUS:
-            self.object.delete()
-            return HttpResponseRedirect(self.success_url)
-
-        return super().form_valid(form)
+        try:
+            apply_transition(self.object,
+                             form.transition,
+                             form.cleaned_data.get('status'),
+                             self.request.user,
+                             form.cleaned_data.get('comment'))
+        except TransitionConflict:
+            messages.error(self.request, CONFLICT_ERROR)
+        return HttpResponseRedirect(self.success_url)
 
     def form_invalid(self, form):
         error_list = form.errors.get('status')
@@ -186,7 +253,7 @@ class ChangeTicketStatusView(LoginRequiredMixin, UpdateView):
         return kwargs
 
 
-class CommentCreateView(LoginRequiredMixin, CreateView):
+class CommentCreateView(TicketObjectMixin, LoginRequiredMixin, CreateView):
     form_class = CommentCreateForm
 
     def form_valid(self, form):
@@ -204,9 +271,7 @@ class CommentCreateView(LoginRequiredMixin, CreateView):
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
-        ticket_id = self.kwargs.get('pk')
-        ticket = Ticket.objects.get(id=ticket_id)
-        kwargs['ticket'] = ticket
+        kwargs['ticket'] = self.get_ticket()
         kwargs['request'] = self.request
         return kwargs
 